@@ -5,10 +5,28 @@ Uses crawl_tool to extract real-time cryptocurrency prices in Toman
 import logging
 import re
 from datetime import datetime, timezone
-from typing import Dict, Optional
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:  # lxml is optional - the streaming tokenizer is used instead
+    lxml = None
+
+# Compiled once; these run for every row of every scrape
+SYMBOL_LINK_RE = re.compile(r'\]\(https://abantether\.com/coin/([A-Z]+)\)')
+SYMBOL_HREF_RE = re.compile(r'/coin/([A-Z]+)')
+BUY_PRICE_RE = re.compile(r'([\d,]+)\s*خرید')
+PERCENT_RE = re.compile(r'([-+]?\d+\.?\d*)\s*%')
+
+if lxml is not None:
+    # Rows that link to a coin page; hrefs and text are read in the same pass
+    COIN_ROWS_XPATH = etree.XPath("//tr[.//a[contains(@href, '/coin/')]]")
+    ROW_HREFS_XPATH = etree.XPath(".//a/@href")
+
 # Coin mapping
 COIN_MAP = {
     'BTC': {'id': 'bitcoin', 'name': 'Bitcoin', 'symbol': 'BTC'},
@@ -31,6 +49,8 @@ COIN_MAP = {
     'DAI': {'id': 'dai', 'name': 'Dai', 'symbol': 'DAI'},
     'XLM': {'id': 'stellar', 'name': 'Stellar', 'symbol': 'XLM'},
     'BCH': {'id': 'bitcoin-cash', 'name': 'Bitcoin Cash', 'symbol': 'BCH'},
+    'MATIC': {'id': 'matic-network', 'name': 'Polygon', 'symbol': 'MATIC'},
+    'ETC': {'id': 'ethereum-classic', 'name': 'Ethereum Classic', 'symbol': 'ETC'},
 }
 
 def parse_abantether_prices(markdown_content: str) -> Dict:
@@ -53,7 +73,7 @@ def parse_abantether_prices(markdown_content: str) -> Dict:
             
             try:
                 # Extract symbol from the line
-                symbol_match = re.search(r'\]\(https://abantether\.com/coin/([A-Z]+)\)', line)
+                symbol_match = SYMBOL_LINK_RE.search(line)
                 if not symbol_match:
                     continue
                 
@@ -66,7 +86,7 @@ def parse_abantether_prices(markdown_content: str) -> Dict:
                 
                 # Extract buy price (first number before "خرید")
                 # Format: 12,959,940,780 خرید or 115,090 خرید
-                price_match = re.search(r'([\d,]+)\s*خرید', line)
+                price_match = BUY_PRICE_RE.search(line)
                 if not price_match:
                     continue
                 
@@ -75,7 +95,7 @@ def parse_abantether_prices(markdown_content: str) -> Dict:
                 
                 # Extract 24h change (percentage)
                 # Format: -6.38% or 0.19%
-                change_match = re.search(r'([-+]?\d+\.?\d*)\s*%', line)
+                change_match = PERCENT_RE.search(line)
                 change_24h = 0
                 if change_match:
                     change_24h = float(change_match.group(1))
@@ -102,6 +122,103 @@ def parse_abantether_prices(markdown_content: str) -> Dict:
         logger.error(f"Error parsing Abantether markdown: {str(e)}")
         return {}
 
+def _table_region(html: str) -> str:
+    """The span from the first <table to the last </table>, or the whole page"""
+    start = html.find('<table')
+    end = html.rfind('</table>')
+    if start == -1 or end == -1:
+        return html
+    return html[start:end + len('</table>')]
+
+def _parse_row(hrefs: List[str], row_text: str, timestamp: str) -> Optional[Tuple[str, Dict]]:
+    """One coin row of the coins table -> (coin_id, price entry)"""
+    symbol = None
+    for href in hrefs:
+        symbol_match = SYMBOL_HREF_RE.search(href)
+        if symbol_match:
+            symbol = symbol_match.group(1)
+            break
+    if symbol not in COIN_MAP:
+        return None
+    
+    # Buy price (خرید)
+    price_match = BUY_PRICE_RE.search(row_text)
+    if not price_match:
+        return None
+    
+    # The 2nd percentage is the daily change when the row has several
+    changes = PERCENT_RE.findall(row_text)
+    change_24h = float(changes[1] if len(changes) >= 2 else changes[0]) if changes else 0
+    
+    coin_info = COIN_MAP[symbol]
+    return coin_info['id'], {
+        'symbol': symbol,
+        'name': coin_info['name'],
+        'price_tmn': float(price_match.group(1).replace(',', '')),
+        'change_24h': change_24h,
+        'last_updated': timestamp,
+        'source': 'abantether'
+    }
+
+class _CoinRowTokenizer(HTMLParser):
+    """Collects (hrefs, text) of every <tr> without building a tree"""
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows: List[Tuple[List[str], str]] = []
+        self._hrefs: Optional[List[str]] = None
+        self._text: List[str] = []
+    
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self._hrefs, self._text = [], []
+        elif tag == 'a' and self._hrefs is not None:
+            href = dict(attrs).get('href')
+            if href:
+                self._hrefs.append(href)
+    
+    def handle_endtag(self, tag):
+        if tag == 'tr' and self._hrefs is not None:
+            if self._hrefs:
+                self.rows.append((self._hrefs, ''.join(self._text)))
+            self._hrefs = None
+    
+    def handle_data(self, data):
+        if self._hrefs is not None:
+            self._text.append(data)
+
+def _coin_rows(html: str, use_lxml: bool = True) -> List[Tuple[List[str], str]]:
+    region = _table_region(html)
+    if use_lxml and lxml is not None:
+        document = lxml.html.fromstring(region)
+        return [(ROW_HREFS_XPATH(row), row.text_content()) for row in COIN_ROWS_XPATH(document)]
+    
+    tokenizer = _CoinRowTokenizer()
+    tokenizer.feed(region)
+    tokenizer.close()
+    return tokenizer.rows
+
+def parse_abantether_html(html: str, use_lxml: bool = True) -> Dict:
+    """
+    Parse cryptocurrency prices from the abantether.com/coins HTML page
+    
+    Only the price table is parsed, with lxml when installed and a
+    streaming tokenizer otherwise. CPU bound - call it off the event loop.
+    """
+    prices = {}
+    timestamp = datetime.now(timezone.utc).isoformat()
+    
+    for hrefs, row_text in _coin_rows(html, use_lxml):
+        try:
+            parsed = _parse_row(hrefs, row_text, timestamp)
+        except ValueError as e:
+            logger.debug(f"Error parsing row: {str(e)}")
+            continue
+        if parsed:
+            prices[parsed[0]] = parsed[1]
+    
+    return prices
+
 async def fetch_abantether_prices_with_crawl() -> Dict:
     """
     Fetch prices from Abantether using crawl_tool integration
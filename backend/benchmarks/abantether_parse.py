@@ -0,0 +1,76 @@
+"""
+Abantether Parser Benchmark
+Times the coins page parsers over saved HTML fixtures: the former
+BeautifulSoup/html.parser scrape against the lxml and tokenizer fast paths
+
+Usage: python benchmarks/abantether_parse.py --repeat 50
+"""
+import argparse
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bs4 import BeautifulSoup
+from abantether_scraper import COIN_MAP, lxml, parse_abantether_html
+
+FIXTURES = Path(__file__).resolve().parent / 'fixtures'
+
+def parse_with_soup(html: str) -> dict:
+    """The scrape as it was before the fast path, for comparison"""
+    prices = {}
+    for row in BeautifulSoup(html, 'html.parser').find_all('tr'):
+        link = row.find('a', href=re.compile(r'/coin/[A-Z]+'))
+        if not link:
+            continue
+        symbol = re.search(r'/coin/([A-Z]+)', link.get('href', '')).group(1)
+        if symbol not in COIN_MAP:
+            continue
+        row_text = row.get_text()
+        price_match = re.search(r'([\d,]+)\s*خرید', row_text)
+        if not price_match:
+            continue
+        changes = re.findall(r'([-+]?\d+\.?\d*)\s*%', row_text)
+        prices[COIN_MAP[symbol]['id']] = {
+            'price_tmn': float(price_match.group(1).replace(',', '')),
+            'change_24h': float(changes[1] if len(changes) >= 2 else changes[0]) if changes else 0
+        }
+    return prices
+
+def time_parser(parse, html: str, repeat: int) -> float:
+    """Best-of-repeat milliseconds per page"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parse(html)
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+def run(repeat: int):
+    parsers = {
+        'bs4 html.parser': parse_with_soup,
+        'tokenizer': lambda html: parse_abantether_html(html, use_lxml=False),
+    }
+    if lxml is not None:
+        parsers['lxml'] = parse_abantether_html
+
+    for fixture in sorted(FIXTURES.glob('abantether_*.html')):
+        html = fixture.read_text(encoding='utf-8')
+        expected = {
+            coin_id: (entry['price_tmn'], entry['change_24h'])
+            for coin_id, entry in parse_abantether_html(html, use_lxml=False).items()
+        }
+        print(f"{fixture.name}: {len(html.encode('utf-8')) / 1024:,.0f} KiB, {len(expected)} coins")
+
+        for name, parse in parsers.items():
+            parsed = parse(html)
+            matches = {coin_id: (entry['price_tmn'], entry['change_24h']) for coin_id, entry in parsed.items()} == expected
+            print(f"  {name:<16} {time_parser(parse, html, repeat):8.2f} ms/page  {'ok' if matches else 'MISMATCH'}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20, help='parses per fixture and parser (best time is reported)')
+    args = parser.parse_args()
+    run(args.repeat)
@@ -0,0 +1,71 @@
+"""
+DCA Timing Wheel Benchmark
+Schedules strategies across the executor's lookahead window and advances the
+wheel tick by tick through it, next to the same number of sleeping asyncio
+tasks, and reports time and memory of both
+
+Usage: python benchmarks/dca_timing_wheel.py --strategies 100000 --lookahead 3600
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dca_executor import TimingWheel
+
+def measure_wheel(deadlines, start: float, lookahead: int):
+    tracemalloc.start()
+    began = time.perf_counter()
+    wheel = TimingWheel(1.0, now=start)
+    for key, deadline in enumerate(deadlines):
+        wheel.schedule(key, deadline)
+    scheduled = time.perf_counter() - began
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    began = time.perf_counter()
+    fired = 0
+    for second in range(1, lookahead + 2):
+        fired += len(wheel.advance(start + second))
+    advanced = time.perf_counter() - began
+    return scheduled, advanced, memory, fired
+
+async def measure_tasks(count: int):
+    tracemalloc.start()
+    began = time.perf_counter()
+    tasks = [asyncio.create_task(asyncio.sleep(3600)) for _ in range(count)]
+    await asyncio.sleep(0)
+    created = time.perf_counter() - began
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return created, memory
+
+async def run(strategies: int, lookahead: int):
+    start = time.time()
+    deadlines = [start + random.uniform(0, lookahead) for _ in range(strategies)]
+
+    scheduled, advanced, wheel_memory, fired = measure_wheel(deadlines, start, lookahead)
+    print(f"Timing wheel: scheduled {strategies:,} in {scheduled * 1000:.0f} ms, "
+          f"advanced {lookahead:,} ticks in {advanced * 1000:.0f} ms ({fired:,} fired), "
+          f"{wheel_memory / 1024 / 1024:.1f} MiB")
+
+    created, task_memory = await measure_tasks(strategies)
+    print(f"Sleeping tasks: created {strategies:,} in {created * 1000:.0f} ms, {task_memory / 1024 / 1024:.1f} MiB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--strategies', type=int, default=100000)
+    parser.add_argument('--lookahead', type=int, default=3600, help='seconds of schedule to advance through')
+    args = parser.parse_args()
+    asyncio.run(run(args.strategies, args.lookahead))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Order Book Benchmark
+Drives the matching engine in memory with a random mix of new limit orders,
+cancellations and price ticks and reports order operations per second on
+one core (journal entries are buffered, not flushed)
+
+Usage: python benchmarks/order_book_ops.py --operations 200000
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from order_book import MatchingEngine
+
+def orders(count: int, coins: int):
+    for _ in range(count):
+        yield {
+            'id': uuid.uuid4().hex,
+            'user_id': f"user-{random.randrange(1000)}",
+            'coin_id': f"coin-{random.randrange(coins)}",
+            'coin_symbol': 'BTC',
+            'order_type': random.choice(('limit_buy', 'limit_sell')),
+            'amount_crypto': random.uniform(0.01, 2),
+            'target_price_tmn': round(random.gauss(100000, 500)),
+        }
+
+async def run(operations: int, coins: int, cancel_ratio: float, tick_ratio: float):
+    engine = MatchingEngine(db=None, settlement=None)
+    engine._loaded = True
+
+    # Pre-generate the workload so only engine time is measured
+    workload, resting = [], []
+    for document in orders(operations, coins):
+        roll = random.random()
+        if roll < tick_ratio:
+            workload.append(('tick', {document['coin_id']: {'price_tmn': round(random.gauss(100000, 800))}}))
+        elif roll < tick_ratio + cancel_ratio and resting:
+            workload.append(('cancel', resting.pop(random.randrange(len(resting)))))
+        else:
+            workload.append(('submit', document))
+            resting.append(document['id'])
+
+    started = time.perf_counter()
+    for kind, payload in workload:
+        if kind == 'submit':
+            engine.submit(payload)
+        elif kind == 'cancel':
+            engine.cancel(payload)
+        else:
+            await engine.on_prices(payload)
+    elapsed = time.perf_counter() - started
+
+    stats = engine.get_stats()
+    print(f"operations:      {len(workload):,} ({sum(kind == 'submit' for kind, _ in workload):,} orders, "
+          f"{sum(kind == 'cancel' for kind, _ in workload):,} cancels, {sum(kind == 'tick' for kind, _ in workload):,} ticks)")
+    print(f"fills:           {stats['fills']:,}, resting afterwards: {stats['resting_orders']:,} in {stats['books']} books")
+    print(f"journal pending: {stats['journal_pending']:,}")
+    print(f"throughput:      {len(workload) / elapsed:,.0f} ops/s")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--operations', type=int, default=200000)
+    parser.add_argument('--coins', type=int, default=15, help='distinct order books')
+    parser.add_argument('--cancel-ratio', type=float, default=0.3)
+    parser.add_argument('--tick-ratio', type=float, default=0.05)
+    args = parser.parse_args()
+    asyncio.run(run(args.operations, args.coins, args.cancel_ratio, args.tick_ratio))
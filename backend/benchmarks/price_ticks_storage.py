@@ -0,0 +1,58 @@
+"""
+Price Tick Storage Benchmark
+Writes synthetic ticks into a scratch database and extrapolates the storage
+footprint of one year of crypto_price_ticks
+
+Usage: MONGO_URL=mongodb://localhost:27017 python benchmarks/price_ticks_storage.py --days 7
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from price_book import STATIC_PRICES
+from price_history import TICKS_COLLECTION, ensure_price_history, store_price_snapshot, get_tick_storage_stats
+
+async def run(days: int, interval: int, database: str):
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    db = client[database]
+    await db.drop_collection(TICKS_COLLECTION)
+    await db.drop_collection('crypto_prices')
+    time_series = await ensure_price_history(db, retention_days=0)
+
+    prices = {coin_id: dict(data) for coin_id, data in STATIC_PRICES.items()}
+    start = datetime.now(timezone.utc) - timedelta(days=days)
+    ticks_per_coin = days * 24 * 60 * 60 // interval
+
+    for step in range(ticks_per_coin):
+        for data in prices.values():
+            data['price_tmn'] *= 1 + random.gauss(0, 0.001)
+            data['last_updated'] = None
+        await store_price_snapshot(db, prices, 'benchmark', timestamp=start + timedelta(seconds=step * interval))
+
+    stats = await get_tick_storage_stats(db)
+    ticks_per_year = len(prices) * 365 * 24 * 60 * 60 // interval
+    year_bytes = stats['bytes_per_tick'] * ticks_per_year
+
+    print(f"time-series collection: {time_series}")
+    print(f"ticks written:          {stats['ticks']:,} ({len(prices)} coins every {interval}s for {days} days)")
+    print(f"storage / index bytes:  {stats['storage_bytes']:,} / {stats['index_bytes']:,}")
+    print(f"bytes per tick:         {stats['bytes_per_tick']}")
+    print(f"one year of ticks:      {ticks_per_year:,} ticks, ~{year_bytes / 1024 / 1024:,.1f} MiB")
+
+    await client.drop_database(database)
+    client.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--days', type=int, default=7, help='days of synthetic ticks to write')
+    parser.add_argument('--interval', type=int, default=60, help='seconds between ticks')
+    parser.add_argument('--database', default='price_ticks_benchmark', help='scratch database (dropped afterwards)')
+    args = parser.parse_args()
+    asyncio.run(run(args.days, args.interval, args.database))
@@ -0,0 +1,115 @@
+"""
+Settlement Throughput Benchmark
+Approves buy orders concurrently in a scratch database, submitting every
+approval twice, and checks that balances and holdings match a serial run;
+--bulk settles the same backlog through settle_many instead
+
+Usage: MONGO_URL=mongodb://localhost:27017 python benchmarks/settlement_throughput.py --orders 2000 [--bulk]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from db_indexes import INDEXES
+from settlement import SettlementEngine
+
+async def seed(db, users: int, orders: int, coins: int):
+    """Users with a large balance and random pending buy orders; returns the expected end state"""
+    user_ids = [str(uuid.uuid4()) for _ in range(users)]
+    await db.users.insert_many([{'id': user_id, 'wallet_balance_tmn': 10 ** 12} for user_id in user_ids])
+    await db.user_holdings.create_indexes(INDEXES['user_holdings'])
+
+    documents, spent, bought = [], {}, {}
+    for _ in range(orders):
+        user_id, coin = random.choice(user_ids), f"C{random.randrange(coins)}"
+        price, amount_tmn = float(random.randint(1, 1000)), float(random.randint(1000, 100000))
+        documents.append({
+            'id': str(uuid.uuid4()), 'user_id': user_id, 'order_type': 'buy', 'status': 'pending',
+            'coin_symbol': coin, 'coin_id': coin.lower(), 'amount_tmn': amount_tmn, 'price_at_order': price,
+            'created_at': datetime.now(timezone.utc)
+        })
+        spent[user_id] = spent.get(user_id, 0) + amount_tmn
+        amount, cost = bought.get((user_id, coin), (0.0, 0.0))
+        bought[(user_id, coin)] = (amount + amount_tmn / price, cost + amount_tmn)
+    await db.trading_orders.insert_many(documents)
+    return [document['id'] for document in documents], spent, bought
+
+async def verify(db, spent, bought) -> int:
+    """Number of users or holdings that differ from the serial result"""
+    mismatches = 0
+    async for user in db.users.find({}, {'_id': 0}):
+        if abs(10 ** 12 - user['wallet_balance_tmn'] - spent.get(user['id'], 0)) > 1e-3:
+            mismatches += 1
+
+    holdings = await db.user_holdings.find({}, {'_id': 0}).to_list(None)
+    if len(holdings) != len(bought):
+        mismatches += abs(len(holdings) - len(bought))
+    for holding in holdings:
+        amount, cost = bought.get((holding['user_id'], holding['coin_symbol']), (0.0, 0.0))
+        if abs(holding['amount'] - amount) > 1e-6 or abs(holding['average_buy_price_tmn'] - cost / amount) > 1e-6:
+            mismatches += 1
+    return mismatches
+
+async def run(users: int, orders: int, coins: int, concurrency: int, transactions, database: str,
+              bulk: bool, batch_size: int):
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    await client.drop_database(database)
+    db = client[database]
+
+    order_ids, spent, bought = await seed(db, users, orders, coins)
+    engine = SettlementEngine(db, transactions=transactions)
+    await engine.supports_transactions()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def approve(order_id):
+        async with semaphore:
+            await engine.settle(order_id, 'approve')
+
+    async def approve_batch(batch):
+        async with semaphore:
+            await engine.settle_many(batch, 'approve', batch_size=batch_size)
+
+    # Every order is approved twice, concurrently, to exercise the claim
+    submitted = order_ids * 2
+    random.shuffle(submitted)
+    if bulk:
+        submissions = [approve_batch(submitted[start:start + batch_size]) for start in range(0, len(submitted), batch_size)]
+    else:
+        submissions = [approve(order_id) for order_id in submitted]
+    started = time.perf_counter()
+    await asyncio.gather(*submissions)
+    elapsed = time.perf_counter() - started
+
+    stats = engine.get_stats()
+    print(f"mode:              {f'settle_many, batches of {batch_size}' if bulk else 'settle per order'}")
+    print(f"transactions:      {stats['transactions']}")
+    print(f"orders settled:    {stats['settled']:,} of {orders:,} ({stats['duplicate_claims']:,} duplicate approvals ignored)")
+    print(f"throughput:        {stats['settled'] / elapsed:,.0f} orders/s at concurrency {concurrency}")
+    print(f"state mismatches:  {await verify(db, spent, bought)}")
+
+    await client.drop_database(database)
+    client.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=50, help='users sharing the orders (fewer means more contention)')
+    parser.add_argument('--orders', type=int, default=2000, help='pending buy orders to approve')
+    parser.add_argument('--coins', type=int, default=5, help='distinct coins bought')
+    parser.add_argument('--concurrency', type=int, default=64, help='approvals in flight at once')
+    parser.add_argument('--transactions', choices=['auto', 'true', 'false'], default='auto')
+    parser.add_argument('--bulk', action='store_true', help='settle through settle_many instead of one call per order')
+    parser.add_argument('--batch-size', type=int, default=500, help='orders per settle_many batch')
+    parser.add_argument('--database', default='settlement_benchmark', help='scratch database (dropped afterwards)')
+    args = parser.parse_args()
+    transactions = {'true': True, 'false': False}.get(args.transactions)
+    asyncio.run(run(args.users, args.orders, args.coins, args.concurrency, transactions, args.database,
+                    args.bulk, args.batch_size))
@@ -0,0 +1,214 @@
+"""
+OHLCV Candle Builder
+Builds 1m/5m/1h/1d Toman candles incrementally from the price tick stream and
+stores them column-wise, one document per coin, interval and time chunk
+"""
+import logging
+import math
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from pymongo import UpdateOne
+
+from price_history import TICKS_COLLECTION, TICK_TIME_FIELD, TICK_META_FIELD
+
+logger = logging.getLogger(__name__)
+
+CANDLES_COLLECTION = 'crypto_candles'
+
+# interval -> (candle length, chunk length) in seconds; a chunk is one document
+INTERVALS = {
+    '1m': (60, 24 * 60 * 60),
+    '5m': (5 * 60, 7 * 24 * 60 * 60),
+    '1h': (60 * 60, 30 * 24 * 60 * 60),
+    '1d': (24 * 60 * 60, 366 * 24 * 60 * 60),
+}
+
+# Column arrays per chunk: open, high, low, close and tick count (volume proxy)
+COLUMNS = ('o', 'h', 'l', 'c', 'v')
+
+def _epoch(moment: datetime) -> int:
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+def _chunk_id(coin_id: str, interval: str, chunk_start: int) -> str:
+    return f"{coin_id}:{interval}:{chunk_start}"
+
+def pick_interval(days: float) -> str:
+    """Coarsest interval that still gives a useful number of points for the range"""
+    if days <= 1:
+        return '5m'
+    if days <= 14:
+        return '1h'
+    return '1d'
+
+def downsample(candles: List[Dict], max_points: int) -> List[Dict]:
+    """Merge consecutive candles so at most max_points remain"""
+    if max_points <= 0 or len(candles) <= max_points:
+        return candles
+
+    size = math.ceil(len(candles) / max_points)
+    merged = []
+    for start in range(0, len(candles), size):
+        group = candles[start:start + size]
+        merged.append({
+            't': group[0]['t'],
+            'o': group[0]['o'],
+            'h': max(candle['h'] for candle in group),
+            'l': min(candle['l'] for candle in group),
+            'c': group[-1]['c'],
+            'v': sum(candle['v'] for candle in group),
+        })
+    return merged
+
+class CandleBuilder:
+    """Keeps the open candle of every coin/interval in memory and writes it through"""
+
+    def __init__(self, db, intervals: Optional[Dict[str, Tuple[int, int]]] = None):
+        self.db = db
+        self.intervals = intervals or INTERVALS
+        # (coin_id, interval) -> [candle start, o, h, l, c, v]
+        self._open: Dict[Tuple[str, str], List] = {}
+        # (coin_id, interval) -> start of the chunk known to be preallocated
+        self._chunks: Dict[Tuple[str, str], int] = {}
+
+    def _chunk_setup(self, coin_id: str, interval: str, chunk_start: int) -> Optional[UpdateOne]:
+        """Preallocate the column arrays of a chunk the first time it is written"""
+        if self._chunks.get((coin_id, interval)) == chunk_start:
+            return None
+
+        self._chunks[(coin_id, interval)] = chunk_start
+        step, chunk_length = self.intervals[interval]
+        slots = chunk_length // step
+        return UpdateOne(
+            {'_id': _chunk_id(coin_id, interval, chunk_start)},
+            {'$setOnInsert': {
+                'coin_id': coin_id,
+                'interval': interval,
+                'start': datetime.fromtimestamp(chunk_start, timezone.utc),
+                'step': step,
+                **{column: [None] * slots for column in COLUMNS}
+            }},
+            upsert=True
+        )
+
+    def _candle_update(self, coin_id: str, interval: str, candle: List) -> UpdateOne:
+        step, chunk_length = self.intervals[interval]
+        chunk_start = candle[0] - candle[0] % chunk_length
+        slot = (candle[0] - chunk_start) // step
+        return UpdateOne(
+            {'_id': _chunk_id(coin_id, interval, chunk_start)},
+            {'$set': {f'{column}.{slot}': value for column, value in zip(COLUMNS, candle[1:])}}
+        )
+
+    async def add_ticks(self, prices: Dict[str, Dict], timestamp: Optional[datetime] = None):
+        """Fold one tick per coin into every interval's open candle"""
+        now = _epoch(timestamp or datetime.now(timezone.utc))
+        operations = []
+
+        for coin_id, data in prices.items():
+            price = data.get('price_tmn')
+            if not price:
+                continue
+
+            for interval, (step, chunk_length) in self.intervals.items():
+                candle_start = now - now % step
+                candle = self._open.get((coin_id, interval))
+
+                if candle is None or candle[0] != candle_start:
+                    candle = [candle_start, price, price, price, price, 0]
+                    self._open[(coin_id, interval)] = candle
+                candle[2] = max(candle[2], price)
+                candle[3] = min(candle[3], price)
+                candle[4] = price
+                candle[5] += 1
+
+                setup = self._chunk_setup(coin_id, interval, candle_start - candle_start % chunk_length)
+                if setup:
+                    operations.append(setup)
+                operations.append(self._candle_update(coin_id, interval, candle))
+
+        if operations:
+            # Ordered so a chunk is preallocated before its slots are set
+            await self.db[CANDLES_COLLECTION].bulk_write(operations, ordered=True)
+
+    async def backfill(self, since: Optional[datetime] = None):
+        """Recompute candles from crypto_price_ticks
+
+        Without since, only each interval's currently open candle is rebuilt,
+        which restores in-memory state after a restart.
+        """
+        now = _epoch(datetime.now(timezone.utc))
+
+        for interval, (step, chunk_length) in self.intervals.items():
+            start = _epoch(since) if since else now - now % step
+            start -= start % step
+            step_ms = step * 1000
+            time_ms = {'$toLong': f'${TICK_TIME_FIELD}'}
+
+            rows = await self.db[TICKS_COLLECTION].aggregate([
+                {'$match': {TICK_TIME_FIELD: {'$gte': datetime.fromtimestamp(start, timezone.utc)}}},
+                {'$sort': {TICK_TIME_FIELD: 1}},
+                {'$group': {
+                    '_id': {
+                        'coin_id': f'${TICK_META_FIELD}.coin_id',
+                        't': {'$subtract': [time_ms, {'$mod': [time_ms, step_ms]}]}
+                    },
+                    'o': {'$first': '$price_tmn'},
+                    'h': {'$max': '$price_tmn'},
+                    'l': {'$min': '$price_tmn'},
+                    'c': {'$last': '$price_tmn'},
+                    'v': {'$sum': 1}
+                }},
+                {'$sort': {'_id.t': 1}}
+            ]).to_list(None)
+
+            operations = []
+            for row in rows:
+                coin_id = row['_id']['coin_id']
+                candle = [row['_id']['t'] // 1000, row['o'], row['h'], row['l'], row['c'], row['v']]
+                setup = self._chunk_setup(coin_id, interval, candle[0] - candle[0] % chunk_length)
+                if setup:
+                    operations.append(setup)
+                operations.append(self._candle_update(coin_id, interval, candle))
+                self._open[(coin_id, interval)] = candle
+
+            if operations:
+                await self.db[CANDLES_COLLECTION].bulk_write(operations, ordered=True)
+            logger.info(f"✅ Backfilled {len(rows)} {interval} candles")
+
+    async def get_candles(self, coin_id: str, interval: str, since: datetime,
+                          until: Optional[datetime] = None) -> List[Dict]:
+        """Candles of one coin in [since, until] with a single range read"""
+        step, chunk_length = self.intervals[interval]
+        start = _epoch(since)
+        end = _epoch(until) if until else _epoch(datetime.now(timezone.utc))
+
+        chunks = await self.db[CANDLES_COLLECTION].find(
+            {
+                'coin_id': coin_id,
+                'interval': interval,
+                'start': {
+                    '$gte': datetime.fromtimestamp(start - start % chunk_length, timezone.utc),
+                    '$lte': datetime.fromtimestamp(end, timezone.utc)
+                }
+            },
+            {'_id': 0, 'start': 1, **{column: 1 for column in COLUMNS}}
+        ).sort('start', 1).to_list(None)
+
+        candles = []
+        for chunk in chunks:
+            chunk_start = _epoch(chunk['start'])
+            for slot, open_price in enumerate(chunk['o']):
+                t = chunk_start + slot * step
+                if open_price is None or t < start - start % step or t > end:
+                    continue
+                candles.append({
+                    't': t,
+                    'o': open_price,
+                    'h': chunk['h'][slot],
+                    'l': chunk['l'][slot],
+                    'c': chunk['c'][slot],
+                    'v': chunk['v'][slot],
+                })
+        return candles
@@ -1,14 +1,28 @@
 """
 Crypto Price Fetching Service using CoinGecko API
+Every call goes through a per-endpoint circuit breaker and a token bucket
+whose budget is shared by all workers; while CoinGecko is unavailable the
+last good response is served stale
 """
-import httpx
-from typing import List, Dict, Optional
+import asyncio
 import logging
+import random
+import time
+from datetime import datetime, timezone
+from typing import List, Dict, Optional
+from cachetools import LRUCache
+from http_clients import get_http_client
 
 logger = logging.getLogger(__name__)
 
 COINGECKO_BASE_URL = "https://api.coingecko.com/api/v3"
 
+# CoinGecko's public API allows roughly 30 calls per minute
+COINGECKO_CALLS_PER_MINUTE = 30
+COINGECKO_BURST = 5
+# Longest a caller waits for a token before falling back to the last good response
+RATE_LIMIT_MAX_WAIT = 2.0
+
 # Top cryptocurrencies for Iranian market
 TOP_COINS = [
     "bitcoin", "ethereum", "tether", "binancecoin", "ripple",
@@ -16,210 +30,331 @@ TOP_COINS = [
     "usd-coin", "shiba-inu", "avalanche-2", "chainlink", "litecoin"
 ]
 
+class TokenBucket:
+    """Call budget; callers reserve a token and sleep until it is due
+    
+    The bucket paces the calls of this process. With a shared rate limiter
+    (the app's Redis backend) every call also counts against one key all
+    workers use, so together they stay within rate_per_minute.
+    """
+    
+    def __init__(self, rate_per_minute: float, burst: int, shared=None, key: str = "coingecko"):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.shared = shared
+        self.key = key
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self.throttled = 0
+    
+    async def acquire(self, max_wait: float) -> bool:
+        """Take one token, waiting up to max_wait seconds; False when the budget is exhausted"""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        
+        wait = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0
+        if wait > max_wait:
+            self.throttled += 1
+            return False
+        
+        # Reserve before sleeping so concurrent callers queue behind this one
+        self._tokens -= 1
+        if wait > 0:
+            await asyncio.sleep(wait)
+        if self.shared is not None and not await self.shared.hit(self.key, round(self.rate * 60), 60):
+            # Other workers spent this minute's budget
+            self.throttled += 1
+            return False
+        return True
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open single probe -> closed
+    
+    Each consecutive trip doubles the open period (with jitter) up to max_backoff.
+    """
+    
+    def __init__(self, failure_threshold: int = 3, base_backoff: float = 30.0,
+                 max_backoff: float = 600.0, probe_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.probe_timeout = probe_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self._probe_started: Optional[float] = None
+    
+    def allow(self) -> bool:
+        now = time.monotonic()
+        if self.state == "open":
+            if now < self.open_until:
+                return False
+            self.state = "half_open"
+            self._probe_started = None
+        
+        if self.state == "half_open":
+            # One probe at a time; a probe that never reported is retried
+            if self._probe_started is not None and now - self._probe_started < self.probe_timeout:
+                return False
+            self._probe_started = now
+        return True
+    
+    def cancel_probe(self):
+        """Give back the half-open probe allow() granted to a call that was not made"""
+        if self.state == "half_open":
+            self._probe_started = None
+    
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.trips = 0
+        self._probe_started = None
+    
+    def record_failure(self, retry_after: Optional[float] = None):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.trips += 1
+            backoff = min(self.max_backoff, self.base_backoff * 2 ** (self.trips - 1))
+            backoff = random.uniform(backoff / 2, backoff)
+            if retry_after:
+                backoff = max(backoff, retry_after)
+            self.state = "open"
+            self.open_until = time.monotonic() + backoff
+            self._probe_started = None
+            logger.warning(f"⚠️  CoinGecko circuit open for {backoff:.0f}s after {self.failures} failures")
+    
+    def get_status(self) -> Dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "trips": self.trips,
+            "retry_in_seconds": round(max(0.0, self.open_until - time.monotonic()), 1) if self.state == "open" else 0
+        }
+
 class CryptoPriceService:
     """Fetch and manage cryptocurrency prices"""
     
-    async def get_prices(self, coins: Optional[List[str]] = None, vs_currency: str = "usd"):
-        """Get current prices for multiple cryptocurrencies"""
-        try:
-            coin_ids = ",".join(coins or TOP_COINS)
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{COINGECKO_BASE_URL}/simple/price",
-                    params={
-                        "ids": coin_ids,
-                        "vs_currencies": vs_currency,
-                        "include_24hr_change": "true",
-                        "include_24hr_vol": "true",
-                        "include_market_cap": "true"
-                    },
-                    timeout=10.0
-                )
+    def __init__(self, calls_per_minute: float = COINGECKO_CALLS_PER_MINUTE,
+                 burst: int = COINGECKO_BURST, max_wait: float = RATE_LIMIT_MAX_WAIT):
+        self.bucket = TokenBucket(calls_per_minute, burst)
+        self.max_wait = max_wait
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        # (path, params) -> (fetched at, JSON body) of the last good response
+        self._last_good = LRUCache(maxsize=512)
+        self.stale_served = 0
+    
+    def share_budget(self, limiter):
+        """Count every call against a rate limiter shared by all workers"""
+        self.bucket.shared = limiter
+    
+    async def _fetch(self, endpoint: str, path: str, params: Optional[Dict] = None) -> Optional[Dict]:
+        """GET a CoinGecko path through the endpoint's breaker and the shared bucket
+        
+        Returns {"status", "data", "stale", "as_of"}; on failure the last good
+        response is returned with stale=True, or None when there is none.
+        """
+        breaker = self.breakers.setdefault(endpoint, CircuitBreaker())
+        key = (path, tuple(sorted((params or {}).items())))
+        
+        allowed = breaker.allow()
+        if allowed and not await self.bucket.acquire(self.max_wait):
+            # Throttled - a half-open probe must not block the next one for probe_timeout
+            breaker.cancel_probe()
+            allowed = False
+        
+        if allowed:
+            try:
+                client = get_http_client('coingecko')
+                response = await client.get(f"{COINGECKO_BASE_URL}{path}", params=params)
                 
                 if response.status_code == 200:
-                    return {
-                        "success": True,
-                        "data": response.json()
-                    }
-                elif response.status_code == 429:
-                    # Rate limited - return mock data for testing
-                    logger.warning("CoinGecko rate limited, returning mock data")
-                    return self._get_mock_prices(coins or TOP_COINS)
+                    breaker.record_success()
+                    data = response.json()
+                    self._last_good[key] = (datetime.now(timezone.utc), data)
+                    return {"status": 200, "data": data, "stale": False, "as_of": None}
+                elif response.status_code == 429 or response.status_code >= 500:
+                    retry_after = response.headers.get("retry-after", "")
+                    breaker.record_failure(float(retry_after) if retry_after.isdigit() else None)
+                    logger.warning(f"CoinGecko {endpoint} returned {response.status_code}")
                 else:
-                    return {
-                        "success": False,
-                        "error": "Failed to fetch prices"
-                    }
-        except Exception as e:
-            logger.error(f"Error fetching prices: {str(e)}")
-            # Return mock data on error for testing
+                    # The upstream is healthy, the request itself was rejected
+                    breaker.record_success()
+                    return {"status": response.status_code, "data": None, "stale": False, "as_of": None}
+            except Exception as e:
+                breaker.record_failure()
+                logger.error(f"Error calling CoinGecko {endpoint}: {str(e)}")
+        
+        cached = self._last_good.get(key)
+        if cached is None:
+            return None
+        
+        self.stale_served += 1
+        fetched_at, data = cached
+        return {"status": 200, "data": data, "stale": True, "as_of": fetched_at.isoformat()}
+    
+    @staticmethod
+    def _freshness(result: Dict) -> Dict:
+        """Staleness fields added to successful responses"""
+        return {"stale": result["stale"], "as_of": result["as_of"]} if result["stale"] else {"stale": False}
+    
+    async def get_prices(self, coins: Optional[List[str]] = None, vs_currency: str = "usd"):
+        """Get current prices for multiple cryptocurrencies"""
+        result = await self._fetch("simple_price", "/simple/price", {
+            "ids": ",".join(coins or TOP_COINS),
+            "vs_currencies": vs_currency,
+            "include_24hr_change": "true",
+            "include_24hr_vol": "true",
+            "include_market_cap": "true"
+        })
+        
+        if result is None:
+            # Unavailable and nothing cached - return mock data for testing
+            logger.warning("CoinGecko unavailable, returning mock data")
             return self._get_mock_prices(coins or TOP_COINS)
+        if result["status"] != 200:
+            return {
+                "success": False,
+                "error": "Failed to fetch prices"
+            }
+        
+        return {
+            "success": True,
+            "data": result["data"],
+            **self._freshness(result)
+        }
     
     async def get_coin_details(self, coin_id: str):
         """Get detailed information about a specific coin"""
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{COINGECKO_BASE_URL}/coins/{coin_id}",
-                    params={
-                        "localization": "false",
-                        "tickers": "false",
-                        "community_data": "false",
-                        "developer_data": "false"
-                    },
-                    timeout=10.0
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    
-                    # Extract relevant data
-                    market_data = data.get("market_data", {})
-                    
-                    return {
-                        "success": True,
-                        "data": {
-                            "id": data.get("id"),
-                            "symbol": data.get("symbol", "").upper(),
-                            "name": data.get("name"),
-                            "image": data.get("image", {}).get("large"),
-                            "market_data": {
-                                "current_price": {"usd": market_data.get("current_price", {}).get("usd", 0)},
-                                "market_cap": market_data.get("market_cap", {}).get("usd", 0),
-                                "total_volume": market_data.get("total_volume", {}).get("usd", 0),
-                                "high_24h": market_data.get("high_24h", {}).get("usd", 0),
-                                "low_24h": market_data.get("low_24h", {}).get("usd", 0),
-                                "price_change_percentage_24h": market_data.get("price_change_percentage_24h", 0),
-                                "price_change_percentage_7d": market_data.get("price_change_percentage_7d", 0),
-                                "price_change_percentage_30d": market_data.get("price_change_percentage_30d", 0),
-                                "circulating_supply": market_data.get("circulating_supply", 0),
-                                "total_supply": market_data.get("total_supply", 0),
-                                "ath": market_data.get("ath", {}).get("usd", 0),
-                                "atl": market_data.get("atl", {}).get("usd", 0),
-                            }
-                        }
-                    }
-                elif response.status_code == 429:
-                    # Rate limited - return mock data
-                    logger.warning(f"CoinGecko rate limited for {coin_id}, returning mock data")
-                    return self._get_mock_coin_details(coin_id)
-                else:
-                    return {
-                        "success": False,
-                        "error": "Coin not found"
-                    }
-        except Exception as e:
-            logger.error(f"Error fetching coin details: {str(e)}")
-            # Return mock data on error for testing
+        result = await self._fetch("coins", f"/coins/{coin_id}", {
+            "localization": "false",
+            "tickers": "false",
+            "community_data": "false",
+            "developer_data": "false"
+        })
+        
+        if result is None:
+            # Unavailable and nothing cached - return mock data
+            logger.warning(f"CoinGecko unavailable for {coin_id}, returning mock data")
             return self._get_mock_coin_details(coin_id)
+        if result["status"] != 200:
+            return {
+                "success": False,
+                "error": "Coin not found"
+            }
+        
+        data = result["data"]
+        
+        # Extract relevant data
+        market_data = data.get("market_data", {})
+        
+        return {
+            "success": True,
+            "data": {
+                "id": data.get("id"),
+                "symbol": data.get("symbol", "").upper(),
+                "name": data.get("name"),
+                "image": data.get("image", {}).get("large"),
+                "market_data": {
+                    "current_price": {"usd": market_data.get("current_price", {}).get("usd", 0)},
+                    "market_cap": market_data.get("market_cap", {}).get("usd", 0),
+                    "total_volume": market_data.get("total_volume", {}).get("usd", 0),
+                    "high_24h": market_data.get("high_24h", {}).get("usd", 0),
+                    "low_24h": market_data.get("low_24h", {}).get("usd", 0),
+                    "price_change_percentage_24h": market_data.get("price_change_percentage_24h", 0),
+                    "price_change_percentage_7d": market_data.get("price_change_percentage_7d", 0),
+                    "price_change_percentage_30d": market_data.get("price_change_percentage_30d", 0),
+                    "circulating_supply": market_data.get("circulating_supply", 0),
+                    "total_supply": market_data.get("total_supply", 0),
+                    "ath": market_data.get("ath", {}).get("usd", 0),
+                    "atl": market_data.get("atl", {}).get("usd", 0),
+                }
+            },
+            **self._freshness(result)
+        }
     
     async def get_market_chart(self, coin_id: str, days: int = 7):
         """Get historical market data for charting"""
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{COINGECKO_BASE_URL}/coins/{coin_id}/market_chart",
-                    params={
-                        "vs_currency": "usd",
-                        "days": days
-                    },
-                    timeout=10.0
-                )
-                
-                if response.status_code == 200:
-                    return {
-                        "success": True,
-                        "data": response.json()
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "error": "Failed to fetch chart data"
-                    }
-        except Exception as e:
-            logger.error(f"Error fetching chart data: {str(e)}")
+        result = await self._fetch("market_chart", f"/coins/{coin_id}/market_chart", {
+            "vs_currency": "usd",
+            "days": days
+        })
+        
+        if result is None or result["status"] != 200:
             return {
                 "success": False,
-                "error": str(e)
+                "error": "Failed to fetch chart data"
             }
+        
+        return {
+            "success": True,
+            "data": result["data"],
+            **self._freshness(result)
+        }
     
     async def get_trending_coins(self):
         """Get currently trending coins"""
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{COINGECKO_BASE_URL}/search/trending",
-                    timeout=10.0
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    trending = data.get("coins", [])
-                    
-                    return {
-                        "success": True,
-                        "data": [
-                            {
-                                "id": coin["item"]["id"],
-                                "name": coin["item"]["name"],
-                                "symbol": coin["item"]["symbol"],
-                                "market_cap_rank": coin["item"]["market_cap_rank"],
-                                "thumb": coin["item"]["thumb"]
-                            }
-                            for coin in trending[:10]
-                        ]
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "error": "Failed to fetch trending coins"
-                    }
-        except Exception as e:
-            logger.error(f"Error fetching trending coins: {str(e)}")
+        result = await self._fetch("trending", "/search/trending")
+        
+        if result is None or result["status"] != 200:
             return {
                 "success": False,
-                "error": str(e)
+                "error": "Failed to fetch trending coins"
             }
+        
+        trending = result["data"].get("coins", [])
+        return {
+            "success": True,
+            "data": [
+                {
+                    "id": coin["item"]["id"],
+                    "name": coin["item"]["name"],
+                    "symbol": coin["item"]["symbol"],
+                    "market_cap_rank": coin["item"]["market_cap_rank"],
+                    "thumb": coin["item"]["thumb"]
+                }
+                for coin in trending[:10]
+            ],
+            **self._freshness(result)
+        }
     
     async def search_coins(self, query: str):
         """Search for coins by name or symbol"""
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{COINGECKO_BASE_URL}/search",
-                    params={"query": query},
-                    timeout=10.0
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    coins = data.get("coins", [])
-                    
-                    return {
-                        "success": True,
-                        "data": [
-                            {
-                                "id": coin["id"],
-                                "name": coin["name"],
-                                "symbol": coin["symbol"],
-                                "market_cap_rank": coin.get("market_cap_rank"),
-                                "thumb": coin.get("thumb")
-                            }
-                            for coin in coins[:20]
-                        ]
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "error": "Search failed"
-                    }
-        except Exception as e:
-            logger.error(f"Error searching coins: {str(e)}")
+        result = await self._fetch("search", "/search", {"query": query})
+        
+        if result is None or result["status"] != 200:
             return {
                 "success": False,
-                "error": str(e)
+                "error": "Search failed"
             }
+        
+        coins = result["data"].get("coins", [])
+        return {
+            "success": True,
+            "data": [
+                {
+                    "id": coin["id"],
+                    "name": coin["name"],
+                    "symbol": coin["symbol"],
+                    "market_cap_rank": coin.get("market_cap_rank"),
+                    "thumb": coin.get("thumb")
+                }
+                for coin in coins[:20]
+            ],
+            **self._freshness(result)
+        }
+    
+    def get_status(self) -> Dict:
+        """Breaker states and rate limit counters for monitoring"""
+        return {
+            "calls_per_minute": self.bucket.rate * 60,
+            "shared_budget": self.bucket.shared.backend if self.bucket.shared is not None else None,
+            "throttled": self.bucket.throttled,
+            "stale_served": self.stale_served,
+            "cached_responses": len(self._last_good),
+            "breakers": {endpoint: breaker.get_status() for endpoint, breaker in self.breakers.items()}
+        }
 
     def _get_mock_prices(self, coin_ids: List[str]):
         """Return mock price data for testing when API is rate limited"""
@@ -242,7 +377,6 @@ class CryptoPriceService:
                 mock_data[coin_id] = mock_prices[coin_id]
             else:
                 # Generate random mock data for unknown coins
-                import random
                 mock_data[coin_id] = {
                     "usd": round(random.uniform(0.1, 1000), 2),
                     "usd_24h_change": round(random.uniform(-10, 10), 2),
@@ -252,7 +386,9 @@ class CryptoPriceService:
         
         return {
             "success": True,
-            "data": mock_data
+            "data": mock_data,
+            # Not a quote - never to be traded on
+            "mock": True
         }
     
     def _get_mock_coin_details(self, coin_id: str):
@@ -307,7 +443,6 @@ class CryptoPriceService:
             }
         else:
             # Generate random mock data
-            import random
             return {
                 "success": True,
                 "data": {
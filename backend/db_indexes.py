@@ -0,0 +1,96 @@
+"""
+MongoDB Index Registry
+Declares the indexes behind every hot query in server.py and creates them
+idempotently at startup
+"""
+import logging
+from typing import Dict, List
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Verified OTPs are still read by /auth/register after they expire, so they
+# are only purged this long after expires_at
+OTP_RETENTION_SECONDS = 24 * 60 * 60
+
+# collection name -> indexes; unique only where the code already assumes it
+INDEXES: Dict[str, List[IndexModel]] = {
+    'users': [
+        IndexModel([('id', ASCENDING)], unique=True),
+        IndexModel([('email', ASCENDING)], unique=True),
+        IndexModel([('phone', ASCENDING)], unique=True),
+        IndexModel([('created_at', DESCENDING), ('id', DESCENDING)]),
+    ],
+    'trading_orders': [
+        IndexModel([('id', ASCENDING)], unique=True),
+        IndexModel([('user_id', ASCENDING), ('created_at', DESCENDING), ('id', DESCENDING)]),
+        IndexModel([('status', ASCENDING), ('created_at', DESCENDING)]),
+        IndexModel([('created_at', DESCENDING), ('id', DESCENDING)]),
+    ],
+    'user_holdings': [
+        IndexModel([('user_id', ASCENDING), ('coin_symbol', ASCENDING)], unique=True),
+    ],
+    'wallet_addresses': [
+        IndexModel([('user_id', ASCENDING), ('symbol', ASCENDING), ('verified', ASCENDING)]),
+    ],
+    'otp_verifications': [
+        IndexModel([('phone', ASCENDING), ('verified', ASCENDING), ('created_at', DESCENDING)]),
+        IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=OTP_RETENTION_SECONDS),
+    ],
+    'deposit_requests': [
+        IndexModel([('id', ASCENDING)], unique=True),
+        IndexModel([('status', ASCENDING)]),
+        IndexModel([('user_id', ASCENDING), ('created_at', DESCENDING), ('id', DESCENDING)]),
+        IndexModel([('created_at', DESCENDING), ('id', DESCENDING)]),
+    ],
+    'settlement_plans': [
+        IndexModel([('status', ASCENDING), ('created_at', ASCENDING)]),
+    ],
+    'limit_orders': [
+        IndexModel([('id', ASCENDING)], unique=True),
+        IndexModel([('status', ASCENDING), ('created_at', ASCENDING), ('id', ASCENDING)]),
+        IndexModel([('coin_id', ASCENDING), ('status', ASCENDING)]),
+    ],
+    'stop_loss_orders': [
+        IndexModel([('id', ASCENDING)], unique=True),
+        IndexModel([('status', ASCENDING), ('created_at', ASCENDING), ('id', ASCENDING)]),
+    ],
+    'dca_strategies': [
+        IndexModel([('id', ASCENDING)], unique=True),
+        IndexModel([('status', ASCENDING), ('next_purchase_date', ASCENDING)]),
+        IndexModel([('pending_purchase.id', ASCENDING)], sparse=True),
+    ],
+    'limit_order_fills': [
+        IndexModel([('id', ASCENDING)], unique=True),
+        IndexModel([('coin_id', ASCENDING), ('created_at', DESCENDING)]),
+    ],
+    'crypto_prices': [
+        IndexModel([('coin_id', ASCENDING)], unique=True),
+    ],
+    'crypto_candles': [
+        IndexModel([('coin_id', ASCENDING), ('interval', ASCENDING), ('start', ASCENDING)]),
+    ],
+    'platform_stats_buckets': [
+        IndexModel([('granularity', ASCENDING), ('start', ASCENDING)]),
+        # Hourly buckets carry expires_at; daily buckets are kept
+        IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=0),
+    ],
+}
+
+async def ensure_indexes(db) -> Dict[str, List[str]]:
+    """Create all registered indexes; existing identical indexes are a no-op
+
+    A failing collection (for example duplicate data blocking a unique
+    index) is logged and skipped so the API still starts.
+    """
+    created = {}
+
+    for collection_name, indexes in INDEXES.items():
+        try:
+            created[collection_name] = await db[collection_name].create_indexes(indexes)
+        except PyMongoError as e:
+            logger.error(f"Error creating indexes for {collection_name}: {str(e)}")
+
+    logger.info(f"✅ Ensured indexes on {len(created)}/{len(INDEXES)} collections")
+    return created
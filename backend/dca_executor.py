@@ -0,0 +1,416 @@
+"""
+DCA Strategy Executor
+Runs due dollar-cost-averaging purchases in batches; strategies due soon are
+held in a hierarchical timing wheel instead of one sleeping task each
+"""
+import asyncio
+import heapq
+import logging
+import math
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+from pymongo import UpdateOne
+
+from settlement import merge_legs
+from timestamps import epoch_seconds
+
+logger = logging.getLogger(__name__)
+
+FREQUENCIES = {
+    'daily': timedelta(days=1),
+    'weekly': timedelta(days=7),
+    'monthly': timedelta(days=30),
+}
+
+DCA_NOTE = 'خرید خودکار استراتژی DCA'
+
+# Purchase ids derive from (strategy id, due time), so a batch repeated after
+# a crash inserts the same orders instead of buying twice
+PURCHASE_NAMESPACE = uuid.UUID('5f0c1c5e-7d0a-4c3e-9a57-2f4c1d9b6e11')
+
+class TimingWheel:
+    """Hierarchical timing wheel of keys and their deadlines (epoch seconds)
+
+    Level 0 has one slot per tick; each higher level's slot spans a whole
+    rotation of the level below. A key sits in the coarsest level that still
+    tells its deadline apart and moves down as its slot comes up, so
+    scheduling and cancelling are O(1) and advancing costs one slot per tick
+    plus the keys that cascade. Deadlines past the top level wait in a heap.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: Sequence[int] = (60, 60, 24), now: Optional[float] = None):
+        self.tick = tick
+        self.slots = tuple(slots)
+        self.spans = [math.prod(self.slots[:level]) for level in range(len(self.slots) + 1)]
+        self._wheels: List[List[Dict[Hashable, int]]] = [[{} for _ in range(count)] for count in self.slots]
+        self._where: Dict[Hashable, Tuple[int, int]] = {}  # key -> (level, slot); level -1 is overdue
+        self._deadlines: Dict[Hashable, int] = {}
+        self._overflow: List[Tuple[int, Hashable]] = []
+        self._overdue: Dict[Hashable, int] = {}
+        self._time = self._ticks(time.time() if now is None else now)
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._deadlines
+
+    def _ticks(self, seconds: float) -> int:
+        return math.floor(seconds / self.tick)
+
+    def schedule(self, key: Hashable, deadline: float):
+        """Add key or move it to a new deadline"""
+        self.cancel(key)
+        self._deadlines[key] = self._place(key, math.ceil(deadline / self.tick))
+
+    def _place(self, key: Hashable, due: int) -> int:
+        delta = due - self._time
+        if delta <= 0:
+            self._overdue[key] = due
+            self._where[key] = (-1, 0)
+            return due
+        for level, count in enumerate(self.slots):
+            if delta < self.spans[level + 1]:
+                slot = (due // self.spans[level]) % count
+                self._wheels[level][slot][key] = due
+                self._where[key] = (level, slot)
+                return due
+        heapq.heappush(self._overflow, (due, key))
+        self._where.pop(key, None)
+        return due
+
+    def cancel(self, key: Hashable) -> bool:
+        due = self._deadlines.pop(key, None)
+        if due is None:
+            return False
+        where = self._where.pop(key, None)
+        if where is None:
+            pass  # In the overflow heap - dropped lazily
+        elif where[0] < 0:
+            self._overdue.pop(key, None)
+        else:
+            self._wheels[where[0]][where[1]].pop(key, None)
+        return True
+
+    def advance(self, now: Optional[float] = None) -> List[Hashable]:
+        """Move the wheel up to now and return the keys that came due"""
+        target = self._ticks(time.time() if now is None else now)
+        due = list(self._overdue)
+        self._overdue.clear()
+
+        while self._time < target:
+            self._time += 1
+            # Pull far deadlines into the wheel once they are within its range
+            while self._overflow and self._overflow[0][0] - self._time < self.spans[-1]:
+                deadline, key = heapq.heappop(self._overflow)
+                if self._deadlines.get(key) == deadline and key not in self._where:
+                    self._place(key, deadline)
+            # Cascade every level whose slot starts at this tick, coarsest first
+            for level in range(len(self.slots) - 1, 0, -1):
+                if self._time % self.spans[level] == 0:
+                    slot = (self._time // self.spans[level]) % self.slots[level]
+                    entries, self._wheels[level][slot] = self._wheels[level][slot], {}
+                    for key, deadline in entries.items():
+                        self._place(key, deadline)
+            slot = self._time % self.slots[0]
+            if self._wheels[0][slot]:
+                entries, self._wheels[0][slot] = self._wheels[0][slot], {}
+                due.extend(entries)
+            if self._overdue:
+                due.extend(self._overdue)
+                self._overdue.clear()
+
+        for key in due:
+            self._deadlines.pop(key, None)
+            self._where.pop(key, None)
+        return due
+
+class DCAExecutor:
+    """Executes DCA strategies when their next_purchase_date comes up
+
+    Strategies due within the lookahead window are loaded into the wheel by
+    one range query on next_purchase_date that resumes where the previous one
+    stopped. Every tick, all strategies that came due are bought together:
+    each purchase's Toman is taken with a guarded reservation, then each
+    strategy's next_purchase_date and spent_amount_tmn move in one
+    conditional update that also stores the purchase as pending_purchase.
+    Only the purchases whose update matched are inserted, with
+    deterministic ids, and their coins credited in one settlement plan;
+    the others get their reservation back. A purchase left in
+    pending_purchase by a crash is placed by recover(). Runs only in the
+    lease holder.
+    """
+
+    def __init__(self, db, settlement, price_lookup: Callable[[List[str]], Awaitable[Dict[str, float]]],
+                 lease=None, tick: float = 1.0, lookahead: int = 3600, retry_delay: int = 60,
+                 batch_size: int = 500, user_cache=None):
+        self.db = db
+        self.settlement = settlement
+        self.user_cache = user_cache
+        self.price_lookup = price_lookup
+        self.lease = lease
+        self.tick = tick
+        self.lookahead = lookahead
+        self.retry_delay = retry_delay
+        self.batch_size = batch_size
+        self.wheel = TimingWheel(tick)
+        self._loaded_until: Optional[datetime] = None
+        self._loaded = False
+        self._task: Optional[asyncio.Task] = None
+        self.purchases = 0
+        self.skipped = 0
+        self.completed = 0
+        self.superseded = 0
+        self.invalid = 0
+
+    @property
+    def is_owner(self) -> bool:
+        return self.lease is None or self.lease.is_leader
+
+    async def load(self, now: datetime):
+        """Schedule active strategies due up to now + lookahead not loaded yet"""
+        until = now + timedelta(seconds=self.lookahead)
+        window = {'$lte': until}
+        if self._loaded_until is not None:
+            window['$gt'] = self._loaded_until
+        async for strategy in self.db.dca_strategies.find(
+            {'status': 'active', 'next_purchase_date': window}, {'_id': 0, 'id': 1, 'next_purchase_date': 1}
+        ):
+            deadline = epoch_seconds(strategy['next_purchase_date'])
+            if deadline is None:
+                self.invalid += 1
+                logger.warning(f"⚠️  DCA strategy {strategy['id']} skipped: invalid next_purchase_date "
+                               f"{strategy['next_purchase_date']!r}")
+                continue
+            self.wheel.schedule(strategy['id'], deadline)
+        self._loaded_until = until
+
+    async def _place(self, orders: List[Dict]):
+        """Insert and settle purchases their strategies committed to, then clear them
+
+        The Toman was reserved before the strategies committed, so settling
+        only credits the coins. Purchases committed together share the
+        settlement_batch plan id they were stored with, which makes placing
+        them again after a crash a replay of the same plan.
+        """
+        order_ids = [order['id'] for order in orders]
+        # Inserted by an interrupted earlier run - counted then
+        placed = set(await self.db.trading_orders.distinct('id', {'id': {'$in': order_ids}}))
+        batches: Dict[str, List[Dict]] = {}
+        for order in orders:
+            batches.setdefault(order['settlement_batch'], []).append(order)
+        for plan_id, batch in batches.items():
+            legs = merge_legs([
+                ('credit', order['user_id'], order['coin_symbol'], order['amount_tmn'] / order['price_at_order'],
+                 order['price_at_order'], order['coin_id'])
+                for order in batch
+            ])
+            await self.settlement.apply(plan_id, legs, inserts=[['trading_orders', batch]])
+        if self.user_cache is not None:
+            for user_id in {order['user_id'] for order in orders}:
+                self.user_cache.invalidate(user_id)
+        if self.settlement.stats is not None:
+            await self.settlement.stats.record_many(
+                'trading_orders', [(None, order) for order in orders if order['id'] not in placed]
+            )
+        await self.db.dca_strategies.update_many(
+            {'pending_purchase.id': {'$in': order_ids}}, {'$unset': {'pending_purchase': ''}}
+        )
+        self.purchases += len(orders)
+
+    async def _reserve(self, order: Dict) -> bool:
+        return await self.settlement.reserve(
+            ('balance', order['user_id'], -order['amount_tmn']), f"{order['id']}:reserve"
+        )
+
+    async def _release(self, order: Dict):
+        await self.settlement.release(('balance', order['user_id'], -order['amount_tmn']), f"{order['id']}:reserve")
+
+    async def recover(self):
+        """Place and settle purchases a previous holder committed to but did not finish"""
+        orders = [strategy['pending_purchase'] async for strategy in self.db.dca_strategies.find(
+            {'pending_purchase': {'$exists': True}}, {'_id': 0, 'pending_purchase': 1}
+        )]
+        if orders:
+            await self._place(orders)
+            logger.info(f"✅ Settled {len(orders)} interrupted DCA purchases")
+
+    async def execute(self, strategy_ids: List[str], now: datetime):
+        """Buy for every due strategy among strategy_ids in one batch"""
+        strategies = await self.db.dca_strategies.find(
+            {'id': {'$in': strategy_ids}, 'status': 'active', 'next_purchase_date': {'$lte': now}}, {'_id': 0}
+        ).to_list(None)
+        if not strategies:
+            return
+
+        prices = await self.price_lookup(list({strategy['coin_id'] for strategy in strategies}))
+        batch = uuid.uuid4().hex
+        purchases = {}
+        for strategy in strategies:
+            remaining = strategy['total_budget_tmn'] - strategy.get('spent_amount_tmn', 0)
+            amount = min(strategy['amount_tmn_per_purchase'], remaining)
+            price = prices.get(strategy['coin_id'])
+            if price and amount > 0:
+                purchases[strategy['id']] = _purchase(strategy, amount, price, now, batch)
+        # Guarded debits, so purchases racing other spending never overdraw a wallet
+        reserved = await asyncio.gather(*(self._reserve(order) for order in purchases.values()))
+        funded = {strategy_id for strategy_id, ok in zip(purchases, reserved) if ok}
+
+        orders, updates = {}, []
+        for strategy in strategies:
+            price = prices.get(strategy['coin_id'])
+            if not price:
+                # No price yet - try again shortly without moving the schedule
+                self.wheel.schedule(strategy['id'], now.timestamp() + self.retry_delay)
+                continue
+
+            remaining = strategy['total_budget_tmn'] - strategy.get('spent_amount_tmn', 0)
+            amount = min(strategy['amount_tmn_per_purchase'], remaining)
+            due = strategy['next_purchase_date']
+            update = {'$set': {'next_purchase_date': _next_date(due, strategy['frequency'], now), 'updated_at': now}}
+
+            if amount <= 0:
+                update['$set']['status'] = 'completed'
+                self.completed += 1
+            elif strategy['id'] not in funded:
+                update['$set']['last_run_status'] = 'insufficient_balance'
+                self.skipped += 1
+            else:
+                order = orders[strategy['id']] = purchases[strategy['id']]
+                update['$set']['pending_purchase'] = order
+                update['$set']['last_run_status'] = 'purchased'
+                update['$set']['last_purchase_date'] = now
+                update['$inc'] = {'spent_amount_tmn': amount, 'purchase_count': 1}
+                if amount >= remaining:
+                    update['$set']['status'] = 'completed'
+                    self.completed += 1
+
+            # Conditional on the due date read above, so a repeated batch cannot advance it twice
+            updates.append(UpdateOne({'id': strategy['id'], 'status': 'active', 'next_purchase_date': due}, update))
+
+        try:
+            if updates:
+                await self.db.dca_strategies.bulk_write(updates, ordered=False)
+        finally:
+            # A strategy paused, cancelled or advanced by another writer since it
+            # was read did not match, nor did any update a failed write left out:
+            # their reservations go back now, committed purchases are placed below
+            # or by recover()
+            committed = await self._release_uncommitted(orders) if orders else []
+        if committed:
+            await self._place(committed)
+            logger.info(f"🔁 DCA tick: {len(committed)} purchases for {len(strategies)} due strategies")
+
+    async def _release_uncommitted(self, orders: Dict[str, Dict]) -> List[Dict]:
+        committed = [strategy['pending_purchase'] async for strategy in self.db.dca_strategies.find(
+            {'pending_purchase.id': {'$in': [order['id'] for order in orders.values()]}},
+            {'_id': 0, 'pending_purchase': 1}
+        )]
+        committed_ids = {order['id'] for order in committed}
+        for order in orders.values():
+            if order['id'] not in committed_ids:
+                await self._release(order)
+                self.superseded += 1
+        return committed
+
+    def _reset(self):
+        self.wheel = TimingWheel(self.tick)
+        self._loaded_until = None
+
+    async def _run(self):
+        last_load = 0.0
+        while True:
+            try:
+                now = datetime.now(timezone.utc)
+                if self.is_owner and not self._loaded:
+                    self._reset()
+                    await self.recover()
+                    await self.load(now)
+                    self._loaded = True
+                    last_load = time.monotonic()
+                    logger.info(f"✅ DCA executor loaded {len(self.wheel)} strategies due within {self.lookahead}s")
+                elif not self.is_owner and self._loaded:
+                    self._loaded = False
+                    self._reset()
+                    logger.info("🛑 DCA strategies released to another worker")
+
+                if self._loaded:
+                    # Refill well before the loaded window runs out
+                    if time.monotonic() - last_load >= self.lookahead / 4:
+                        await self.load(now)
+                        last_load = time.monotonic()
+                    due = self.wheel.advance(now.timestamp())
+                    for start in range(0, len(due), self.batch_size):
+                        await self.execute(due[start:start + self.batch_size], now)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"DCA executor loop failed: {str(e)}")
+                # Strategies of a failed batch are picked up again by the next load
+                self._loaded = False
+            await asyncio.sleep(self.tick)
+
+    def start(self):
+        if self._task is None:
+            if self.lease is not None:
+                self.lease.start()
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"🔄 DCA executor started (tick {self.tick}s, lookahead {self.lookahead}s)")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.lease is not None:
+            await self.lease.stop()
+
+    def get_stats(self) -> Dict:
+        return {
+            'owner': self.is_owner,
+            'loaded': self._loaded,
+            'scheduled': len(self.wheel),
+            'loaded_until': self._loaded_until.isoformat() if self._loaded_until else None,
+            'purchases': self.purchases,
+            'skipped_insufficient_balance': self.skipped,
+            'completed_strategies': self.completed,
+            'superseded_purchases': self.superseded,
+            'invalid_strategies': self.invalid
+        }
+
+def _next_date(due: datetime, frequency: str, now: datetime) -> datetime:
+    """Next purchase date on the strategy's cadence; purchases missed during downtime are not replayed"""
+    period = FREQUENCIES.get(frequency, FREQUENCIES['daily'])
+    if due.tzinfo is None:
+        due = due.replace(tzinfo=timezone.utc)
+    next_date = due + period
+    if next_date <= now:
+        next_date += period * ((now - next_date) // period + 1)
+    return next_date
+
+def _purchase(strategy: Dict, amount: float, price: float, now: datetime, batch: str) -> Dict:
+    due = epoch_seconds(strategy['next_purchase_date'])
+    return {
+        'id': str(uuid.uuid5(PURCHASE_NAMESPACE, f"{strategy['id']}:{due}")),
+        'user_id': strategy['user_id'],
+        'order_type': 'buy',
+        'coin_symbol': strategy['coin_symbol'],
+        'coin_id': strategy['coin_id'],
+        'amount_crypto': None,
+        'amount_tmn': amount,
+        'target_coin_symbol': None,
+        'target_coin_id': None,
+        'price_at_order': price,
+        'total_value_tmn': amount,
+        'status': 'completed',
+        'admin_note': DCA_NOTE,
+        'dca_strategy_id': strategy['id'],
+        'settlement_batch': batch,
+        'created_at': now,
+        'updated_at': now
+    }
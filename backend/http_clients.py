@@ -0,0 +1,84 @@
+"""
+Shared HTTP Client Registry
+Long-lived, pooled httpx clients per upstream so outbound calls reuse
+keep-alive connections instead of paying a TCP+TLS handshake every time
+"""
+import logging
+from typing import Dict, Optional
+import httpx
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:  # HTTP/2 is optional
+    HTTP2_AVAILABLE = False
+
+# upstream name -> httpx.AsyncClient settings
+UPSTREAMS = {
+    'coingecko': {
+        'timeout': httpx.Timeout(10.0, connect=5.0),
+        'limits': httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60.0),
+    },
+    'wallex': {
+        'timeout': httpx.Timeout(10.0, connect=5.0),
+        'limits': httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=60.0),
+    },
+    'nobitex': {
+        'timeout': httpx.Timeout(15.0, connect=5.0),
+        'limits': httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=60.0),
+    },
+    'abantether': {
+        'timeout': httpx.Timeout(20.0, connect=10.0),
+        'limits': httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=60.0),
+        'follow_redirects': True,
+        'verify': False,  # Skip SSL verification if needed
+    },
+    'apir': {
+        'timeout': httpx.Timeout(10.0, connect=5.0),
+        'limits': httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=120.0),
+    },
+}
+
+class HTTPClientRegistry:
+    """Named, pooled AsyncClients created at startup and closed at shutdown"""
+
+    def __init__(self, upstreams: Optional[Dict[str, Dict]] = None):
+        self.upstreams = upstreams or UPSTREAMS
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def _create(self, name: str) -> httpx.AsyncClient:
+        if name not in self.upstreams:
+            raise KeyError(f"Unknown HTTP upstream: {name}")
+        return httpx.AsyncClient(http2=HTTP2_AVAILABLE, **self.upstreams[name])
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """Return the shared client for an upstream, creating it on first use"""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._create(name)
+            self._clients[name] = client
+        return client
+
+    async def start(self):
+        """Open every registered client up front"""
+        for name in self.upstreams:
+            self.get(name)
+        logger.info(f"✅ HTTP clients ready: {', '.join(self.upstreams)} (HTTP/2: {HTTP2_AVAILABLE})")
+
+    async def close(self):
+        """Close all clients and their pooled connections"""
+        for name, client in self._clients.items():
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.debug(f"Error closing HTTP client {name}: {str(e)}")
+        self._clients.clear()
+
+# Global registry instance
+http_clients = HTTPClientRegistry()
+
+def get_http_client(name: str) -> httpx.AsyncClient:
+    """Shared pooled client for a named upstream"""
+    return http_clients.get(name)
@@ -0,0 +1,98 @@
+"""
+Leader Lease
+MongoDB lease so a background job runs in exactly one uvicorn worker or
+replica; the holder renews it and another process takes over once it expires
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+LEASES_COLLECTION = 'leases'
+
+class LeaderLease:
+    """One named lease document: {_id: name, holder, expires_at}
+
+    is_leader is only True while this process holds an unexpired lease.
+    Renewals run every ttl/3 seconds so a single failed renewal does not
+    hand leadership over.
+    """
+
+    def __init__(self, db, name: str, ttl: int = 30):
+        self.db = db
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self.expires_at: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def acquire(self) -> bool:
+        """Take the lease if it is free or expired, or renew it if already held"""
+        now = datetime.now(timezone.utc)
+        try:
+            lease = await self.db[LEASES_COLLECTION].find_one_and_update(
+                {'_id': self.name, '$or': [{'holder': self.holder}, {'expires_at': {'$lt': now}}]},
+                {'$set': {'holder': self.holder, 'expires_at': now + timedelta(seconds=self.ttl), 'renewed_at': now}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            leader = lease is not None and lease.get('holder') == self.holder
+            if leader:
+                self.expires_at = now + timedelta(seconds=self.ttl)
+        except DuplicateKeyError:
+            # Another process holds an unexpired lease
+            leader = False
+        except PyMongoError as e:
+            logger.error(f"Error renewing lease {self.name}: {str(e)}")
+            # Keep leading only while the last renewal outlives the next attempt
+            leader = self.is_leader and now + timedelta(seconds=self.ttl / 3) < self.expires_at
+
+        if leader != self.is_leader:
+            logger.info(f"👑 {'Acquired' if leader else 'Lost'} lease {self.name} ({self.holder})")
+        self.is_leader = leader
+        return leader
+
+    async def release(self):
+        """Give the lease up so another process can take over immediately"""
+        self.is_leader = False
+        try:
+            await self.db[LEASES_COLLECTION].delete_one({'_id': self.name, 'holder': self.holder})
+        except PyMongoError as e:
+            logger.error(f"Error releasing lease {self.name}: {str(e)}")
+
+    async def _renew_loop(self):
+        while True:
+            await self.acquire()
+            await asyncio.sleep(self.ttl / 3)
+
+    def start(self):
+        """Contend for the lease now and keep renewing it in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._renew_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_leader:
+            await self.release()
+
+    def get_status(self) -> Dict:
+        return {
+            'name': self.name,
+            'holder': self.holder,
+            'is_leader': self.is_leader,
+            'expires_at': self.expires_at.isoformat() if self.is_leader and self.expires_at else None
+        }
@@ -1,17 +1,15 @@
 """
 Abantether Price Scraper Service
 Fetches real-time crypto prices in Toman from Abantether.com
-Updates every 30 minutes in background
 """
-import httpx
 import asyncio
 import logging
 from datetime import datetime, timezone
-from typing import Dict, Optional
-from bs4 import BeautifulSoup
-import re
+from typing import Dict, List, Optional
 import json
-from abantether_scraper import parse_abantether_prices
+import time
+from abantether_scraper import parse_abantether_html
+from http_clients import get_http_client
 
 logger = logging.getLogger(__name__)
 
@@ -45,137 +43,211 @@ COIN_MAP = {
     'DAI': {'id': 'dai', 'name': 'Dai', 'symbol': 'DAI'},
 }
 
+# Sources of the same prices, raced by fetch_abantether_prices
+ABANTETHER_SOURCES = ['abantether_api', 'abantether_page']
+# A source "wins" once it returns at least this many coins
+SOURCE_QUORUM = 5
+# Overall budget for one hedged fetch, in seconds
+FETCH_DEADLINE = 20.0
+# Weight of the newest sample in the per-source latency moving average
+LATENCY_EWMA_ALPHA = 0.3
+
 class NobitexPriceService:
     """Scrape and manage cryptocurrency prices in Toman from Abantether"""
     
     def __init__(self, db=None):
         self.db = db
-        self.last_update = None
-        self.cached_prices = {}
-        self.update_interval = 30 * 60  # 30 minutes in seconds
+        self.sources = {
+            'abantether_api': self._fetch_abantether_api,
+            'abantether_page': self._scrape_abantether_pages,
+            'nobitex_api': self._fetch_nobitex_api,
+        }
+        self.source_stats = {
+            name: {'attempts': 0, 'successes': 0, 'failures': 0, 'cancelled': 0, 'avg_latency': None}
+            for name in self.sources
+        }
+        
+    def ranked_sources(self, names: Optional[List[str]] = None) -> list:
+        """Source names (all by default) ordered by success rate, then average latency"""
+        def score(name):
+            stats = self.source_stats[name]
+            completed = stats['successes'] + stats['failures']
+            success_rate = stats['successes'] / completed if completed else 1.0
+            return (-success_rate, stats['avg_latency'] if stats['avg_latency'] is not None else 0.0)
+        
+        return sorted(names or self.sources, key=score)
+    
+    async def _timed_fetch(self, name: str) -> Dict:
+        """Run one source and record its latency and outcome"""
+        stats = self.source_stats[name]
+        stats['attempts'] += 1
+        started = time.monotonic()
         
-    async def scrape_nobitex_prices(self) -> Dict:
-        """Fetch real prices from Abantether.com"""
         try:
-            logger.info("🔄 Fetching prices from Abantether.com...")
-            
-            # Method 1: Try Abantether API first
-            prices = await self._fetch_abantether_api()
-            
-            # Method 2: Try Nobitex API (reliable Iranian source)
-            if not prices or len(prices) < 5:
-                logger.warning("Abantether API yielded few results, trying Nobitex API...")
-                prices = await self._fetch_nobitex_api()
-            
-            # Method 3: If both APIs fail, scrape Abantether pages
-            if not prices or len(prices) < 5:
-                logger.warning("APIs yielded few results, trying web scraping...")
-                prices = await self._scrape_abantether_pages()
-            
-            if prices:
-                logger.info(f"✅ Successfully fetched {len(prices)} prices from Abantether")
-                self.cached_prices = prices
-                self.last_update = datetime.now(timezone.utc)
+            prices = await self.sources[name]() or {}
+        except asyncio.CancelledError:
+            # Lost the race - elapsed time is only a lower bound on its latency
+            stats['cancelled'] += 1
+            self._record_latency(name, time.monotonic() - started, lower_bound=True)
+            raise
+        except Exception as e:
+            logger.error(f"Error fetching {name}: {str(e)}")
+            prices = {}
+        
+        self._record_latency(name, time.monotonic() - started)
+        stats['successes' if len(prices) >= SOURCE_QUORUM else 'failures'] += 1
+        return prices
+    
+    def _record_latency(self, name: str, latency: float, lower_bound: bool = False):
+        """Fold a sample into the moving average; a lower bound can raise it but never lower it"""
+        stats = self.source_stats[name]
+        previous = stats['avg_latency']
+        if lower_bound and previous is not None and latency <= previous:
+            return
+        stats['avg_latency'] = latency if previous is None else (
+            LATENCY_EWMA_ALPHA * latency + (1 - LATENCY_EWMA_ALPHA) * previous
+        )
+    
+    async def _fetch_hedged(self, names: Optional[List[str]] = None) -> Dict:
+        """Fire the named sources (all by default) at once and keep the first that meets the quorum
+        
+        Remaining sources are cancelled as soon as one wins. If none reaches
+        the quorum before FETCH_DEADLINE, the largest partial result is used.
+        """
+        ranking = self.ranked_sources(names)
+        tasks = {asyncio.create_task(self._timed_fetch(name)): name for name in ranking}
+        pending = set(tasks)
+        deadline = time.monotonic() + FETCH_DEADLINE
+        best, best_source = {}, None
+        
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=max(deadline - time.monotonic(), 0),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    logger.warning(f"Price sources timed out: {', '.join(tasks[task] for task in pending)}")
+                    break
                 
-                # Store in database
-                if self.db is not None:
-                    await self._store_prices_in_db(prices)
+                # Several sources may finish together - prefer the better ranked one
+                for task in sorted(done, key=lambda task: ranking.index(tasks[task])):
+                    prices = task.result()
+                    if len(prices) > len(best):
+                        best, best_source = prices, tasks[task]
                 
-                return {'success': True, 'data': prices}
-            else:
-                logger.warning("No prices found, using fallback")
-                return self._get_fallback_prices()
-                    
-        except Exception as e:
-            logger.error(f"Error fetching Abantether prices: {str(e)}")
-            return self._get_fallback_prices()
+                if len(best) >= SOURCE_QUORUM:
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+        
+        if best_source:
+            logger.info(f"🏁 {best_source} won the price fetch with {len(best)} coins")
+        return best
+    
+    def get_source_stats(self) -> Dict:
+        """Per-source latency and success counters, in current ranking order"""
+        return {
+            name: {
+                **self.source_stats[name],
+                'avg_latency': round(self.source_stats[name]['avg_latency'], 3)
+                if self.source_stats[name]['avg_latency'] is not None else None
+            }
+            for name in self.ranked_sources()
+        }
+    
+    async def fetch_abantether_prices(self) -> Dict:
+        """Abantether prices - the API and the coins page raced, first to the quorum wins"""
+        return await self._fetch_hedged(ABANTETHER_SOURCES)
+    
+    async def fetch_nobitex_prices(self) -> Dict:
+        """Nobitex orderbook prices, timed into the source stats"""
+        return await self._timed_fetch('nobitex_api')
     
     async def _fetch_abantether_api(self) -> Dict:
         """Fetch prices from Abantether API - with improved error handling"""
         try:
-            async with httpx.AsyncClient(
-                timeout=httpx.Timeout(20.0, connect=10.0),
-                follow_redirects=True,
-                verify=False  # Skip SSL verification if needed
-            ) as client:
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                    'Accept': 'application/json, text/plain, */*',
-                    'Accept-Language': 'fa-IR,fa;q=0.9',
-                    'Referer': 'https://abantether.com/coins',
-                }
+            client = get_http_client('abantether')
+            headers = {
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+                'Accept': 'application/json, text/plain, */*',
+                'Accept-Language': 'fa-IR,fa;q=0.9',
+                'Referer': 'https://abantether.com/coins',
+            }
+            
+            response = await client.get(ABANTETHER_API_URL, headers=headers)
+            
+            if response.status_code == 200:
+                try:
+                    data = response.json()
+                except:
+                    data = json.loads(response.text)
+                
+                prices = {}
                 
-                response = await client.get(ABANTETHER_API_URL, headers=headers)
+                # Parse response - Abantether returns list of coins
+                if isinstance(data, list):
+                    coins_data = data
+                elif isinstance(data, dict) and 'data' in data:
+                    coins_data = data['data']
+                elif isinstance(data, dict) and 'coins' in data:
+                    coins_data = data['coins']
+                else:
+                    coins_data = []
                 
-                if response.status_code == 200:
+                for coin_data in coins_data:
                     try:
-                        data = response.json()
-                    except:
-                        data = json.loads(response.text)
-                    
-                    prices = {}
-                    
-                    # Parse response - Abantether returns list of coins
-                    if isinstance(data, list):
-                        coins_data = data
-                    elif isinstance(data, dict) and 'data' in data:
-                        coins_data = data['data']
-                    elif isinstance(data, dict) and 'coins' in data:
-                        coins_data = data['coins']
-                    else:
-                        coins_data = []
-                    
-                    for coin_data in coins_data:
-                        try:
-                            # Get symbol (might be 'symbol', 'code', or 'ticker')
-                            symbol = (coin_data.get('symbol') or 
-                                    coin_data.get('code') or 
-                                    coin_data.get('ticker', '')).upper()
+                        # Get symbol (might be 'symbol', 'code', or 'ticker')
+                        symbol = (coin_data.get('symbol') or 
+                                coin_data.get('code') or 
+                                coin_data.get('ticker', '')).upper()
+                        
+                        if symbol in COIN_MAP:
+                            coin_info = COIN_MAP[symbol]
                             
-                            if symbol in COIN_MAP:
-                                coin_info = COIN_MAP[symbol]
-                                
-                                # Get price - try different field names
-                                price_tmn = (coin_data.get('sell_price') or
-                                           coin_data.get('price') or
-                                           coin_data.get('buy_price') or
-                                           coin_data.get('last_price') or 0)
-                                
-                                # Convert to float if string
-                                if isinstance(price_tmn, str):
-                                    price_tmn = float(price_tmn.replace(',', ''))
-                                else:
-                                    price_tmn = float(price_tmn)
-                                
-                                # Get 24h change
-                                change_24h = coin_data.get('change_24h') or coin_data.get('change') or 0
-                                if isinstance(change_24h, str):
-                                    change_24h = float(change_24h.replace('%', '').replace(',', ''))
-                                else:
-                                    change_24h = float(change_24h)
+                            # Get price - try different field names
+                            price_tmn = (coin_data.get('sell_price') or
+                                       coin_data.get('price') or
+                                       coin_data.get('buy_price') or
+                                       coin_data.get('last_price') or 0)
+                            
+                            # Convert to float if string
+                            if isinstance(price_tmn, str):
+                                price_tmn = float(price_tmn.replace(',', ''))
+                            else:
+                                price_tmn = float(price_tmn)
+                            
+                            # Get 24h change
+                            change_24h = coin_data.get('change_24h') or coin_data.get('change') or 0
+                            if isinstance(change_24h, str):
+                                change_24h = float(change_24h.replace('%', '').replace(',', ''))
+                            else:
+                                change_24h = float(change_24h)
+                            
+                            if price_tmn > 0:
+                                prices[coin_info['id']] = {
+                                    'symbol': symbol,
+                                    'name': coin_info['name'],
+                                    'price_tmn': price_tmn,
+                                    'change_24h': change_24h,
+                                    'last_updated': datetime.now(timezone.utc).isoformat()
+                                }
                                 
-                                if price_tmn > 0:
-                                    prices[coin_info['id']] = {
-                                        'symbol': symbol,
-                                        'name': coin_info['name'],
-                                        'price_tmn': price_tmn,
-                                        'change_24h': change_24h,
-                                        'last_updated': datetime.now(timezone.utc).isoformat()
-                                    }
-                                    
-                                    logger.info(f"✅ {symbol}: {price_tmn:,.0f} تومان")
-                        
-                        except Exception as e:
-                            logger.debug(f"Error parsing coin data: {str(e)}")
-                            continue
-                    
-                    if prices:
-                        logger.info(f"✅ Fetched {len(prices)} prices from Abantether API")
-                    return prices
-                else:
-                    logger.warning(f"Abantether API returned status {response.status_code}")
-                    return {}
+                                logger.info(f"✅ {symbol}: {price_tmn:,.0f} تومان")
                     
+                    except Exception as e:
+                        logger.debug(f"Error parsing coin data: {str(e)}")
+                        continue
+                
+                if prices:
+                    logger.info(f"✅ Fetched {len(prices)} prices from Abantether API")
+                return prices
+            else:
+                logger.warning(f"Abantether API returned status {response.status_code}")
+                return {}
+                
         except Exception as e:
             logger.error(f"Error fetching Abantether API: {str(e)}")
             return {}
@@ -183,51 +255,51 @@ class NobitexPriceService:
     async def _fetch_nobitex_api(self) -> Dict:
         """Fetch prices from Nobitex API (reliable Iranian exchange)"""
         try:
-            async with httpx.AsyncClient(timeout=15.0) as client:
-                response = await client.post(
-                    'https://api.nobitex.ir/v2/orderbook',
-                    json={'type': 'all'},
-                    headers={'Content-Type': 'application/json'}
-                )
+            client = get_http_client('nobitex')
+            response = await client.post(
+                'https://api.nobitex.ir/v2/orderbook',
+                json={'type': 'all'},
+                headers={'Content-Type': 'application/json'}
+            )
+            
+            if response.status_code == 200:
+                data = response.json()
+                prices = {}
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    prices = {}
-                    
-                    # Nobitex returns orderbook data
-                    if isinstance(data, dict):
-                        for symbol, coin_info in COIN_MAP.items():
-                            # Try different pair formats
-                            for pair_key in [f"{symbol}IRT", f"{symbol}USDT", f"{symbol}TMN"]:
-                                if pair_key in data:
-                                    try:
-                                        orderbook = data[pair_key]
-                                        
-                                        # Get last trade price or best bid/ask average
-                                        if 'lastTradePrice' in orderbook:
-                                            price = float(orderbook['lastTradePrice'])
-                                        elif 'bestSell' in orderbook and 'bestBuy' in orderbook:
-                                            price = (float(orderbook['bestSell']) + float(orderbook['bestBuy'])) / 2
-                                        else:
-                                            continue
-                                        
-                                        if price > 0 and pair_key.endswith('IRT'):  # Only IRTpairs
-                                            prices[coin_info['id']] = {
-                                                'symbol': symbol,
-                                                'name': coin_info['name'],
-                                                'price_tmn': price / 10,  # Nobitex uses Rial, convert to Toman
-                                                'change_24h': 0,
-                                                'last_updated': datetime.now(timezone.utc).isoformat()
-                                            }
-                                            logger.info(f"✅ Nobitex {symbol}: {price/10:,.0f} تومان")
-                                            break
-                                    except Exception as e:
+                # Nobitex returns orderbook data
+                if isinstance(data, dict):
+                    for symbol, coin_info in COIN_MAP.items():
+                        # Try different pair formats
+                        for pair_key in [f"{symbol}IRT", f"{symbol}USDT", f"{symbol}TMN"]:
+                            if pair_key in data:
+                                try:
+                                    orderbook = data[pair_key]
+                                    
+                                    # Get last trade price or best bid/ask average
+                                    if 'lastTradePrice' in orderbook:
+                                        price = float(orderbook['lastTradePrice'])
+                                    elif 'bestSell' in orderbook and 'bestBuy' in orderbook:
+                                        price = (float(orderbook['bestSell']) + float(orderbook['bestBuy'])) / 2
+                                    else:
                                         continue
-                    
-                    if prices:
-                        logger.info(f"✅ Fetched {len(prices)} prices from Nobitex API")
-                    return prices
-                    
+                                    
+                                    if price > 0 and pair_key.endswith('IRT'):  # Only IRTpairs
+                                        prices[coin_info['id']] = {
+                                            'symbol': symbol,
+                                            'name': coin_info['name'],
+                                            'price_tmn': price / 10,  # Nobitex uses Rial, convert to Toman
+                                            'change_24h': 0,
+                                            'last_updated': datetime.now(timezone.utc).isoformat()
+                                        }
+                                        logger.info(f"✅ Nobitex {symbol}: {price/10:,.0f} تومان")
+                                        break
+                                except Exception as e:
+                                    continue
+                
+                if prices:
+                    logger.info(f"✅ Fetched {len(prices)} prices from Nobitex API")
+                return prices
+                
         except Exception as e:
             logger.error(f"Error fetching Nobitex API: {str(e)}")
             return {}
@@ -237,244 +309,36 @@ class NobitexPriceService:
         try:
             logger.info("📊 Scraping Abantether coins page...")
             
-            async with httpx.AsyncClient(
-                timeout=20.0, 
-                follow_redirects=True,
-                verify=False
-            ) as client:
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                    'Accept-Language': 'fa-IR,fa;q=0.9,en-US;q=0.8,en;q=0.7',
-                    'Accept-Encoding': 'gzip, deflate, br',
-                    'Connection': 'keep-alive',
-                    'Upgrade-Insecure-Requests': '1',
-                }
-                
-                response = await client.get('https://abantether.com/coins', headers=headers)
+            client = get_http_client('abantether')
+            headers = {
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+                'Accept-Language': 'fa-IR,fa;q=0.9,en-US;q=0.8,en;q=0.7',
+                'Accept-Encoding': 'gzip, deflate, br',
+                'Connection': 'keep-alive',
+                'Upgrade-Insecure-Requests': '1',
+            }
+            
+            response = await client.get('https://abantether.com/coins', headers=headers)
+            
+            if response.status_code == 200:
+                # Parse in a worker thread so a large page never blocks the event loop
+                prices = await asyncio.to_thread(parse_abantether_html, response.text)
                 
-                if response.status_code == 200:
-                    html_content = response.text
-                    soup = BeautifulSoup(html_content, 'html.parser')
-                    
-                    prices = {}
-                    
-                    # Method 1: Parse table rows
-                    table_rows = soup.find_all('tr')
-                    for row in table_rows:
-                        try:
-                            # Look for coin symbol link
-                            link = row.find('a', href=re.compile(r'/coin/[A-Z]+'))
-                            if not link:
-                                continue
-                            
-                            # Extract symbol from URL
-                            href = link.get('href', '')
-                            symbol_match = re.search(r'/coin/([A-Z]+)', href)
-                            if not symbol_match:
-                                continue
-                            
-                            symbol = symbol_match.group(1)
-                            if symbol not in COIN_MAP:
-                                continue
-                            
-                            coin_info = COIN_MAP[symbol]
-                            
-                            # Get all text from row
-                            row_text = row.get_text()
-                            
-                            # Extract buy price (خرید)
-                            price_match = re.search(r'([\d,]+)\s*خرید', row_text)
-                            if not price_match:
-                                continue
-                            
-                            price_tmn = float(price_match.group(1).replace(',', ''))
-                            
-                            # Extract 24h change
-                            change_match = re.search(r'([-+]?\d+\.?\d*)\s*%', row_text)
-                            change_24h = 0
-                            if change_match:
-                                # Get the first percentage (usually the daily change)
-                                changes = re.findall(r'([-+]?\d+\.?\d*)\s*%', row_text)
-                                if len(changes) >= 2:  # Get the 2nd one (daily change)
-                                    change_24h = float(changes[1])
-                                elif changes:
-                                    change_24h = float(changes[0])
-                            
-                            prices[coin_info['id']] = {
-                                'symbol': symbol,
-                                'name': coin_info['name'],
-                                'price_tmn': price_tmn,
-                                'change_24h': change_24h,
-                                'last_updated': datetime.now(timezone.utc).isoformat(),
-                                'source': 'abantether'
-                            }
-                            
-                            logger.info(f"✅ {symbol}: {price_tmn:,.0f} تومان ({change_24h:+.2f}%)")
-                            
-                        except Exception as e:
-                            logger.debug(f"Error parsing row: {str(e)}")
-                            continue
-                    
-                    if prices:
-                        logger.info(f"✅ Scraped {len(prices)} prices from Abantether")
-                        return prices
-                    else:
-                        logger.warning("No prices found in HTML")
-                        return {}
+                if prices:
+                    logger.info(f"✅ Scraped {len(prices)} prices from Abantether")
+                    return prices
                 else:
-                    logger.error(f"Failed to fetch Abantether page: {response.status_code}")
+                    logger.warning("No prices found in HTML")
                     return {}
+            else:
+                logger.error(f"Failed to fetch Abantether page: {response.status_code}")
+                return {}
             
         except Exception as e:
             logger.error(f"Error scraping Abantether page: {str(e)}")
             return {}
-    
-    async def _store_prices_in_db(self, prices: Dict):
-        """Store prices in MongoDB"""
-        try:
-            if self.db is None:
-                return
-            
-            # Store each price with timestamp
-            for coin_id, price_data in prices.items():
-                await self.db.crypto_prices.update_one(
-                    {'coin_id': coin_id},
-                    {
-                        '$set': {
-                            'coin_id': coin_id,
-                            'symbol': price_data['symbol'],
-                            'name': price_data['name'],
-                            'price_tmn': price_data['price_tmn'],
-                            'change_24h': price_data['change_24h'],
-                            'last_updated': price_data['last_updated'],
-                            'source': 'nobitex'
-                        }
-                    },
-                    upsert=True
-                )
-            
-            logger.info(f"✅ Stored {len(prices)} prices in database")
-            
-        except Exception as e:
-            logger.error(f"Error storing prices in DB: {str(e)}")
-    
-    async def get_prices_from_db(self) -> Dict:
-        """Get cached prices from database"""
-        try:
-            if self.db is None:
-                return self._get_fallback_prices()
-            
-            prices_cursor = self.db.crypto_prices.find({})
-            prices_list = await prices_cursor.to_list(length=None)
-            
-            if not prices_list:
-                # No cached prices, fetch fresh
-                return await self.scrape_nobitex_prices()
-            
-            prices = {}
-            for price_doc in prices_list:
-                coin_id = price_doc.get('coin_id')
-                prices[coin_id] = {
-                    'symbol': price_doc.get('symbol'),
-                    'name': price_doc.get('name'),
-                    'price_tmn': price_doc.get('price_tmn', 0),
-                    'change_24h': price_doc.get('change_24h', 0),
-                    'last_updated': price_doc.get('last_updated')
-                }
-            
-            return {'success': True, 'data': prices, 'from_cache': True}
-            
-        except Exception as e:
-            logger.error(f"Error getting prices from DB: {str(e)}")
-            return self._get_fallback_prices()
-    
-    async def get_coin_price(self, coin_id: str) -> Optional[Dict]:
-        """Get price for a specific coin"""
-        prices_data = await self.get_prices_from_db()
-        
-        if prices_data.get('success'):
-            return prices_data['data'].get(coin_id)
-        
-        return None
-    
-    def _get_fallback_prices(self) -> Dict:
-        """Return fallback prices in Toman (only used if Abantether is unavailable)"""
-        # WARNING: These are fallback prices only - real prices come from Abantether
-        fallback = {
-            'bitcoin': {'symbol': 'BTC', 'name': 'Bitcoin', 'price_tmn': 4200000000, 'change_24h': 1.5},
-            'ethereum': {'symbol': 'ETH', 'name': 'Ethereum', 'price_tmn': 165000000, 'change_24h': 2.1},
-            'tether': {'symbol': 'USDT', 'name': 'Tether', 'price_tmn': 67500, 'change_24h': 0.05},
-            'binancecoin': {'symbol': 'BNB', 'name': 'Binance Coin', 'price_tmn': 42000000, 'change_24h': 1.8},
-            'ripple': {'symbol': 'XRP', 'name': 'XRP', 'price_tmn': 45000, 'change_24h': -0.5},
-            'cardano': {'symbol': 'ADA', 'name': 'Cardano', 'price_tmn': 22000, 'change_24h': 3.2},
-            'solana': {'symbol': 'SOL', 'name': 'Solana', 'price_tmn': 8500000, 'change_24h': 4.1},
-            'dogecoin': {'symbol': 'DOGE', 'name': 'Dogecoin', 'price_tmn': 6800, 'change_24h': -1.2},
-            'polkadot': {'symbol': 'DOT', 'name': 'Polkadot', 'price_tmn': 310000, 'change_24h': 1.9},
-            'tron': {'symbol': 'TRX', 'name': 'TRON', 'price_tmn': 13500, 'change_24h': 0.8},
-        }
-        
-        for coin_id, data in fallback.items():
-            data['last_updated'] = datetime.now(timezone.utc).isoformat()
-        
-        logger.warning("⚠️  Using fallback prices")
-        return {'success': True, 'data': fallback, 'fallback': True}
-
-# Background task scheduler
-class PriceUpdateScheduler:
-    """Schedule regular price updates from Abantether"""
-    
-    def __init__(self, db):
-        self.db = db
-        self.price_service = NobitexPriceService(db)
-        self.is_running = False
-        
-    async def start(self):
-        """Start the background price update task"""
-        if self.is_running:
-            logger.info("Price scheduler already running")
-            return
-        
-        self.is_running = True
-        logger.info("🚀 Starting Abantether price update scheduler (every 30 minutes)")
-        
-        # Initial fetch
-        await self.price_service.scrape_nobitex_prices()
-        
-        # Schedule updates every 30 minutes
-        while self.is_running:
-            try:
-                await asyncio.sleep(30 * 60)  # 30 minutes
-                logger.info("⏰ Scheduled price update triggered")
-                await self.price_service.scrape_nobitex_prices()
-            except Exception as e:
-                logger.error(f"Error in price update scheduler: {str(e)}")
-                await asyncio.sleep(60)  # Wait 1 minute on error
-    
-    def stop(self):
-        """Stop the background task"""
-        self.is_running = False
-        logger.info("🛑 Stopping price update scheduler")
-
-# Global scheduler instance
-_scheduler = None
 
 def get_price_service(db) -> NobitexPriceService:
     """Get or create price service instance"""
     return NobitexPriceService(db)
-
-async def start_price_scheduler(db):
-    """Start the global price update scheduler"""
-    global _scheduler
-    if _scheduler is None:
-        _scheduler = PriceUpdateScheduler(db)
-        # Start in background
-        asyncio.create_task(_scheduler.start())
-    return _scheduler
-
-def stop_price_scheduler():
-    """Stop the global price update scheduler"""
-    global _scheduler
-    if _scheduler:
-        _scheduler.stop()
-        _scheduler = None
@@ -0,0 +1,511 @@
+"""
+Limit Order Book and Matching Engine
+Per-coin in-memory books with price-time priority that match limit orders
+against each other and against price book ticks; fills, order state and the
+balance and holding changes they settle are persisted behind the matching
+path by a write-behind journal
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo.errors import PyMongoError
+
+from timestamps import epoch_seconds
+
+logger = logging.getLogger(__name__)
+
+FILLS_COLLECTION = 'limit_order_fills'
+
+# Amounts below this are treated as fully filled
+DUST = 1e-12
+
+# New orders are looked up this far behind the newest one seen, so orders
+# inserted by other workers with slightly skewed clocks are not missed
+SYNC_SLACK = timedelta(seconds=30)
+
+class BookOrder:
+    """A resting or incoming limit order"""
+
+    __slots__ = ('id', 'user_id', 'coin_id', 'coin_symbol', 'side', 'price', 'remaining', 'filled', 'seq',
+                 'expires_at', 'status')
+
+    def __init__(self, order_id: str, user_id: str, coin_id: str, side: str, price: float,
+                 amount: float, filled: float = 0.0, seq: int = 0, expires_at: Optional[float] = None,
+                 coin_symbol: Optional[str] = None):
+        self.id = order_id
+        self.user_id = user_id
+        self.coin_id = coin_id
+        self.coin_symbol = coin_symbol
+        self.side = side  # 'buy' or 'sell'
+        self.price = price
+        self.remaining = amount
+        self.filled = filled
+        self.seq = seq
+        self.expires_at = expires_at
+        self.status = 'active'
+
+    @classmethod
+    def from_document(cls, document: Dict) -> 'BookOrder':
+        return cls(
+            document['id'],
+            document['user_id'],
+            document['coin_id'],
+            'buy' if document['order_type'] == 'limit_buy' else 'sell',
+            float(document['target_price_tmn']),
+            float(document.get('remaining_amount', document['amount_crypto'])),
+            float(document.get('filled_amount') or 0.0),
+            expires_at=epoch_seconds(document.get('expiry_date')),
+            coin_symbol=document.get('coin_symbol'),
+        )
+
+# (price, amount, buy order, sell order); the market side of a tick fill is None
+Fill = Tuple[float, float, Optional[BookOrder], Optional[BookOrder]]
+
+def reservation_leg(document: Dict) -> Tuple:
+    """The debit that backs a limit order: Toman for a buy, coins for a sell"""
+    amount = float(document.get('remaining_amount', document['amount_crypto']))
+    if document['order_type'] == 'limit_buy':
+        return ('balance', document['user_id'], -amount * float(document['target_price_tmn']))
+    return ('debit', document['user_id'], document['coin_symbol'], amount)
+
+def release_legs(order: BookOrder) -> List[Tuple]:
+    """Return what is still reserved for a cancelled or expired order"""
+    if order.remaining <= DUST:
+        return []
+    if order.side == 'buy':
+        return [('balance', order.user_id, order.remaining * order.price)]
+    return [('debit', order.user_id, order.coin_symbol, -order.remaining)]
+
+def fill_legs(fill: Fill) -> List[Tuple]:
+    """Settle a fill against the reservations of the orders in it
+
+    The buyer gets the coins at the fill price plus back whatever was reserved
+    above it; the seller gets the Toman. The platform is the other side of a
+    price tick fill, as it is for market orders.
+    """
+    price, amount, buy, sell = fill
+    legs = []
+    if buy is not None:
+        legs.append(('credit', buy.user_id, buy.coin_symbol, amount, price, buy.coin_id))
+        if buy.price > price:
+            legs.append(('balance', buy.user_id, (buy.price - price) * amount))
+    if sell is not None:
+        legs.append(('balance', sell.user_id, price * amount))
+    return legs
+
+class OrderBook:
+    """Bids and asks of one coin as heaps keyed by (price, arrival)
+
+    Cancelled, filled and expired orders are removed lazily when they reach
+    the top of a heap; the heaps are compacted once dead entries dominate.
+    """
+
+    def __init__(self, coin_id: str):
+        self.coin_id = coin_id
+        self._bids: List[Tuple[float, int, BookOrder]] = []  # (-price, seq, order)
+        self._asks: List[Tuple[float, int, BookOrder]] = []  # (price, seq, order)
+        self.orders: Dict[str, BookOrder] = {}
+        self.expired: List[BookOrder] = []
+        self._dead = 0
+
+    def _best(self, heap: List, now: float) -> Optional[BookOrder]:
+        while heap:
+            order = heap[0][2]
+            if order.status == 'active' and order.expires_at is not None and order.expires_at <= now:
+                order.status = 'expired'
+                del self.orders[order.id]
+                self._dead += 1
+                self.expired.append(order)
+            if order.status == 'active':
+                return order
+            heapq.heappop(heap)
+            self._dead -= 1
+        return None
+
+    def _take(self, order: BookOrder, amount: float):
+        order.remaining -= amount
+        order.filled += amount
+        if order.remaining <= DUST:
+            order.remaining = 0.0
+            order.status = 'filled'
+            if self.orders.pop(order.id, None) is not None:
+                self._dead += 1
+
+    def add(self, order: BookOrder, now: float) -> List[Fill]:
+        """Match an incoming order against the opposite side, then rest the rest"""
+        fills = []
+        opposite = self._asks if order.side == 'buy' else self._bids
+
+        while order.remaining > DUST:
+            best = self._best(opposite, now)
+            if best is None or (best.price > order.price if order.side == 'buy' else best.price < order.price):
+                break
+            amount = min(order.remaining, best.remaining)
+            # The resting order sets the price
+            fills.append((best.price, amount, order, best) if order.side == 'buy' else (best.price, amount, best, order))
+            self._take(best, amount)
+            order.remaining -= amount
+            order.filled += amount
+
+        if order.remaining > DUST:
+            self.orders[order.id] = order
+            if order.side == 'buy':
+                heapq.heappush(self._bids, (-order.price, order.seq, order))
+            else:
+                heapq.heappush(self._asks, (order.price, order.seq, order))
+        else:
+            order.remaining = 0.0
+            order.status = 'filled'
+        return fills
+
+    def cancel(self, order_id: str) -> Optional[BookOrder]:
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return None
+        order.status = 'cancelled'
+        self._dead += 1
+        self._compact()
+        return order
+
+    def match_price(self, price: float, now: float) -> List[Fill]:
+        """Fill every resting order the market price has crossed, at that price"""
+        fills = []
+        while True:
+            best = self._best(self._bids, now)
+            if best is None or best.price < price:
+                break
+            fills.append((price, best.remaining, best, None))
+            self._take(best, best.remaining)
+        while True:
+            best = self._best(self._asks, now)
+            if best is None or best.price > price:
+                break
+            fills.append((price, best.remaining, None, best))
+            self._take(best, best.remaining)
+        self._compact()
+        return fills
+
+    def _compact(self):
+        if self._dead > 1024 and self._dead > len(self.orders):
+            self._bids = [entry for entry in self._bids if entry[2].status == 'active']
+            self._asks = [entry for entry in self._asks if entry[2].status == 'active']
+            heapq.heapify(self._bids)
+            heapq.heapify(self._asks)
+            self._dead = 0
+
+    def depth(self, levels: int = 10) -> Dict[str, List[List[float]]]:
+        """Aggregated [price, amount] levels, best first"""
+        def aggregate(entries, sign):
+            result: List[List[float]] = []
+            for key, _, order in sorted(entry for entry in entries if entry[2].status == 'active'):
+                if result and result[-1][0] == key * sign:
+                    result[-1][1] += order.remaining
+                elif len(result) == levels:
+                    break
+                else:
+                    result.append([key * sign, order.remaining])
+            return result
+
+        return {'bids': aggregate(self._bids, -1), 'asks': aggregate(self._asks, 1)}
+
+class OrderJournal:
+    """Write-behind persistence of fills, order state and their settlement
+
+    Order state is coalesced per order id, so a busy order costs one update
+    per flush however often it traded. Each flush hands the fills, the legs
+    that settle them and the order states to the settlement engine as one
+    plan, retried under the same id until it is applied, so assets, fills
+    and order state never disagree and nothing is applied twice. Users
+    whose wallet or holdings a plan changed leave user_cache once it is in.
+    """
+
+    def __init__(self, db, settlement, user_cache=None):
+        self.db = db
+        self.settlement = settlement
+        self.user_cache = user_cache
+        self._states: Dict[str, Dict] = {}
+        self._fills: List[Dict] = []
+        self._legs: List[Tuple] = []
+        # (plan id, legs, fills, states) taken by a flush and not applied yet
+        self._batch: Optional[Tuple[str, List[Tuple], List[Dict], Dict[str, Dict]]] = None
+        self.flushed_states = 0
+        self.flushed_fills = 0
+
+    @property
+    def pending(self) -> int:
+        pending = len(self._states) + len(self._fills)
+        if self._batch is not None:
+            pending += len(self._batch[2]) + len(self._batch[3])
+        return pending
+
+    def order_state(self, order: BookOrder):
+        self._states[order.id] = {
+            'status': order.status,
+            'filled_amount': order.filled,
+            'remaining_amount': order.remaining,
+            'updated_at': datetime.now(timezone.utc)
+        }
+        if order.status in ('cancelled', 'expired'):
+            self._legs.extend(release_legs(order))
+
+    def fill(self, coin_id: str, fill: Fill):
+        price, amount, buy, sell = fill
+        self._fills.append({
+            'id': str(uuid.uuid4()),
+            'coin_id': coin_id,
+            'price_tmn': price,
+            'amount': amount,
+            'buy_order_id': buy.id if buy else None,
+            'sell_order_id': sell.id if sell else None,
+            'liquidity': 'book' if buy and sell else 'market',
+            'created_at': datetime.now(timezone.utc)
+        })
+        self._legs.extend(fill_legs(fill))
+
+    async def flush(self):
+        if self._batch is None:
+            if not self._states and not self._fills and not self._legs:
+                return
+            self._batch = (uuid.uuid4().hex, self._legs, self._fills, self._states)
+            self._legs, self._fills, self._states = [], [], {}
+
+        plan_id, legs, fills, states = self._batch
+        try:
+            await self.settlement.apply(
+                plan_id, legs,
+                marks=[['limit_orders', order_id, state] for order_id, state in states.items()],
+                inserts=[[FILLS_COLLECTION, fills]] if fills else []
+            )
+        except PyMongoError as e:
+            # Retried under the same plan id, so a partly applied batch is finished, not repeated
+            logger.error(f"Error flushing order journal: {str(e)}")
+            return
+        self._batch = None
+        if self.user_cache is not None:
+            for user_id in {leg[1] for leg in legs}:
+                self.user_cache.invalidate(user_id)
+        self.flushed_states += len(states)
+        self.flushed_fills += len(fills)
+
+class MatchingEngine:
+    """Owns the order books of this process
+
+    With a lease only the lease holder matches: other workers insert orders
+    and cancellation requests into MongoDB and the holder picks them up on
+    its next sync. Books are rebuilt from limit_orders whenever this process
+    becomes the holder.
+
+    Every order in the book is backed by a reservation taken when it was
+    placed, so fills settle against funds that are known to exist.
+    """
+
+    def __init__(self, db, settlement, lease=None, flush_interval: float = 0.5, user_cache=None):
+        self.db = db
+        self.lease = lease
+        self.flush_interval = flush_interval
+        self.journal = OrderJournal(db, settlement, user_cache)
+        self.settlement = settlement
+        self.user_cache = user_cache
+        self.books: Dict[str, OrderBook] = {}
+        self._locations: Dict[str, str] = {}  # resting order id -> coin_id
+        self._seen: Dict[str, float] = {}  # order id -> created_at epoch, for sync
+        self._watermark: Optional[datetime] = None
+        self._sequence = itertools.count()
+        self._loaded = False
+        self._task: Optional[asyncio.Task] = None
+        self.operations = 0
+        self.fills = 0
+        self.unfunded = 0
+
+    @property
+    def is_owner(self) -> bool:
+        return self.lease is None or self.lease.is_leader
+
+    async def _funded(self, document: Dict) -> bool:
+        """Reserve for an order stored before orders were reserved at placement"""
+        if document.get('reserved'):
+            return True
+        if await self.settlement.reserve(reservation_leg(document)):
+            if self.user_cache is not None:
+                self.user_cache.invalidate(document['user_id'])
+            await self.db.limit_orders.update_one({'id': document['id']}, {'$set': {'reserved': True}})
+            return True
+        await self.db.limit_orders.update_one(
+            {'id': document['id'], 'status': 'active'},
+            {'$set': {'status': 'cancelled', 'cancel_reason': 'insufficient_funds',
+                      'updated_at': datetime.now(timezone.utc)}}
+        )
+        self.unfunded += 1
+        logger.warning(f"⚠️  Limit order {document['id']} cancelled: nothing left to reserve for it")
+        return False
+
+    def _book(self, coin_id: str) -> OrderBook:
+        book = self.books.get(coin_id)
+        if book is None:
+            book = self.books[coin_id] = OrderBook(coin_id)
+        return book
+
+    def _record(self, book: OrderBook, fills: List[Fill]):
+        """Journal the fills and the state of every order they or expiry touched"""
+        touched = {}
+        for fill in fills:
+            self.journal.fill(book.coin_id, fill)
+            for order in fill[2:]:
+                if order is not None:
+                    touched[order.id] = order
+        for order in book.expired:
+            touched[order.id] = order
+        book.expired.clear()
+
+        for order in touched.values():
+            self.journal.order_state(order)
+            if order.status != 'active':
+                self._locations.pop(order.id, None)
+        self.fills += len(fills)
+
+    def _add(self, document: Dict) -> BookOrder:
+        order = BookOrder.from_document(document)
+        order.seq = next(self._sequence)
+        book = self._book(order.coin_id)
+        fills = book.add(order, time.time())
+        if order.status == 'active':
+            self._locations[order.id] = order.coin_id
+        # A resting order without fills is already stored as it is
+        self._record(book, fills)
+        self._seen[order.id] = epoch_seconds(document.get('created_at')) or time.time()
+        self.operations += 1
+        return order
+
+    def submit(self, document: Dict) -> Optional[BookOrder]:
+        """Match a newly inserted limit order; None when another process owns the books
+
+        The insert can be picked up by sync() before this call, in which case
+        the order is already in the book and is not added again.
+        """
+        if not self.is_owner or not self._loaded:
+            return None
+        if document['id'] in self._seen:
+            coin_id = self._locations.get(document['id'])
+            return self.books[coin_id].orders.get(document['id']) if coin_id else None
+        return self._add(document)
+
+    def cancel(self, order_id: str) -> Optional[BookOrder]:
+        """Remove a resting order; None when it is not resting in this process"""
+        coin_id = self._locations.pop(order_id, None)
+        if coin_id is None:
+            return None
+        order = self.books[coin_id].cancel(order_id)
+        if order is not None:
+            self.journal.order_state(order)
+            self.operations += 1
+        return order
+
+    async def on_prices(self, prices: Dict[str, Dict]):
+        """Price feed listener - fill resting orders the new prices crossed"""
+        if not self._loaded:
+            return
+        now = time.time()
+        for coin_id, data in prices.items():
+            book = self.books.get(coin_id)
+            if book is not None and data.get('price_tmn'):
+                self._record(book, book.match_price(data['price_tmn'], now))
+
+    async def rebuild(self):
+        """Load every active limit order in arrival order"""
+        self.books.clear()
+        self._locations.clear()
+        self._seen.clear()
+        self._watermark = None
+        count = 0
+        async for document in self.db.limit_orders.find({'status': 'active'}, {'_id': 0}).sort([('created_at', 1), ('id', 1)]):
+            self._advance(document.get('created_at'))
+            if await self._funded(document):
+                self._add(document)
+                count += 1
+        self._loaded = True
+        logger.info(f"✅ Order books rebuilt: {count} active limit orders in {len(self.books)} books")
+
+    def _advance(self, created_at: Optional[datetime]):
+        if isinstance(created_at, datetime) and (self._watermark is None or created_at > self._watermark):
+            self._watermark = created_at
+
+    async def sync(self):
+        """Pick up orders and cancellation requests written by other workers"""
+        query: Dict[str, Any] = {'status': 'active'}
+        if self._watermark is not None:
+            query['created_at'] = {'$gte': self._watermark - SYNC_SLACK}
+        async for document in self.db.limit_orders.find(query, {'_id': 0}).sort([('created_at', 1), ('id', 1)]):
+            self._advance(document.get('created_at'))
+            if document['id'] not in self._seen and await self._funded(document):
+                self._add(document)
+
+        async for document in self.db.limit_orders.find({'status': 'active', 'cancel_requested': True}, {'_id': 0, 'id': 1}):
+            self.cancel(document['id'])
+
+        if self._watermark is not None:
+            horizon = epoch_seconds(self._watermark - 2 * SYNC_SLACK)
+            self._seen = {order_id: created_at for order_id, created_at in self._seen.items() if created_at >= horizon}
+
+    async def _run(self):
+        while True:
+            try:
+                if self.is_owner and not self._loaded:
+                    await self.rebuild()
+                elif not self.is_owner and self._loaded:
+                    # Lost the lease - hand over with everything persisted
+                    self._loaded = False
+                    await self.journal.flush()
+                    self.books.clear()
+                    self._locations.clear()
+                    logger.info("🛑 Order books released to another worker")
+
+                if self._loaded:
+                    await self.sync()
+                await self.journal.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Matching engine loop failed: {str(e)}")
+            await asyncio.sleep(self.flush_interval)
+
+    def start(self):
+        if self._task is None:
+            if self.lease is not None:
+                self.lease.start()
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"🔄 Matching engine started (journal flush every {self.flush_interval}s)")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.journal.flush()
+        if self.lease is not None:
+            await self.lease.stop()
+
+    def depth(self, coin_id: str, levels: int = 10) -> Optional[Dict]:
+        book = self.books.get(coin_id)
+        return book.depth(levels) if book is not None else None
+
+    def get_stats(self) -> Dict:
+        return {
+            'owner': self.is_owner,
+            'loaded': self._loaded,
+            'books': len(self.books),
+            'resting_orders': len(self._locations),
+            'operations': self.operations,
+            'fills': self.fills,
+            'unfunded': self.unfunded,
+            'journal_pending': self.journal.pending,
+            'journal_flushed_states': self.journal.flushed_states,
+            'journal_flushed_fills': self.journal.flushed_fills
+        }
@@ -0,0 +1,387 @@
+"""
+Platform Statistics Materialized View
+Dashboard counters maintained with $inc on every write, hourly/daily volume
+buckets, and a periodic reconciliation job that checks them against the
+source collections
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import ReturnDocument, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+STATS_COLLECTION = 'platform_stats'
+BUCKETS_COLLECTION = 'platform_stats_buckets'
+GLOBAL_ID = 'global'
+
+# counter name -> (source collection, equality match, summed field or None to count)
+COUNTERS = {
+    'users_total': ('users', {}, None),
+    'users_active': ('users', {'is_active': True}, None),
+    'users_suspended': ('users', {'is_suspended': True}, None),
+    'users_admin': ('users', {'is_admin': True}, None),
+    'kyc_level_0': ('users', {'kyc_level': 0}, None),
+    'kyc_level_1': ('users', {'kyc_level': 1}, None),
+    'kyc_level_2': ('users', {'kyc_level': 2}, None),
+    'kyc_pending': ('users', {'kyc_status': 'pending'}, None),
+    'deposits_pending': ('deposit_requests', {'status': 'pending'}, None),
+    'deposits_approved_amount': ('deposit_requests', {'status': 'approved'}, 'amount'),
+    'orders_total': ('trading_orders', {}, None),
+    'orders_pending': ('trading_orders', {'status': 'pending'}, None),
+    'cards_active': ('card_numbers', {'is_active': True}, None),
+}
+
+# Same shape, bucketed by the source document's created_at
+BUCKET_COUNTERS = {
+    'registrations': ('users', {}, None),
+    'orders': ('trading_orders', {}, None),
+    'completed_orders': ('trading_orders', {'status': 'completed'}, None),
+    'volume_tmn': ('trading_orders', {}, 'total_value_tmn'),
+}
+
+BUCKET_FORMATS = {
+    'hour': '%Y-%m-%dT%H',
+    'day': '%Y-%m-%d',
+}
+
+def _as_datetime(value: Any) -> datetime:
+    """Normalise stored created_at values (datetime or ISO string) to aware UTC"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            value = None
+    if not isinstance(value, datetime):
+        return datetime.now(timezone.utc)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def _bucket_start(moment: datetime, granularity: str) -> datetime:
+    moment = moment.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if granularity == 'day' else moment
+
+def _matches(document: Optional[Dict], match: Dict) -> bool:
+    if document is None:
+        return False
+    return all(
+        document.get(field) == value and isinstance(document.get(field), bool) == isinstance(value, bool)
+        for field, value in match.items()
+    )
+
+def _contribution(document: Optional[Dict], match: Dict, field: Optional[str]) -> float:
+    """How much one document adds to a counter"""
+    if not _matches(document, match):
+        return 0
+    if field is None:
+        return 1
+    return document.get(field) or 0
+
+def _match_expression(match: Dict) -> Dict:
+    """Aggregation expression equivalent of an equality match"""
+    if not match:
+        return {'$literal': True}
+    return {'$and': [{'$eq': [f'${field}', value]} for field, value in match.items()]}
+
+def _tracked_fields(collection_name: str) -> Dict[str, int]:
+    """Projection of every field the counters of a collection depend on"""
+    fields = {'_id': 0, 'created_at': 1, 'user_id': 1}
+    for source, match, field in list(COUNTERS.values()) + list(BUCKET_COUNTERS.values()):
+        if source == collection_name:
+            fields.update({name: 1 for name in match})
+            if field:
+                fields[field] = 1
+    return fields
+
+def _apply_set(document: Dict, update: Dict) -> Dict:
+    """Document as it looks after a $set-only update"""
+    return {**document, **update.get('$set', {})}
+
+class PlatformStats:
+    """Materialized dashboard counters in a single platform_stats document
+
+    With a lease only the holder runs the periodic reconciliation.
+    """
+
+    def __init__(self, db, hourly_retention_days: int = 35, rebuild_window_hours: int = 48, lease=None):
+        self.db = db
+        self.lease = lease
+        self.hourly_retention = timedelta(days=hourly_retention_days)
+        self.rebuild_window = timedelta(hours=rebuild_window_hours)
+        self._task: Optional[asyncio.Task] = None
+        self.last_drift: Dict[str, float] = {}
+
+    def _gauges(self) -> Dict:
+        """Time-relative values that cannot be incremented; refreshed on reconcile"""
+        since = (datetime.now(timezone.utc) - timedelta(days=30)).isoformat()
+        return {
+            'users_recently_active': ('users', {'last_login': {'$gte': since}}, None),
+        }
+
+    # ---------- write path ----------
+
+    async def record(self, collection_name: str, before: Optional[Dict], after: Optional[Dict]):
+        """Apply the counter delta of one document changing from before to after
+
+        Pass before=None for inserts and after=None for deletes. Errors are
+        logged, never raised - reconciliation repairs any missed update.
+        """
+        try:
+            counters = self._delta(COUNTERS, collection_name, before, after)
+            bucket_counters = self._delta(BUCKET_COUNTERS, collection_name, before, after)
+            updates = []
+
+            if counters:
+                updates.append(self.db[STATS_COLLECTION].update_one(
+                    {'_id': GLOBAL_ID},
+                    {'$inc': counters, '$set': {'updated_at': datetime.now(timezone.utc)}},
+                    upsert=True
+                ))
+
+            if bucket_counters:
+                created_at = _as_datetime((after or before).get('created_at'))
+                new_order = collection_name == 'trading_orders' and before is None and after is not None
+                for granularity in BUCKET_FORMATS:
+                    update = {'$inc': bucket_counters, '$setOnInsert': self._bucket_fields(created_at, granularity)}
+                    if new_order:
+                        update['$max'] = {'max_value_tmn': after.get('total_value_tmn') or 0}
+                        if granularity == 'hour':
+                            update['$addToSet'] = {'traders': after.get('user_id')}
+                    updates.append(self.db[BUCKETS_COLLECTION].update_one(
+                        {'_id': self._bucket_id(created_at, granularity)}, update, upsert=True
+                    ))
+
+            if updates:
+                await asyncio.gather(*updates)
+        except Exception as e:
+            logger.error(f"Error updating platform stats for {collection_name}: {str(e)}")
+
+    async def record_many(self, collection_name: str, changes: List[Tuple[Dict, Optional[Dict]]]):
+        """record() for many updated or deleted documents
+
+        Deltas are summed first, so the whole batch costs one counter write
+        plus one bulk_write over the touched buckets.
+        """
+        try:
+            counters: Dict[str, float] = {}
+            buckets: Dict[str, Tuple[Dict, Dict]] = {}
+
+            for before, after in changes:
+                for name, change in self._delta(COUNTERS, collection_name, before, after).items():
+                    counters[name] = counters.get(name, 0) + change
+
+                bucket_counters = self._delta(BUCKET_COUNTERS, collection_name, before, after)
+                if not bucket_counters:
+                    continue
+                created_at = _as_datetime((after or before).get('created_at'))
+                for granularity in BUCKET_FORMATS:
+                    increments, _ = buckets.setdefault(
+                        self._bucket_id(created_at, granularity),
+                        ({}, self._bucket_fields(created_at, granularity))
+                    )
+                    for name, change in bucket_counters.items():
+                        increments[name] = increments.get(name, 0) + change
+
+            counters = {name: change for name, change in counters.items() if change}
+            if counters:
+                await self.db[STATS_COLLECTION].update_one(
+                    {'_id': GLOBAL_ID},
+                    {'$inc': counters, '$set': {'updated_at': datetime.now(timezone.utc)}},
+                    upsert=True
+                )
+
+            operations = [
+                UpdateOne({'_id': bucket_id}, {'$inc': increments, '$setOnInsert': fields}, upsert=True)
+                for bucket_id, (increments, fields) in buckets.items()
+                if any(increments.values())
+            ]
+            if operations:
+                await self.db[BUCKETS_COLLECTION].bulk_write(operations, ordered=False)
+        except Exception as e:
+            logger.error(f"Error updating platform stats for {collection_name}: {str(e)}")
+
+    async def tracked_update(self, collection_name: str, query: Dict, update: Dict) -> Optional[Dict]:
+        """update_one that also records the counter delta
+
+        Returns the tracked fields of the document before the update, or None
+        when nothing matched. Counters follow $set changes only.
+        """
+        before = await self.db[collection_name].find_one_and_update(
+            query, update, projection=_tracked_fields(collection_name),
+            return_document=ReturnDocument.BEFORE
+        )
+        if before is not None:
+            await self.record(collection_name, before, _apply_set(before, update))
+        return before
+
+    async def tracked_delete(self, collection_name: str, query: Dict) -> Optional[Dict]:
+        """delete_one that also records the counter delta"""
+        before = await self.db[collection_name].find_one_and_delete(
+            query, projection=_tracked_fields(collection_name)
+        )
+        if before is not None:
+            await self.record(collection_name, before, None)
+        return before
+
+    @staticmethod
+    def _delta(definitions: Dict, collection_name: str, before: Optional[Dict], after: Optional[Dict]) -> Dict:
+        delta = {}
+        for name, (source, match, field) in definitions.items():
+            if source != collection_name:
+                continue
+            change = _contribution(after, match, field) - _contribution(before, match, field)
+            if change:
+                delta[name] = change
+        return delta
+
+    def _bucket_id(self, moment: datetime, granularity: str) -> str:
+        return f"{granularity}:{moment.astimezone(timezone.utc).strftime(BUCKET_FORMATS[granularity])}"
+
+    def _bucket_fields(self, moment: datetime, granularity: str) -> Dict:
+        start = _bucket_start(moment, granularity)
+        fields = {'granularity': granularity, 'start': start}
+        if granularity == 'hour':
+            fields['expires_at'] = start + self.hourly_retention
+        return fields
+
+    # ---------- read path ----------
+
+    async def get_counters(self) -> Dict:
+        """The materialized counters, reconciled first if never initialised"""
+        counters = await self.db[STATS_COLLECTION].find_one({'_id': GLOBAL_ID})
+        if counters is None or 'reconciled_at' not in counters:
+            await self.reconcile()
+            counters = await self.db[STATS_COLLECTION].find_one({'_id': GLOBAL_ID})
+        return counters or {}
+
+    async def get_bucket(self, granularity: str, moment: Optional[datetime] = None) -> Dict:
+        """A single hourly or daily bucket, {} when it has no activity"""
+        moment = moment or datetime.now(timezone.utc)
+        bucket = await self.db[BUCKETS_COLLECTION].find_one({'_id': self._bucket_id(moment, granularity)})
+        return bucket or {}
+
+    async def get_buckets(self, granularity: str, since: datetime) -> List[Dict]:
+        """Buckets starting at or after the bucket that contains since"""
+        return await self.db[BUCKETS_COLLECTION].find({
+            'granularity': granularity,
+            'start': {'$gte': _bucket_start(since, granularity)}
+        }).to_list(None)
+
+    # ---------- reconciliation ----------
+
+    async def reconcile(self) -> Dict[str, float]:
+        """Recompute counters and recent buckets from the source collections
+
+        Returns the drift (truth - materialized) of every counter that was off.
+        Writes racing with a reconcile may leave a small drift that the next
+        run corrects.
+        """
+        definitions = {**COUNTERS, **self._gauges()}
+        collections = sorted({source for source, _, _ in definitions.values()})
+
+        results = await asyncio.gather(*[
+            self._aggregate_counters(collection_name, {
+                name: definition for name, definition in definitions.items() if definition[0] == collection_name
+            })
+            for collection_name in collections
+        ])
+        truth = {name: value for result in results for name, value in result.items()}
+
+        current = await self.db[STATS_COLLECTION].find_one({'_id': GLOBAL_ID}) or {}
+        drift = {
+            name: truth[name] - current.get(name, 0)
+            for name in COUNTERS
+            if 'reconciled_at' in current and abs(truth[name] - current.get(name, 0)) > 1e-6
+        }
+        if drift:
+            logger.warning(f"⚠️  Platform stats drift corrected: {drift}")
+
+        now = datetime.now(timezone.utc)
+        await self.db[STATS_COLLECTION].update_one(
+            {'_id': GLOBAL_ID},
+            {'$set': {**truth, 'reconciled_at': now, 'updated_at': now}},
+            upsert=True
+        )
+        await self._rebuild_buckets(_bucket_start(now - self.rebuild_window, 'day'))
+
+        self.last_drift = drift
+        return drift
+
+    async def _aggregate_counters(self, collection_name: str, definitions: Dict) -> Dict[str, float]:
+        """Ground truth for counters of one collection in a single $facet round-trip"""
+        facets = {
+            name: [{'$match': match}, {'$group': {'_id': None, 'value': {'$sum': f'${field}' if field else 1}}}]
+            for name, (_, match, field) in definitions.items()
+        }
+        result = await self.db[collection_name].aggregate([{'$facet': facets}]).to_list(1)
+        results = result[0] if result else {}
+        # A facet that matched nothing has no result document
+        return {name: (results.get(name) or [{}])[0].get('value', 0) for name in definitions}
+
+    async def _rebuild_buckets(self, since: datetime):
+        """Overwrite hourly/daily buckets from since onwards with recomputed values"""
+        collections = sorted({source for source, _, _ in BUCKET_COUNTERS.values()})
+
+        for granularity, date_format in BUCKET_FORMATS.items():
+            buckets: Dict[str, Dict] = {}
+
+            for collection_name in collections:
+                group = {'_id': {'$dateToString': {'format': date_format, 'date': '$created_at'}}}
+                for name, (source, match, field) in BUCKET_COUNTERS.items():
+                    if source == collection_name:
+                        value = f'${field}' if field else 1
+                        group[name] = {'$sum': {'$cond': [_match_expression(match), value, 0]}}
+                if collection_name == 'trading_orders':
+                    group['max_value_tmn'] = {'$max': '$total_value_tmn'}
+                    if granularity == 'hour':
+                        group['traders'] = {'$addToSet': '$user_id'}
+
+                async for row in self.db[collection_name].aggregate([
+                    # $dateToString fails on the ISO strings some older documents store
+                    {'$match': {'created_at': {'$gte': since, '$type': 'date'}}},
+                    {'$group': group}
+                ]):
+                    key = row.pop('_id')
+                    if key:
+                        buckets.setdefault(key, {}).update(row)
+
+            for key, values in buckets.items():
+                start = datetime.strptime(key, date_format).replace(tzinfo=timezone.utc)
+                await self.db[BUCKETS_COLLECTION].update_one(
+                    {'_id': f'{granularity}:{key}'},
+                    {'$set': {**values, **self._bucket_fields(start, granularity)}},
+                    upsert=True
+                )
+
+    async def _reconcile_loop(self, interval: int):
+        if self.lease is not None:
+            # Settle leadership first so the holder reconciles right away
+            await self.lease.acquire()
+        while True:
+            try:
+                if self.lease is None or self.lease.is_leader:
+                    await self.reconcile()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Platform stats reconciliation failed: {str(e)}")
+            await asyncio.sleep(interval)
+
+    def start(self, interval: int = 300):
+        """Reconcile now and then every interval seconds in the background"""
+        if self._task is None:
+            if self.lease is not None:
+                self.lease.start()
+            self._task = asyncio.create_task(self._reconcile_loop(interval))
+            logger.info(f"✅ Platform stats reconciliation every {interval}s")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.lease is not None:
+            await self.lease.stop()
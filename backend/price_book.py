@@ -0,0 +1,363 @@
+"""
+Price Book Service
+One in-memory snapshot of Toman prices, fed by Wallex, Nobitex and Abantether
+in the background and read by every price consumer without network I/O
+"""
+import asyncio
+import logging
+import statistics
+import time
+import uuid
+from datetime import datetime, timezone
+from types import MappingProxyType
+from typing import Awaitable, Callable, Dict, List, Mapping, Optional
+
+from timestamps import epoch_seconds
+
+logger = logging.getLogger(__name__)
+
+# Seed prices so the book is usable before (or without) any live source
+STATIC_PRICES = {
+    'bitcoin': {'symbol': 'BTC', 'name': 'Bitcoin', 'price_tmn': 12959940780, 'change_24h': -6.38},
+    'ethereum': {'symbol': 'ETH', 'name': 'Ethereum', 'price_tmn': 445134743, 'change_24h': -10.38},
+    'tether': {'symbol': 'USDT', 'name': 'Tether', 'price_tmn': 115090, 'change_24h': 0.19},
+    'binancecoin': {'symbol': 'BNB', 'name': 'Binance Coin', 'price_tmn': 123989909, 'change_24h': -12.76},
+    'ripple': {'symbol': 'XRP', 'name': 'XRP', 'price_tmn': 264664, 'change_24h': -17.75},
+    'cardano': {'symbol': 'ADA', 'name': 'Cardano', 'price_tmn': 67454, 'change_24h': -24.91},
+    'solana': {'symbol': 'SOL', 'name': 'Solana', 'price_tmn': 21460832, 'change_24h': -13.72},
+    'dogecoin': {'symbol': 'DOGE', 'name': 'Dogecoin', 'price_tmn': 7500, 'change_24h': -1.2},
+    'polkadot': {'symbol': 'DOT', 'name': 'Polkadot', 'price_tmn': 314771, 'change_24h': -29.46},
+    'tron': {'symbol': 'TRX', 'name': 'TRON', 'price_tmn': 36655, 'change_24h': -5.03},
+    'usd-coin': {'symbol': 'USDC', 'name': 'USD Coin', 'price_tmn': 114641, 'change_24h': -0.07},
+    'chainlink': {'symbol': 'LINK', 'name': 'Chainlink', 'price_tmn': 1859854, 'change_24h': -24.6},
+    'litecoin': {'symbol': 'LTC', 'name': 'Litecoin', 'price_tmn': 10899023, 'change_24h': -19.48},
+    'avalanche-2': {'symbol': 'AVAX', 'name': 'Avalanche', 'price_tmn': 2445777, 'change_24h': -24.28},
+    'stellar': {'symbol': 'XLM', 'name': 'Stellar', 'price_tmn': 32731, 'change_24h': -23.37},
+}
+
+PriceSource = Callable[[], Awaitable[Dict]]
+
+class PriceBook:
+    """Versioned, copy-on-write snapshot of coin_id -> Toman price entry
+
+    Readers get an immutable mapping and never wait on writers; publish()
+    builds a new mapping and swaps it in with a single assignment. Entries
+    carry quoted_at, the time a live source last quoted the price; seed
+    entries have none, so get_fresh_price() never returns them.
+    """
+
+    def __init__(self, seed: Optional[Dict[str, Dict]] = None):
+        # Versions count from 0 in every process; positions carry the epoch so
+        # one minted by another worker or before a restart is recognised
+        self.epoch = uuid.uuid4().hex[:12]
+        self.version = 0
+        self.updated_at: Optional[datetime] = None
+        self._snapshot: Mapping[str, Dict] = MappingProxyType({})
+        if seed:
+            self.publish(seed, source='static')
+
+    def snapshot(self) -> Mapping[str, Dict]:
+        """The current immutable coin_id -> entry mapping"""
+        return self._snapshot
+
+    def get(self, coin_id: str) -> Optional[Dict]:
+        return self._snapshot.get(coin_id)
+
+    def get_price(self, coin_id: str) -> Optional[float]:
+        """Toman price of a coin, or None when the book has no quote"""
+        entry = self._snapshot.get(coin_id)
+        return entry['price_tmn'] if entry else None
+
+    def quote_age(self, coin_id: str) -> Optional[float]:
+        """Seconds since a live source quoted the coin, None for seed prices and unknown coins"""
+        entry = self._snapshot.get(coin_id)
+        quoted_at = epoch_seconds(entry.get('quoted_at')) if entry else None
+        return time.time() - quoted_at if quoted_at is not None else None
+
+    def get_fresh_price(self, coin_id: str, max_age: float) -> Optional[float]:
+        """Toman price of a coin quoted by a live source within max_age seconds, else None"""
+        age = self.quote_age(coin_id)
+        return self._snapshot[coin_id]['price_tmn'] if age is not None and age <= max_age else None
+
+    def position(self) -> str:
+        """Opaque "<epoch>.<version>" marker of the current snapshot for clients to resume from"""
+        return f"{self.epoch}.{self.version}"
+
+    def version_at(self, position: Optional[str]) -> Optional[int]:
+        """Book version of a position from this book, None when it is from elsewhere or invalid"""
+        epoch, _, version = (position or '').partition('.')
+        if epoch != self.epoch or not version.isdigit() or int(version) > self.version:
+            return None
+        return int(version)
+
+    def changes_since(self, version: int) -> Dict[str, Dict]:
+        """Entries whose price changed after the given book version"""
+        snapshot = self._snapshot
+        return {coin_id: entry for coin_id, entry in snapshot.items() if entry['version'] > version}
+
+    def publish(self, prices: Dict[str, Dict], source: str) -> int:
+        """Merge new entries into a fresh snapshot and return the new version
+
+        Coins missing from prices keep their previous entry. Each entry
+        records the book version in which its price or source timestamp
+        last changed; when no entry changed, the other fields (such as
+        quoted_at) are refreshed and the version stays the same.
+        """
+        if not prices:
+            return self.version
+
+        version = self.version + 1
+        now = datetime.now(timezone.utc)
+        snapshot = dict(self._snapshot)
+        bumped = False
+
+        for coin_id, data in prices.items():
+            previous = snapshot.get(coin_id)
+            changed = (previous is None or previous.get('price_tmn') != data.get('price_tmn')
+                       or (data.get('last_updated') is not None and previous.get('last_updated') != data['last_updated']))
+            bumped = bumped or changed
+            # Seeds and leader entries without a quote time are never fresh
+            quoted_at = data.get('quoted_at') or (None if source in ('static', 'leader') else now)
+            snapshot[coin_id] = {
+                'symbol': data.get('symbol'),
+                'name': data.get('name'),
+                'price_tmn': data.get('price_tmn'),
+                'change_24h': data.get('change_24h', 0),
+                'last_updated': data.get('last_updated') or now.isoformat(),
+                'source': data.get('source', source),
+                'quoted_at': quoted_at.isoformat() if isinstance(quoted_at, datetime) else quoted_at,
+                'version': version if changed else previous.get('version', version),
+            }
+
+        self._snapshot = MappingProxyType(snapshot)
+        if bumped:
+            self.version = version
+            self.updated_at = now
+        return self.version
+
+    def confirm(self, quotes: Dict[str, str]):
+        """Move quoted_at forward for coins re-quoted at an unchanged price
+
+        The version stays the same, so nothing is pushed to subscribers.
+        """
+        snapshot = dict(self._snapshot)
+        for coin_id, quoted_at in quotes.items():
+            if coin_id in snapshot:
+                snapshot[coin_id] = {**snapshot[coin_id], 'quoted_at': quoted_at}
+        self._snapshot = MappingProxyType(snapshot)
+
+class PriceFeedAggregator:
+    """Polls Toman price sources and publishes the median per coin
+
+    Sources are listed in priority order; the highest priority fresh quote
+    supplies the symbol/name/24h change, while the price is the median of
+    every quote younger than max_age seconds. Each source is polled on its
+    own cadence. With a lease, only the leader polls upstream and the other
+    processes follow the snapshot it persists.
+    """
+
+    def __init__(self, book: PriceBook, sources: Dict[str, PriceSource],
+                 interval: int = 60, max_age: int = 300, timeout: float = 30.0,
+                 cadences: Optional[Dict[str, int]] = None, lease=None,
+                 follow_source: Optional[PriceSource] = None, follow_interval: int = 10):
+        self.book = book
+        self.sources = sources
+        self.interval = interval
+        self.max_age = max_age
+        self.timeout = timeout
+        self.cadences = {name: (cadences or {}).get(name, interval) for name in sources}
+        self.lease = lease
+        self.follow_source = follow_source
+        self.follow_interval = follow_interval
+        # source name -> (monotonic fetch time, coin_id -> quote)
+        self._quotes: Dict[str, tuple] = {}
+        self._task: Optional[asyncio.Task] = None
+        # (listener, leader_only, fresh_only)
+        self._listeners: List[tuple] = []
+        self.last_refresh: Optional[datetime] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self.lease is None or self.lease.is_leader
+
+    def add_listener(self, listener: Callable[[Dict], Awaitable[None]], leader_only: bool = False,
+                     fresh_only: bool = False):
+        """Await listener(prices) after every publish, e.g. to persist history
+
+        leader_only listeners are skipped when a follower publishes what
+        the leader already persisted. fresh_only listeners, the ones that
+        trade on a tick, only get prices quoted within max_age.
+        """
+        self._listeners.append((listener, leader_only, fresh_only))
+
+    def fresh(self, prices: Dict[str, Dict]) -> Dict[str, Dict]:
+        """The entries of prices quoted within max_age"""
+        horizon = time.time() - self.max_age
+        return {
+            coin_id: data for coin_id, data in prices.items()
+            if (epoch_seconds(data.get('quoted_at')) or 0) >= horizon
+        }
+
+    async def _fetch(self, name: str, source: PriceSource) -> Dict:
+        try:
+            prices = await asyncio.wait_for(source(), timeout=self.timeout)
+        except Exception as e:
+            logger.warning(f"⚠️  Price source {name} failed: {str(e) or type(e).__name__}")
+            return {}
+
+        if prices:
+            self._quotes[name] = (time.monotonic(), prices)
+        return prices or {}
+
+    async def _publish(self, prices: Dict[str, Dict], source: str, leader: bool = True):
+        version = self.book.publish(prices, source=source)
+        logger.info(f"✅ Price book v{version}: {len(prices)} coins from {source}")
+        fresh = None
+        for listener, leader_only, fresh_only in self._listeners:
+            if leader_only and not leader:
+                continue
+            if fresh_only and fresh is None:
+                fresh = self.fresh(prices)
+            try:
+                await listener(fresh if fresh_only else prices)
+            except Exception as e:
+                logger.error(f"Price book listener failed: {str(e)}")
+
+    async def refresh(self) -> Dict[str, Dict]:
+        """Fetch all sources at once, reconcile and publish; returns what was published"""
+        await asyncio.gather(*[self._fetch(name, source) for name, source in self.sources.items()])
+
+        reconciled = self.reconcile()
+        if reconciled:
+            await self._publish(reconciled, 'aggregated')
+        self.last_refresh = datetime.now(timezone.utc)
+        return reconciled
+
+    async def follow(self) -> Dict[str, Dict]:
+        """Publish the coins whose price in the leader's snapshot differs from the book"""
+        prices = await self.follow_source()
+        changed = {
+            coin_id: data for coin_id, data in prices.items()
+            if data.get('price_tmn') and data['price_tmn'] != self.book.get_price(coin_id)
+        }
+        requoted = {
+            coin_id: data['quoted_at'] for coin_id, data in prices.items()
+            if coin_id not in changed and data.get('quoted_at')
+            and data['quoted_at'] != (self.book.get(coin_id) or {}).get('quoted_at')
+        }
+        if requoted:
+            self.book.confirm(requoted)
+        if changed:
+            await self._publish(changed, 'leader', leader=False)
+        return changed
+
+    def fresh_sources(self) -> Dict[str, Dict]:
+        """Quotes of every source fetched within max_age, in priority order"""
+        now = time.monotonic()
+        return {
+            name: self._quotes[name][1]
+            for name in self.sources
+            if name in self._quotes and now - self._quotes[name][0] <= self.max_age
+        }
+
+    def reconcile(self) -> Dict[str, Dict]:
+        """Median price per coin across fresh sources, quoted at its newest fetch"""
+        offset = time.time() - time.monotonic()
+        quotes_by_coin: Dict[str, list] = {}
+        for name, prices in self.fresh_sources().items():
+            for coin_id, quote in prices.items():
+                if quote.get('price_tmn', 0) > 0:
+                    quotes_by_coin.setdefault(coin_id, []).append((name, quote))
+
+        reconciled = {}
+        for coin_id, quotes in quotes_by_coin.items():
+            primary_source, primary = quotes[0]
+            reconciled[coin_id] = {
+                'symbol': primary.get('symbol'),
+                'name': primary.get('name'),
+                'price_tmn': statistics.median(quote['price_tmn'] for _, quote in quotes),
+                'change_24h': primary.get('change_24h', 0),
+                'last_updated': primary.get('last_updated'),
+                'source': '+'.join(name for name, _ in quotes),
+                'quoted_at': datetime.fromtimestamp(
+                    max(self._quotes[name][0] for name, _ in quotes) + offset, timezone.utc
+                ).isoformat(),
+            }
+        return reconciled
+
+    async def _poll_source(self, name: str):
+        """Fetch one source every cadence seconds while leading and republish"""
+        while True:
+            try:
+                if self.is_leader and await self._fetch(name, self.sources[name]):
+                    reconciled = self.reconcile()
+                    if reconciled:
+                        await self._publish(reconciled, 'aggregated')
+                    self.last_refresh = datetime.now(timezone.utc)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Price feed refresh from {name} failed: {str(e)}")
+            await asyncio.sleep(self.cadences[name])
+
+    async def _follow_leader(self):
+        while True:
+            try:
+                if not self.is_leader:
+                    await self.follow()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Price feed follow failed: {str(e)}")
+            await asyncio.sleep(self.follow_interval)
+
+    async def _run(self):
+        if self.lease is not None:
+            # Settle leadership before the first poll so no cadence is skipped
+            await self.lease.acquire()
+            self.lease.start()
+
+        loops = [self._poll_source(name) for name in self.sources]
+        if self.lease is not None and self.follow_source is not None:
+            loops.append(self._follow_leader())
+        await asyncio.gather(*loops)
+
+    def start(self):
+        """Poll every source in the background; returns without waiting for a fetch"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            cadences = ', '.join(f"{name} every {seconds}s" for name, seconds in self.cadences.items())
+            logger.info(f"🔄 Price feed aggregator started ({cadences})")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.lease is not None:
+            await self.lease.stop()
+
+    def get_status(self) -> Dict:
+        """Per-source freshness for monitoring"""
+        now = time.monotonic()
+        return {
+            'book_version': self.book.version,
+            'book_updated_at': self.book.updated_at.isoformat() if self.book.updated_at else None,
+            'last_refresh': self.last_refresh.isoformat() if self.last_refresh else None,
+            'leader': self.lease.get_status() if self.lease is not None else None,
+            'sources': {
+                name: {
+                    'cadence_seconds': self.cadences[name],
+                    'coins': len(self._quotes[name][1]) if name in self._quotes else 0,
+                    'age_seconds': round(now - self._quotes[name][0], 1) if name in self._quotes else None,
+                    'fresh': name in self._quotes and now - self._quotes[name][0] <= self.max_age,
+                }
+                for name in self.sources
+            }
+        }
+
+# Global price book, seeded with static prices
+price_book = PriceBook(seed=STATIC_PRICES)
@@ -0,0 +1,118 @@
+"""
+Price History Storage
+Bulk upserts of the latest price snapshot into crypto_prices plus an
+append-only crypto_price_ticks time-series collection
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import CollectionInvalid, OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+TICKS_COLLECTION = 'crypto_price_ticks'
+TICK_TIME_FIELD = 'ts'
+TICK_META_FIELD = 'meta'
+
+async def ensure_price_history(db, retention_days: int = 400) -> bool:
+    """Create crypto_price_ticks as a time-series collection if it is missing
+
+    Returns True when the collection is a native time-series collection.
+    MongoDB < 5.0 gets a regular collection with a TTL index instead.
+    """
+    expire_after = retention_days * 24 * 60 * 60 if retention_days > 0 else None
+    options = {'expireAfterSeconds': expire_after} if expire_after else {}
+    time_series = True
+
+    try:
+        await db.create_collection(
+            TICKS_COLLECTION,
+            timeseries={
+                'timeField': TICK_TIME_FIELD,
+                'metaField': TICK_META_FIELD,
+                'granularity': 'minutes'
+            },
+            **options
+        )
+        logger.info(f"✅ Created time-series collection {TICKS_COLLECTION}")
+    except CollectionInvalid:
+        # Already exists - keep whatever type it was created with
+        collections = await db.list_collections(filter={'name': TICKS_COLLECTION}).to_list(1)
+        time_series = bool(collections) and collections[0].get('type') == 'timeseries'
+    except OperationFailure as e:
+        logger.warning(f"⚠️  Time-series collections unavailable ({str(e)}), using a regular collection")
+        time_series = False
+
+    try:
+        await db[TICKS_COLLECTION].create_index(
+            [(f'{TICK_META_FIELD}.coin_id', ASCENDING), (TICK_TIME_FIELD, ASCENDING)]
+        )
+        if not time_series and expire_after:
+            await db[TICKS_COLLECTION].create_index(TICK_TIME_FIELD, expireAfterSeconds=expire_after)
+    except PyMongoError as e:
+        logger.error(f"Error creating indexes for {TICKS_COLLECTION}: {str(e)}")
+
+    return time_series
+
+async def store_price_snapshot(db, prices: Dict[str, Dict], source: str,
+                               timestamp: Optional[datetime] = None):
+    """Upsert the latest price per coin in one bulk_write and append one tick per coin"""
+    if not prices:
+        return
+
+    timestamp = timestamp or datetime.now(timezone.utc)
+
+    latest = [
+        UpdateOne(
+            {'coin_id': coin_id},
+            {'$set': {
+                'coin_id': coin_id,
+                'symbol': price_data.get('symbol'),
+                'name': price_data.get('name'),
+                'price_tmn': price_data['price_tmn'],
+                'change_24h': price_data.get('change_24h', 0),
+                'last_updated': price_data.get('last_updated') or timestamp.isoformat(),
+                'quoted_at': price_data.get('quoted_at') or timestamp.isoformat(),
+                'source': source
+            }},
+            upsert=True
+        )
+        for coin_id, price_data in prices.items()
+    ]
+    ticks = [
+        {
+            TICK_TIME_FIELD: timestamp,
+            TICK_META_FIELD: {'coin_id': coin_id, 'source': source},
+            'price_tmn': float(price_data['price_tmn']),
+            'change_24h': float(price_data.get('change_24h') or 0)
+        }
+        for coin_id, price_data in prices.items()
+    ]
+
+    await db.crypto_prices.bulk_write(latest, ordered=False)
+    await db[TICKS_COLLECTION].insert_many(ticks, ordered=False)
+
+async def get_tick_storage_stats(db) -> Dict:
+    """Actual tick storage plus a one-year projection at the last day's tick rate"""
+    stats = await db.command('collStats', TICKS_COLLECTION)
+    total_ticks = await db[TICKS_COLLECTION].count_documents({})
+    last_day_ticks = await db[TICKS_COLLECTION].count_documents({
+        TICK_TIME_FIELD: {'$gte': datetime.now(timezone.utc) - timedelta(days=1)}
+    })
+
+    storage_size = stats.get('storageSize', 0)
+    bytes_per_tick = storage_size / total_ticks if total_ticks else 0
+
+    return {
+        'collection': TICKS_COLLECTION,
+        'time_series': 'timeseries' in stats,
+        'ticks': total_ticks,
+        'ticks_last_24h': last_day_ticks,
+        'storage_bytes': storage_size,
+        'data_bytes': stats.get('size', 0),
+        'index_bytes': stats.get('totalIndexSize', 0),
+        'bytes_per_tick': round(bytes_per_tick, 2),
+        'projected_year_bytes': int(bytes_per_tick * last_day_ticks * 365),
+        'buckets': stats.get('timeseries', {}).get('bucketCount')
+    }
@@ -0,0 +1,129 @@
+"""
+Price Stream Broadcaster
+Fans price book changes out to WebSocket and SSE clients; each changed coin is
+serialized once per tick and slow clients get their updates coalesced
+"""
+import asyncio
+import json
+import logging
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from price_book import PriceBook
+
+logger = logging.getLogger(__name__)
+
+class PriceSubscription:
+    """One streaming client: an optional coin filter and the coins waiting to be sent"""
+
+    def __init__(self, coin_ids: Optional[Set[str]] = None):
+        self.coin_ids = coin_ids  # None means every coin
+        self._pending: Set[str] = set()
+        self._event = asyncio.Event()
+        self.coalesced = 0
+
+    def notify(self, coin_ids: Set[str]):
+        """Queue changed coins; a coin already queued is coalesced, not duplicated"""
+        relevant = coin_ids if self.coin_ids is None else coin_ids & self.coin_ids
+        if not relevant:
+            return
+
+        self.coalesced += len(relevant & self._pending)
+        self._pending |= relevant
+        self._event.set()
+
+    async def next_batch(self, timeout: Optional[float] = None) -> Set[str]:
+        """Wait for changed coins; an empty set means the timeout passed"""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return set()
+
+        self._event.clear()
+        batch, self._pending = self._pending, set()
+        return batch
+
+class PriceBroadcaster:
+    """Single fan-out point between the price book and streaming clients"""
+
+    def __init__(self, book: PriceBook):
+        self.book = book
+        self._subscriptions: Set[PriceSubscription] = set()
+        self._version = book.version
+        # coin_id -> (entry version, JSON fragment)
+        self._fragments: Dict[str, Tuple[int, str]] = {}
+        # Rendered messages for the current book version, keyed by coin set
+        self._messages: Dict[frozenset, str] = {}
+        self._messages_version = book.version
+        self.messages_rendered = 0
+
+    def subscribe(self, coin_ids: Optional[Set[str]] = None) -> PriceSubscription:
+        subscription = PriceSubscription(coin_ids)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: PriceSubscription):
+        self._subscriptions.discard(subscription)
+
+    def resolve(self, symbols: Iterable[str]) -> Set[str]:
+        """Map coin ids or ticker symbols (any case) to coin ids known to the book"""
+        snapshot = self.book.snapshot()
+        by_symbol = {(entry.get('symbol') or '').upper(): coin_id for coin_id, entry in snapshot.items()}
+        coin_ids = set()
+        for symbol in symbols:
+            symbol = symbol.strip()
+            if symbol in snapshot:
+                coin_ids.add(symbol)
+            elif symbol.upper() in by_symbol:
+                coin_ids.add(by_symbol[symbol.upper()])
+        return coin_ids
+
+    async def on_publish(self, prices: Optional[Dict] = None):
+        """Price feed listener - notify every subscription of the coins that changed"""
+        changed = set(self.book.changes_since(self._version))
+        self._version = self.book.version
+        if not changed:
+            return
+
+        for subscription in list(self._subscriptions):
+            subscription.notify(changed)
+
+    def _fragment(self, coin_id: str, entry: Dict) -> str:
+        cached = self._fragments.get(coin_id)
+        if cached and cached[0] == entry['version']:
+            return cached[1]
+
+        fragment = json.dumps(entry, ensure_ascii=False)
+        self._fragments[coin_id] = (entry['version'], fragment)
+        return fragment
+
+    def render(self, coin_ids: Optional[Set[str]] = None) -> str:
+        """JSON message with the current entries of coin_ids (all coins when None)
+
+        Entries are serialized once per price change and whole messages once
+        per distinct coin set and book version, however many clients share them.
+        """
+        version = self.book.version
+        if version != self._messages_version:
+            self._messages.clear()
+            self._messages_version = version
+
+        snapshot = self.book.snapshot()
+        key = frozenset(snapshot if coin_ids is None else coin_ids)
+        message = self._messages.get(key)
+        if message is None:
+            data = ','.join(
+                f'{json.dumps(coin_id)}:{self._fragment(coin_id, snapshot[coin_id])}'
+                for coin_id in sorted(key) if coin_id in snapshot
+            )
+            message = f'{{"type":"prices","version":{version},"data":{{{data}}}}}'
+            self._messages[key] = message
+            self.messages_rendered += 1
+        return message
+
+    def get_stats(self) -> Dict:
+        return {
+            'subscribers': len(self._subscriptions),
+            'book_version': self.book.version,
+            'messages_rendered': self.messages_rendered,
+            'coalesced_updates': sum(subscription.coalesced for subscription in self._subscriptions)
+        }
@@ -0,0 +1,146 @@
+"""
+Rate Limiter Service
+O(1) sliding-window rate limiting with a per-process in-memory backend and a
+Redis/KeyDB backend that is shared by every uvicorn worker
+"""
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Redis backend is optional
+    aioredis = None
+
+# Sliding-window counter: the previous fixed window is weighted by how much
+# of it still overlaps the sliding window. Only allowed hits are counted.
+SLIDING_WINDOW_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+if previous * tonumber(ARGV[2]) + current >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+return 1
+"""
+
+def _window_position(now: float, window: int):
+    """Return the current window index and the weight of the previous window"""
+    index = int(now // window)
+    weight = 1.0 - (now - index * window) / window
+    return index, weight
+
+class RateLimiter(ABC):
+    """Base rate limiter - hit() returns True when the request is allowed"""
+
+    backend = "base"
+
+    @abstractmethod
+    async def hit(self, key: str, limit: int, window: int) -> bool:
+        """Count one request for key; False once limit is reached within window seconds"""
+
+    async def close(self):
+        """Release backend resources"""
+        pass
+
+class InMemoryRateLimiter(RateLimiter):
+    """Per-process sliding-window counter with expiry of idle keys"""
+
+    backend = "memory"
+
+    def __init__(self, sweep_interval: int = 60):
+        # key -> [window index, current count, previous count, expires at]
+        self._windows: Dict[str, List] = {}
+        self._sweep_interval = sweep_interval
+        self._next_sweep = time.time() + sweep_interval
+
+    async def hit(self, key: str, limit: int, window: int) -> bool:
+        now = time.time()
+        self._sweep(now)
+
+        index, weight = _window_position(now, window)
+        entry = self._windows.get(key)
+
+        if entry is None or entry[0] < index - 1:
+            entry = [index, 0, 0, 0.0]
+        elif entry[0] == index - 1:
+            entry = [index, 0, entry[1], 0.0]
+
+        # Idle keys are dropped once both windows have passed
+        entry[3] = (index + 2) * window
+        self._windows[key] = entry
+
+        if entry[2] * weight + entry[1] >= limit:
+            return False
+
+        entry[1] += 1
+        return True
+
+    def _sweep(self, now: float):
+        """Drop expired keys, amortised over sweep_interval"""
+        if now < self._next_sweep:
+            return
+
+        self._next_sweep = now + self._sweep_interval
+        expired = [key for key, entry in self._windows.items() if entry[3] <= now]
+        for key in expired:
+            del self._windows[key]
+
+    def __len__(self):
+        return len(self._windows)
+
+class RedisRateLimiter(RateLimiter):
+    """Sliding-window counter stored in Redis/KeyDB, shared across workers"""
+
+    backend = "redis"
+
+    def __init__(self, client, key_prefix: str = "ratelimit:", fallback: Optional[RateLimiter] = None):
+        self.client = client
+        self.key_prefix = key_prefix
+        self.fallback = fallback or InMemoryRateLimiter()
+        self._script = client.register_script(SLIDING_WINDOW_SCRIPT)
+
+    async def hit(self, key: str, limit: int, window: int) -> bool:
+        index, weight = _window_position(time.time(), window)
+        keys = [
+            f"{self.key_prefix}{key}:{index}",
+            f"{self.key_prefix}{key}:{index - 1}"
+        ]
+
+        try:
+            allowed = await self._script(keys=keys, args=[limit, weight, window * 2])
+            return bool(int(allowed))
+        except Exception as e:
+            # Keep limiting per-process rather than failing every request
+            logger.error(f"Redis rate limiter error, using in-memory fallback: {str(e)}")
+            return await self.fallback.hit(key, limit, window)
+
+    async def close(self):
+        try:
+            await self.client.aclose()
+        except Exception as e:
+            logger.debug(f"Error closing Redis rate limiter client: {str(e)}")
+
+def create_rate_limiter(backend: str = "memory", redis_url: Optional[str] = None, client=None) -> RateLimiter:
+    """Build the configured rate limiter backend
+
+    A ready client (for example fakeredis.aioredis.FakeRedis in tests) can be
+    passed instead of a URL.
+    """
+    if backend == "redis":
+        if client is not None:
+            return RedisRateLimiter(client)
+
+        if aioredis is None:
+            logger.warning("⚠️  redis package not installed - using in-memory rate limiter")
+        elif not redis_url:
+            logger.warning("⚠️  REDIS_URL not set - using in-memory rate limiter")
+        else:
+            logger.info("🚦 Using Redis rate limiter")
+            return RedisRateLimiter(aioredis.from_url(redis_url))
+
+    return InMemoryRateLimiter()
@@ -0,0 +1,115 @@
+"""
+Response Cache Service
+Bounded LRU cache with per-key TTL and single-flight loading, so concurrent
+misses for the same key share one upstream call
+"""
+import asyncio
+import logging
+import time
+from collections import namedtuple
+from typing import Any, Awaitable, Callable, Dict, Optional
+from cachetools import TLRUCache
+
+logger = logging.getLogger(__name__)
+
+_Entry = namedtuple('_Entry', ['data', 'ttl'])
+
+class _MeteredTLRUCache(TLRUCache):
+    """TLRUCache that counts LRU evictions and TTL expirations"""
+
+    def __init__(self, maxsize, ttu, timer=time.monotonic):
+        super().__init__(maxsize, ttu, timer)
+        self.evictions = 0
+        self.expirations = 0
+
+    def popitem(self):
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        self.expirations += len(expired)
+        return expired
+
+class ResponseCache:
+    """LRU/TTL response cache with request coalescing and hit/miss metrics"""
+
+    def __init__(self, maxsize: int = 1024, default_ttl: int = 300):
+        self.default_ttl = default_ttl
+        self._cache = _MeteredTLRUCache(maxsize, self._time_to_use)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def _time_to_use(key, entry: _Entry, now: float) -> float:
+        return now + entry.ttl
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return a cached value or None on a miss"""
+        entry = self._cache.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry.data
+
+    def set(self, key: str, data: Any, ttl: Optional[int] = None):
+        """Store a value with its own TTL (defaults to default_ttl)"""
+        self._cache[key] = _Entry(data, ttl if ttl is not None else self.default_ttl)
+
+    def delete(self, key: str):
+        self._cache.pop(key, None)
+
+    async def get_or_set(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: Optional[int] = None) -> Any:
+        """Return the cached value or load it once for all concurrent callers
+
+        The loader runs in its own task that every caller awaits through
+        asyncio.shield, so a caller that is cancelled (a client that went
+        away) neither cancels the load nor fails the others. Only
+        successful loads are cached. If the loader raises, every caller
+        waiting on the same key receives that exception.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(self._load(key, loader, ttl))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._loaded(key, done))
+        return await asyncio.shield(task)
+
+    async def _load(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: Optional[int]) -> Any:
+        data = await loader()
+        if data is not None:
+            self.set(key, data, ttl)
+        return data
+
+    def _loaded(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # Mark retrieved when every caller has gone
+
+    def get_stats(self) -> Dict:
+        """Cache metrics for monitoring"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._cache),
+            'max_size': self._cache.maxsize,
+            'default_ttl_seconds': self.default_ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'evictions': self._cache.evictions,
+            'expirations': self._cache.expirations,
+            'coalesced_requests': self.coalesced,
+            'inflight': len(self._inflight)
+        }
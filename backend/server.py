@@ -1,5 +1,7 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -12,79 +14,192 @@ import uuid
 from datetime import datetime, timedelta, timezone
 import bcrypt
 import jwt
-import httpx
 import random
-import time
 import asyncio
+import base64
+import csv
+import io
+import json
 from ai_services import chatbot, market_analyst, portfolio_advisor, price_predictor, risk_analyzer, news_summarizer
 from crypto_prices import price_service
 from wallex_prices import get_wallex_service
+from nobitex_prices import get_price_service
 from ai_admin_services import fraud_detector, market_intelligence, system_intelligence, predictive_analytics
 from ai_user_services import personal_assistant, portfolio_manager, notification_system
 from advanced_ai_services import predictive_market_analysis, sentiment_analysis_engine, portfolio_optimizer
 from comprehensive_ai_services import get_ai_service
+from user_cache import UserCache
+from rate_limiter import create_rate_limiter
+from response_cache import ResponseCache
+from db_indexes import ensure_indexes
+from platform_stats import PlatformStats
+from http_clients import http_clients, get_http_client
+from price_book import price_book, PriceFeedAggregator
+from price_history import ensure_price_history, store_price_snapshot, get_tick_storage_stats
+from candles import CandleBuilder, downsample, pick_interval, INTERVALS
+from price_stream import PriceBroadcaster
+from leader_lease import LeaderLease
+from settlement import PriceUnavailable, SettlementEngine
+from order_book import BookOrder, MatchingEngine, release_legs, reservation_leg
+from stop_loss import StopLossEngine
+from dca_executor import FREQUENCIES as DCA_FREQUENCIES, DCAExecutor
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # Configuration variables first
 RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory').lower()  # memory or redis
+REDIS_URL = os.environ.get('REDIS_URL')
 CACHE_TTL = int(os.environ.get('CACHE_TTL', '300'))  # 5 minutes default
+CACHE_MAX_SIZE = int(os.environ.get('CACHE_MAX_SIZE', '1024'))  # LRU eviction beyond this
 DEVELOPMENT_MODE = os.environ.get('DEVELOPMENT_MODE', 'true').lower() == 'true'
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', '60'))  # seconds a resolved user stays cached
+USER_CACHE_MAX_SIZE = int(os.environ.get('USER_CACHE_MAX_SIZE', '10000'))
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', '100'))  # page size when no limit is passed
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', '500'))
+ANALYTICS_MAX_DOCUMENTS = int(os.environ.get('ANALYTICS_MAX_DOCUMENTS', '10000'))
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '1000'))
+STATS_RECONCILE_INTERVAL = int(os.environ.get('STATS_RECONCILE_INTERVAL', '300'))  # seconds
+STATS_HOURLY_RETENTION_DAYS = int(os.environ.get('STATS_HOURLY_RETENTION_DAYS', '35'))
+SETTLEMENT_TRANSACTIONS = {'true': True, 'false': False}.get(os.environ.get('SETTLEMENT_TRANSACTIONS', 'auto').lower())  # auto-detect unless true/false
+SETTLEMENT_BATCH_SIZE = int(os.environ.get('SETTLEMENT_BATCH_SIZE', '500'))  # orders per bulk settlement transaction
+SETTLEMENT_RECOVERY_INTERVAL = int(os.environ.get('SETTLEMENT_RECOVERY_INTERVAL', '60'))  # seconds between recovery passes
+SETTLEMENT_RECOVERY_GRACE = int(os.environ.get('SETTLEMENT_RECOVERY_GRACE', '300'))  # settlements younger than this are left alone
+BULK_APPROVAL_MAX_ORDERS = int(os.environ.get('BULK_APPROVAL_MAX_ORDERS', '5000'))
+MATCHING_ENGINE_ENABLED = os.environ.get('MATCHING_ENGINE_ENABLED', 'true').lower() == 'true'
+MATCHING_JOURNAL_INTERVAL = float(os.environ.get('MATCHING_JOURNAL_INTERVAL', '0.5'))  # seconds between fill/state flushes
+DCA_EXECUTOR_ENABLED = os.environ.get('DCA_EXECUTOR_ENABLED', 'true').lower() == 'true'
+DCA_TICK = float(os.environ.get('DCA_TICK', '1'))  # seconds per timing wheel slot
+DCA_LOOKAHEAD = int(os.environ.get('DCA_LOOKAHEAD', '3600'))  # seconds of upcoming purchases held in memory
+PRICE_FEED_ENABLED = os.environ.get('PRICE_FEED_ENABLED', 'true').lower() == 'true'
+PRICE_FEED_INTERVAL = int(os.environ.get('PRICE_FEED_INTERVAL', '60'))  # seconds between source polls
+PRICE_MAX_AGE = int(os.environ.get('PRICE_MAX_AGE', '300'))  # quotes older than this are ignored
+PRICE_FEED_CADENCES = {  # per-source poll cadence in seconds, e.g. "wallex=15,abantether=180"
+    name: int(seconds) for name, seconds in (
+        item.split('=') for item in os.environ.get('PRICE_FEED_CADENCES', 'wallex=15,nobitex=30,abantether=180').split(',') if item
+    )
+}
+PRICE_FEED_LEADER_ELECTION = os.environ.get('PRICE_FEED_LEADER_ELECTION', 'true').lower() == 'true'
+PRICE_FEED_LEASE_TTL = int(os.environ.get('PRICE_FEED_LEASE_TTL', '30'))  # seconds before another worker takes over
+PRICE_FEED_FOLLOW_INTERVAL = int(os.environ.get('PRICE_FEED_FOLLOW_INTERVAL', '10'))  # followers re-read the leader's prices
+PRICE_TICK_RETENTION_DAYS = int(os.environ.get('PRICE_TICK_RETENTION_DAYS', '400'))  # 0 keeps ticks forever
+PRICE_STREAM_KEEPALIVE = int(os.environ.get('PRICE_STREAM_KEEPALIVE', '15'))  # seconds between SSE keep-alives
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
-# Rate limiting storage (in-memory for simplicity)
-rate_limit_storage = {}
-
-# Cache storage (in-memory for simplicity)
-cache_storage = {}
-
-def check_rate_limit(identifier: str, limit: int = 10, window: int = 60) -> bool:
-    """Simple rate limiting check"""
+# Rate limiting backend (Redis shares limits across workers)
+rate_limiter = create_rate_limiter(RATE_LIMIT_BACKEND, REDIS_URL)
+# CoinGecko's call budget is counted there too, so workers share one budget
+price_service.share_budget(rate_limiter)
+
+# Response cache (bounded LRU with per-key TTL and request coalescing)
+response_cache = ResponseCache(maxsize=CACHE_MAX_SIZE, default_ttl=CACHE_TTL)
+
+# Authenticated user cache - invalidate after every write to db.users
+user_cache = UserCache(maxsize=USER_CACHE_MAX_SIZE, ttl=USER_CACHE_TTL)
+
+# Materialized dashboard counters - record every write to users, deposits, orders and cards
+platform_stats = PlatformStats(db, hourly_retention_days=STATS_HOURLY_RETENTION_DAYS,
+                               lease=LeaderLease(db, 'platform_stats'))
+
+# Trading order settlement - transactional on replica sets, idempotent per order id
+settlement_engine = SettlementEngine(db, platform_stats, transactions=SETTLEMENT_TRANSACTIONS,
+                                     lease=LeaderLease(db, 'settlement_recovery'))
+
+# Toman price sources feeding the in-memory price book, highest priority first
+nobitex_service = get_price_service(db)
+
+async def fetch_wallex_prices() -> dict:
+    return (await get_wallex_service().fetch_prices()).get('data', {})
+
+async def fetch_leader_prices() -> dict:
+    """Latest snapshot persisted by the price feed leader"""
+    prices = await db.crypto_prices.find({}, {"_id": 0}).to_list(None)
+    return {price["coin_id"]: price for price in prices}
+
+# Only the lease holder polls upstream; other workers follow db.crypto_prices
+price_aggregator = PriceFeedAggregator(price_book, {
+    'wallex': fetch_wallex_prices,
+    'nobitex': nobitex_service.fetch_nobitex_prices,
+    'abantether': nobitex_service.fetch_abantether_prices
+}, interval=PRICE_FEED_INTERVAL, max_age=PRICE_MAX_AGE, cadences=PRICE_FEED_CADENCES,
+    lease=LeaderLease(db, 'price_feed', ttl=PRICE_FEED_LEASE_TTL) if PRICE_FEED_LEADER_ELECTION else None,
+    follow_source=fetch_leader_prices, follow_interval=PRICE_FEED_FOLLOW_INTERVAL)
+
+# OHLCV candles built from the same tick stream
+candle_builder = CandleBuilder(db)
+
+async def persist_price_snapshot(prices: dict):
+    await store_price_snapshot(db, prices, 'aggregated')
+    await candle_builder.add_ticks(prices)
+
+price_aggregator.add_listener(persist_price_snapshot, leader_only=True)
+
+# Push price book changes to WebSocket/SSE subscribers
+price_broadcaster = PriceBroadcaster(price_book)
+price_aggregator.add_listener(price_broadcaster.on_publish)
+
+# Limit order books - matched by the lease holder, persisted write-behind
+matching_engine = MatchingEngine(db, settlement_engine, lease=LeaderLease(db, 'matching_engine'),
+                                 flush_interval=MATCHING_JOURNAL_INTERVAL, user_cache=user_cache)
+price_aggregator.add_listener(matching_engine.on_prices, fresh_only=True)
+
+# Stop-loss triggers - armed in the same process that owns the order books
+stop_loss_engine = StopLossEngine(db, settlement_engine, matching_engine, lease=LeaderLease(db, 'stop_loss_engine'),
+                                  user_cache=user_cache)
+price_aggregator.add_listener(stop_loss_engine.on_prices, fresh_only=True)
+
+# Toman per USD when the book has no Tether quote to convert CoinGecko prices
+USD_TMN_FALLBACK = 50000
+
+async def get_prices_tmn(coin_ids, fresh: bool = True) -> dict:
+    """Toman prices for many coins at once: price book first, then a single
+    CoinGecko /simple/price request for the coins the book does not quote.
+    Coins without any quote map to 0, and so do coins CoinGecko could only
+    answer with mock data or a stale cached response.
+    
+    With fresh (what orders and settlement use) book prices older than
+    PRICE_MAX_AGE or still at their seed value count as missing, and
+    CoinGecko quotes are only converted at a fresh Tether price."""
+    coin_ids = set(coin_ids)
+    if fresh:
+        prices = {coin_id: price_book.get_fresh_price(coin_id, PRICE_MAX_AGE) for coin_id in coin_ids}
+        usd_tmn = price_book.get_fresh_price('tether', PRICE_MAX_AGE)
+    else:
+        prices = {coin_id: price_book.get_price(coin_id) for coin_id in coin_ids}
+        usd_tmn = price_book.get_price('tether') or USD_TMN_FALLBACK
+    missing = [coin_id for coin_id, price in prices.items() if not price]
+    
+    if missing and not usd_tmn:
+        return {coin_id: price or 0 for coin_id, price in prices.items()}
+    if missing:
+        quotes = await price_service.get_prices(missing)
+        usable = quotes.get("success") and not quotes.get("mock") and not quotes.get("stale")
+        quoted = quotes.get("data", {}) if usable else {}
+        for coin_id in missing:
+            prices[coin_id] = (quoted.get(coin_id) or {}).get("usd", 0) * usd_tmn
+    
+    return prices
+
+# DCA purchases - due strategies are bought in batches by the lease holder
+dca_executor = DCAExecutor(db, settlement_engine, get_prices_tmn, lease=LeaderLease(db, 'dca_executor'),
+                           tick=DCA_TICK, lookahead=DCA_LOOKAHEAD, batch_size=SETTLEMENT_BATCH_SIZE,
+                           user_cache=user_cache)
+
+async def check_rate_limit(identifier: str, limit: int = 10, window: int = 60) -> bool:
+    """Sliding-window rate limiting check"""
     if not RATE_LIMIT_ENABLED:
         return True
     
-    current_time = time.time()
-    
-    if identifier not in rate_limit_storage:
-        rate_limit_storage[identifier] = []
-    
-    # Clean old entries
-    rate_limit_storage[identifier] = [
-        timestamp for timestamp in rate_limit_storage[identifier] 
-        if current_time - timestamp < window
-    ]
-    
-    # Check if limit exceeded
-    if len(rate_limit_storage[identifier]) >= limit:
-        return False
-    
-    # Add current request
-    rate_limit_storage[identifier].append(current_time)
-    return True
+    return await rate_limiter.hit(identifier, limit, window)
 
-def get_from_cache(key: str):
-    """Get value from cache"""
-    if key not in cache_storage:
-        return None
-    
-    item = cache_storage[key]
-    if time.time() - item['timestamp'] > CACHE_TTL:
-        del cache_storage[key]
-        return None
-    
-    return item['data']
-
-def set_cache(key: str, data):
-    """Set value in cache"""
-    cache_storage[key] = {
-        'data': data,
-        'timestamp': time.time()
-    }
+async def get_or_set_cache(key: str, loader, ttl: Optional[int] = None):
+    """Get value from cache, loading it once for all concurrent misses"""
+    return await response_cache.get_or_set(key, loader, ttl)
 
 # Security
 security = HTTPBearer()
@@ -165,7 +280,7 @@ class User(BaseModel):
     first_name: Optional[str] = None  # Made optional for backward compatibility
     last_name: Optional[str] = None  # Made optional for backward compatibility
     email: str
-    password_hash: str
+    password_hash: Optional[str] = None  # Not loaded into authenticated principals
     phone: str
     full_name: Optional[str] = None  # Added in KYC Level 1 (can override computed name)
     national_code: Optional[str] = None  # Added in KYC Level 1
@@ -400,6 +515,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+PRINCIPAL_PROJECTION = {"_id": 0, "password_hash": 0, "kyc_documents": 0}
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
         token = credentials.credentials
@@ -412,10 +529,19 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="توکن نامعتبر است")
     
-    user = await db.users.find_one({"id": user_id})
+    cached_user = user_cache.get(user_id)
+    if cached_user is not None:
+        return cached_user
+    
+    generation = user_cache.generation()
+    # The cached principal leaves out the password hash and the KYC document blobs
+    user = await db.users.find_one({"id": user_id}, PRINCIPAL_PROJECTION)
     if user is None:
         raise HTTPException(status_code=401, detail="کاربر یافت نشد")
-    return User(**user)
+    
+    current_user = User(**user)
+    user_cache.set(user_id, current_user, generation)
+    return current_user
 
 async def get_current_admin(current_user: User = Depends(get_current_user)):
     if not current_user.is_admin:
@@ -454,6 +580,147 @@ def user_to_response(user: User) -> UserResponse:
         created_at=user.created_at
     )
 
+USER_SUMMARY_PROJECTION = {"_id": 0, "id": 1, "email": 1, "full_name": 1, "first_name": 1, "last_name": 1}
+
+async def get_user_summaries(user_ids) -> dict:
+    """Resolve distinct user ids to email/name fields with a single $in query"""
+    distinct_ids = list({user_id for user_id in user_ids if user_id})
+    if not distinct_ids:
+        return {}
+    
+    users = await db.users.find(
+        {"id": {"$in": distinct_ids}},
+        USER_SUMMARY_PROJECTION
+    ).to_list(None)
+    return {user["id"]: user for user in users}
+
+async def attach_user_info(documents: list, name_fallback: bool = False) -> list:
+    """Merge user_email/user_name into documents carrying a user_id
+    
+    Costs one users query regardless of how many documents are passed.
+    With name_fallback, users without full_name get "first_name last_name".
+    """
+    users = await get_user_summaries(document.get("user_id") for document in documents)
+    
+    for document in documents:
+        user = users.get(document.get("user_id"))
+        if not user:
+            continue
+        
+        document["user_email"] = user.get("email")
+        if name_fallback:
+            document["user_name"] = user.get("full_name") or f"{user.get('first_name', '')} {user.get('last_name', '')}"
+        else:
+            document["user_name"] = user.get("full_name")
+    
+    return documents
+
+# Heavy base64 blobs are never needed by list endpoints
+USER_LIST_PROJECTION = {"_id": 0, "kyc_documents": 0}
+DEPOSIT_LIST_PROJECTION = {"_id": 0, "receipt_image": 0}
+ORDER_LIST_PROJECTION = {"_id": 0}
+
+def encode_cursor(document: dict) -> str:
+    """Encode the (created_at, id) keyset position of a document"""
+    created_at = document.get("created_at")
+    position = {
+        "c": created_at.isoformat() if isinstance(created_at, datetime) else created_at,
+        "d": isinstance(created_at, datetime),
+        "i": document.get("id")
+    }
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        created_at = datetime.fromisoformat(position["c"]) if position["d"] else position["c"]
+        return created_at, position["i"]
+    except Exception:
+        raise HTTPException(status_code=400, detail="نشانگر صفحه نامعتبر است")
+
+async def paginate(collection, query: dict, projection: Optional[dict] = None,
+                   limit: Optional[int] = None, cursor: Optional[str] = None) -> tuple:
+    """Keyset pagination on (created_at, id), newest first
+    
+    Returns (documents, next_cursor); next_cursor is None on the last page.
+    Without a limit a page holds DEFAULT_PAGE_SIZE documents.
+    """
+    page_size = min(max(limit or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+    
+    if cursor:
+        created_at, document_id = decode_cursor(cursor)
+        query = {"$and": [query, {"$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": document_id}}
+        ]}]}
+    
+    documents = await collection.find(query, projection).sort(
+        [("created_at", -1), ("id", -1)]
+    ).limit(page_size + 1).to_list(page_size + 1)
+    
+    next_cursor = encode_cursor(documents[page_size - 1]) if len(documents) > page_size else None
+    return documents[:page_size], next_cursor
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]):
+    """Expose the next page cursor without changing list response bodies"""
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8"
+}
+
+def render_export_rows(rows: list, fields: list, export_format: str) -> str:
+    """Render a batch of response dicts as NDJSON lines or CSV rows"""
+    rows = jsonable_encoder(rows)
+    if export_format == "ndjson":
+        return "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+    
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+    for row in rows:
+        writer.writerow({field: json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+                         for field, value in row.items()})
+    return buffer.getvalue()
+
+async def stream_export(collection, projection: dict, to_row, fields: list,
+                        export_format: str, enrich: bool = False):
+    """Yield an export batch by batch straight from a Motor cursor
+    
+    Only one batch of documents is held in memory at a time, and batches go
+    through the same projection/enrichment as the paginated list endpoints.
+    """
+    if export_format == "csv":
+        # BOM so spreadsheet tools detect UTF-8 (Persian names)
+        header = io.StringIO()
+        csv.writer(header).writerow(fields)
+        yield "\ufeff" + header.getvalue()
+    
+    cursor = collection.find({}, projection).sort(
+        [("created_at", -1), ("id", -1)]
+    ).batch_size(EXPORT_BATCH_SIZE)
+    
+    try:
+        batch = []
+        async for document in cursor:
+            batch.append(document)
+            if len(batch) < EXPORT_BATCH_SIZE:
+                continue
+            
+            if enrich:
+                await attach_user_info(batch)
+            yield render_export_rows([to_row(document) for document in batch], fields, export_format)
+            batch = []
+        
+        if batch:
+            if enrich:
+                await attach_user_info(batch)
+            yield render_export_rows([to_row(document) for document in batch], fields, export_format)
+    finally:
+        await cursor.close()
+
 # ==================== API.IR INTEGRATION ====================
 
 async def send_sms_otp_apir(phone: str, code: str) -> bool:
@@ -465,27 +732,26 @@ async def send_sms_otp_apir(phone: str, code: str) -> bool:
         return True
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{APIR_BASE_URL}/sw1/SmsOTP",
-                headers={
-                    "Content-Type": "application/json",
-                    "Accept": "text/plain",
-                    "Authorization": APIR_API_KEY
-                },
-                json={"code": code, "mobile": phone},
-                timeout=10.0
-            )
+        client = get_http_client('apir')
+        response = await client.post(
+            f"{APIR_BASE_URL}/sw1/SmsOTP",
+            headers={
+                "Content-Type": "application/json",
+                "Accept": "text/plain",
+                "Authorization": APIR_API_KEY
+            },
+            json={"code": code, "mobile": phone}
+        )
+        
+        if response.status_code == 200:
+            data = response.json()
+            return data.get("success", False)
+        else:
+            logger.warning(f"API.IR OTP failed with status {response.status_code}: {response.text}")
+            # Fallback to development mode on API failure
+            logger.info(f"FALLBACK: OTP {code} for {phone} (API.IR unavailable)")
+            return True
             
-            if response.status_code == 200:
-                data = response.json()
-                return data.get("success", False)
-            else:
-                logger.warning(f"API.IR OTP failed with status {response.status_code}: {response.text}")
-                # Fallback to development mode on API failure
-                logger.info(f"FALLBACK: OTP {code} for {phone} (API.IR unavailable)")
-                return True
-                
     except Exception as e:
         logger.error(f"API.IR SMS OTP Error: {str(e)}")
         # Fallback to development mode on error
@@ -501,30 +767,29 @@ async def verify_shahkar(national_code: str, mobile: str, is_company: bool = Fal
         return {"success": True, "data": {"match": True}}
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{APIR_BASE_URL}/sw1/Shahkar",
-                headers={
-                    "Content-Type": "application/json",
-                    "Accept": "text/plain",
-                    "Authorization": APIR_API_KEY
-                },
-                json={
-                    "nationalCode": national_code,
-                    "mobile": mobile,
-                    "isCompany": is_company
-                },
-                timeout=10.0
-            )
+        client = get_http_client('apir')
+        response = await client.post(
+            f"{APIR_BASE_URL}/sw1/Shahkar",
+            headers={
+                "Content-Type": "application/json",
+                "Accept": "text/plain",
+                "Authorization": APIR_API_KEY
+            },
+            json={
+                "nationalCode": national_code,
+                "mobile": mobile,
+                "isCompany": is_company
+            }
+        )
+        
+        if response.status_code == 200:
+            return response.json()
+        else:
+            logger.warning(f"API.IR Shahkar failed with status {response.status_code}: {response.text}")
+            # Fallback to development mode on API failure
+            logger.info(f"FALLBACK: Shahkar verification for {national_code} with {mobile} (API.IR unavailable)")
+            return {"success": True, "data": {"match": True}}
             
-            if response.status_code == 200:
-                return response.json()
-            else:
-                logger.warning(f"API.IR Shahkar failed with status {response.status_code}: {response.text}")
-                # Fallback to development mode on API failure
-                logger.info(f"FALLBACK: Shahkar verification for {national_code} with {mobile} (API.IR unavailable)")
-                return {"success": True, "data": {"match": True}}
-                
     except Exception as e:
         logger.error(f"API.IR Shahkar Error: {str(e)}")
         # Fallback to development mode on error
@@ -540,30 +805,29 @@ async def verify_card_match(national_code: str, birth_date: str, card_number: st
         return {"success": True, "data": {"match": True}}
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{APIR_BASE_URL}/sw1/CardMatch",
-                headers={
-                    "Content-Type": "application/json",
-                    "Accept": "text/plain",
-                    "Authorization": APIR_API_KEY
-                },
-                json={
-                    "nationalCode": national_code,
-                    "birthDate": birth_date,
-                    "cardNumber": card_number
-                },
-                timeout=10.0
-            )
+        client = get_http_client('apir')
+        response = await client.post(
+            f"{APIR_BASE_URL}/sw1/CardMatch",
+            headers={
+                "Content-Type": "application/json",
+                "Accept": "text/plain",
+                "Authorization": APIR_API_KEY
+            },
+            json={
+                "nationalCode": national_code,
+                "birthDate": birth_date,
+                "cardNumber": card_number
+            }
+        )
+        
+        if response.status_code == 200:
+            return response.json()
+        else:
+            logger.warning(f"API.IR CardMatch failed with status {response.status_code}: {response.text}")
+            # Fallback to development mode on API failure
+            logger.info(f"FALLBACK: CardMatch verification for {national_code} with card {card_number[-4:]} (API.IR unavailable)")
+            return {"success": True, "data": {"match": True}}
             
-            if response.status_code == 200:
-                return response.json()
-            else:
-                logger.warning(f"API.IR CardMatch failed with status {response.status_code}: {response.text}")
-                # Fallback to development mode on API failure
-                logger.info(f"FALLBACK: CardMatch verification for {national_code} with card {card_number[-4:]} (API.IR unavailable)")
-                return {"success": True, "data": {"match": True}}
-                
     except Exception as e:
         logger.error(f"API.IR CardMatch Error: {str(e)}")
         # Fallback to development mode on error
@@ -579,26 +843,25 @@ async def get_card_info(card_number: str) -> dict:
         return {"success": True, "data": {"name": "صاحب کارت تست"}}
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{APIR_BASE_URL}/sw1/CardInfo",
-                headers={
-                    "Content-Type": "application/json",
-                    "Accept": "text/plain",
-                    "Authorization": APIR_API_KEY
-                },
-                json={"cardNumber": card_number},
-                timeout=10.0
-            )
+        client = get_http_client('apir')
+        response = await client.post(
+            f"{APIR_BASE_URL}/sw1/CardInfo",
+            headers={
+                "Content-Type": "application/json",
+                "Accept": "text/plain",
+                "Authorization": APIR_API_KEY
+            },
+            json={"cardNumber": card_number}
+        )
+        
+        if response.status_code == 200:
+            return response.json()
+        else:
+            logger.warning(f"API.IR CardInfo failed with status {response.status_code}: {response.text}")
+            # Fallback to development mode on API failure
+            logger.info(f"FALLBACK: CardInfo for card {card_number[-4:]} (API.IR unavailable)")
+            return {"success": True, "data": {"name": "صاحب کارت"}}
             
-            if response.status_code == 200:
-                return response.json()
-            else:
-                logger.warning(f"API.IR CardInfo failed with status {response.status_code}: {response.text}")
-                # Fallback to development mode on API failure
-                logger.info(f"FALLBACK: CardInfo for card {card_number[-4:]} (API.IR unavailable)")
-                return {"success": True, "data": {"name": "صاحب کارت"}}
-                
     except Exception as e:
         logger.error(f"API.IR CardInfo Error: {str(e)}")
         # Fallback to development mode on error
@@ -615,13 +878,13 @@ async def send_otp(request: SendOTPRequest, http_request: Request):
     phone_key = f"otp_send_{request.phone}"
     ip_key = f"otp_send_ip_{client_ip}"
     
-    if not check_rate_limit(phone_key, limit=3, window=300):  # 3 OTP per phone per 5 minutes
+    if not await check_rate_limit(phone_key, limit=3, window=300):  # 3 OTP per phone per 5 minutes
         raise HTTPException(
             status_code=429,
             detail="تعداد درخواست کد تایید برای این شماره بیش از حد مجاز. لطفا 5 دقیقه صبر کنید"
         )
     
-    if not check_rate_limit(ip_key, limit=10, window=300):  # 10 OTP per IP per 5 minutes
+    if not await check_rate_limit(ip_key, limit=10, window=300):  # 10 OTP per IP per 5 minutes
         raise HTTPException(
             status_code=429,
             detail="تعداد درخواست کد تایید از این IP بیش از حد مجاز. لطفا 5 دقیقه صبر کنید"
@@ -651,7 +914,7 @@ async def verify_otp(request: VerifyOTPRequest, http_request: Request):
     # Rate limiting for OTP verification attempts
     phone_key = f"otp_verify_{request.phone}"
     
-    if not check_rate_limit(phone_key, limit=5, window=300):  # 5 verification attempts per phone per 5 minutes
+    if not await check_rate_limit(phone_key, limit=5, window=300):  # 5 verification attempts per phone per 5 minutes
         raise HTTPException(
             status_code=429,
             detail="تعداد تلاش‌های تایید کد برای این شماره بیش از حد مجاز. لطفا 5 دقیقه صبر کنید"
@@ -704,7 +967,7 @@ async def verify_otp(request: VerifyOTPRequest, http_request: Request):
 async def register(user_data: UserCreate, request: Request):
     # Rate limiting for registration attempts
     client_ip = request.client.host if request.client else "unknown"
-    if not check_rate_limit(f"register_{client_ip}", limit=3, window=300):  # 3 attempts per 5 minutes
+    if not await check_rate_limit(f"register_{client_ip}", limit=3, window=300):  # 3 attempts per 5 minutes
         raise HTTPException(
             status_code=429,
             detail="تعداد تلاش‌های ثبت‌نام بیش از حد مجاز. لطفا 5 دقیقه صبر کنید"
@@ -746,6 +1009,7 @@ async def register(user_data: UserCreate, request: Request):
     )
     
     await db.users.insert_one(user.dict())
+    await platform_stats.record("users", None, user.dict())
     
     # Create access token
     access_token = create_access_token(data={"sub": user.id})
@@ -762,7 +1026,7 @@ async def login_user(user_credentials: UserLogin, request: Request):
     
     # Rate limiting for login attempts
     client_ip = request.client.host if request.client else "unknown"
-    if not check_rate_limit(f"login_{client_ip}", limit=5, window=300):  # 5 attempts per 5 minutes
+    if not await check_rate_limit(f"login_{client_ip}", limit=5, window=300):  # 5 attempts per 5 minutes
         raise HTTPException(
             status_code=429,
             detail="تعداد تلاش‌های ورود بیش از حد مجاز. لطفا 5 دقیقه صبر کنید"
@@ -844,7 +1108,8 @@ async def submit_kyc_level1(kyc_data: KYCLevel1Request, current_user: User = Dep
     card_owner_name = card_info.get("data", {}).get("name", "")
     
     # Update user with KYC Level 1 data
-    await db.users.update_one(
+    await platform_stats.tracked_update(
+        "users",
         {"id": current_user.id},
         {"$set": {
             "full_name": kyc_data.full_name,
@@ -856,6 +1121,7 @@ async def submit_kyc_level1(kyc_data: KYCLevel1Request, current_user: User = Dep
             "updated_at": datetime.now(timezone.utc)
         }}
     )
+    user_cache.invalidate(current_user.id)
     
     return {
         "success": True,
@@ -889,7 +1155,8 @@ async def submit_kyc_level2(kyc_data: KYCLevel2Request, current_user: User = Dep
     }
     
     # Update user - pending admin approval
-    await db.users.update_one(
+    await platform_stats.tracked_update(
+        "users",
         {"id": current_user.id},
         {"$set": {
             "kyc_documents": kyc_documents,
@@ -897,6 +1164,7 @@ async def submit_kyc_level2(kyc_data: KYCLevel2Request, current_user: User = Dep
             "updated_at": datetime.now(timezone.utc)
         }}
     )
+    user_cache.invalidate(current_user.id)
     
     return {
         "success": True,
@@ -910,7 +1178,9 @@ async def get_kyc_status(current_user: User = Depends(get_current_user)):
     return {
         "kyc_level": current_user.kyc_level,
         "kyc_status": current_user.kyc_status,
-        "has_documents": current_user.kyc_documents is not None,
+        "has_documents": await db.users.count_documents(
+            {"id": current_user.id, "kyc_documents": {"$ne": None}}, limit=1
+        ) > 0,
         "full_name": current_user.full_name,
         "national_code": current_user.national_code,
         "bank_card_number": current_user.bank_card_number
@@ -939,6 +1209,7 @@ async def update_user_profile(profile_data: dict, current_user: User = Depends(g
             {"id": current_user.id},
             {"$set": update_data}
         )
+        user_cache.invalidate(current_user.id)
         
         # Get updated user
         updated_user = await db.users.find_one({"id": current_user.id})
@@ -1056,27 +1327,21 @@ async def get_banking_info(current_user: User = Depends(get_current_user)):
 
 @api_router.get("/admin/stats", response_model=AdminStats)
 async def get_admin_stats(admin: User = Depends(get_current_admin)):
-    total_users = await db.users.count_documents({})
-    active_users = await db.users.count_documents({"is_active": True})
-    
-    # Calculate total deposits
-    deposits = await db.deposit_requests.find({"status": "approved"}).to_list(None)
-    total_deposits = sum([d.get("amount", 0) for d in deposits])
-    
-    pending_deposits = await db.deposit_requests.count_documents({"status": "pending"})
-    total_cards = await db.card_numbers.count_documents({"is_active": True})
+    stats = await platform_stats.get_counters()
     
     return AdminStats(
-        total_users=total_users,
-        active_users=active_users,
-        total_deposits=total_deposits,
-        pending_deposits=pending_deposits,
-        total_cards=total_cards
+        total_users=stats.get("users_total", 0),
+        active_users=stats.get("users_active", 0),
+        total_deposits=stats.get("deposits_approved_amount", 0),
+        pending_deposits=stats.get("deposits_pending", 0),
+        total_cards=stats.get("cards_active", 0)
     )
 
 @api_router.get("/admin/users", response_model=List[UserResponse])
-async def get_all_users(admin: User = Depends(get_current_admin)):
-    users = await db.users.find().to_list(None)
+async def get_all_users(response: Response, limit: Optional[int] = None, cursor: Optional[str] = None,
+                        admin: User = Depends(get_current_admin)):
+    users, next_cursor = await paginate(db.users, {}, USER_LIST_PROJECTION, limit, cursor)
+    set_next_cursor(response, next_cursor)
     return [user_to_response(User(**user)) for user in users]
 
 @api_router.put("/admin/users/{user_id}")
@@ -1088,15 +1353,17 @@ async def update_user(user_id: str, user_update: UserUpdate, admin: User = Depen
     update_data = {k: v for k, v in user_update.dict().items() if v is not None}
     update_data["updated_at"] = datetime.now(timezone.utc)
     
-    await db.users.update_one({"id": user_id}, {"$set": update_data})
+    await platform_stats.tracked_update("users", {"id": user_id}, {"$set": update_data})
+    user_cache.invalidate(user_id)
     
     updated_user = await db.users.find_one({"id": user_id})
     return user_to_response(User(**updated_user))
 
 @api_router.delete("/admin/users/{user_id}")
 async def delete_user(user_id: str, admin: User = Depends(get_current_admin)):
-    result = await db.users.delete_one({"id": user_id})
-    if result.deleted_count == 0:
+    deleted = await platform_stats.tracked_delete("users", {"id": user_id})
+    user_cache.invalidate(user_id)
+    if deleted is None:
         raise HTTPException(status_code=404, detail="کاربر یافت نشد")
     return {"message": "کاربر با موفقیت حذف شد"}
 
@@ -1116,7 +1383,8 @@ async def suspend_user(user_id: str, suspension_data: dict, admin: User = Depend
     if duration:
         suspension_end = (datetime.now(timezone.utc) + timedelta(days=duration)).isoformat()
     
-    await db.users.update_one(
+    await platform_stats.tracked_update(
+        "users",
         {"id": user_id},
         {"$set": {
             "is_suspended": True,
@@ -1126,6 +1394,7 @@ async def suspend_user(user_id: str, suspension_data: dict, admin: User = Depend
             "suspended_by": admin.id
         }}
     )
+    user_cache.invalidate(user_id)
     
     # Log activity
     await db.user_activity_logs.insert_one({
@@ -1146,7 +1415,8 @@ async def unsuspend_user(user_id: str, admin: User = Depends(get_current_admin))
     if not user:
         raise HTTPException(status_code=404, detail="کاربر یافت نشد")
     
-    await db.users.update_one(
+    await platform_stats.tracked_update(
+        "users",
         {"id": user_id},
         {"$set": {
             "is_suspended": False,
@@ -1156,6 +1426,7 @@ async def unsuspend_user(user_id: str, admin: User = Depends(get_current_admin))
             "unsuspended_by": admin.id
         }}
     )
+    user_cache.invalidate(user_id)
     
     # Log activity
     await db.user_activity_logs.insert_one({
@@ -1210,6 +1481,7 @@ async def add_user_tag(user_id: str, tag_data: dict, admin: User = Depends(get_c
             {"id": user_id},
             {"$set": {"tags": current_tags}}
         )
+        user_cache.invalidate(user_id)
     
     return {"message": "برچسب با موفقیت اضافه شد", "tags": current_tags}
 
@@ -1227,6 +1499,7 @@ async def remove_user_tag(user_id: str, tag: str, admin: User = Depends(get_curr
             {"id": user_id},
             {"$set": {"tags": current_tags}}
         )
+        user_cache.invalidate(user_id)
     
     return {"message": "برچسب با موفقیت حذف شد", "tags": current_tags}
 
@@ -1237,7 +1510,7 @@ async def get_user_activity(user_id: str, admin: User = Depends(get_current_admi
     return activities
 
 @api_router.post("/admin/users/search")
-async def search_users(search_params: dict, admin: User = Depends(get_current_admin)):
+async def search_users(search_params: dict, response: Response, admin: User = Depends(get_current_admin)):
     """Advanced user search with multiple filters"""
     query = {}
     
@@ -1281,7 +1554,11 @@ async def search_users(search_params: dict, admin: User = Depends(get_current_ad
         else:
             query["created_at"] = {"$lte": search_params["created_before"]}
     
-    users = await db.users.find(query).to_list(None)
+    users, next_cursor = await paginate(
+        db.users, query, USER_LIST_PROJECTION,
+        search_params.get("limit"), search_params.get("cursor")
+    )
+    set_next_cursor(response, next_cursor)
     return [user_to_response(User(**user)) for user in users]
 
 @api_router.post("/admin/users/bulk-action")
@@ -1298,7 +1575,8 @@ async def bulk_user_action(bulk_data: dict, admin: User = Depends(get_current_ad
     for user_id in user_ids:
         try:
             if action == "suspend":
-                await db.users.update_one(
+                await platform_stats.tracked_update(
+                    "users",
                     {"id": user_id},
                     {"$set": {
                         "is_suspended": True,
@@ -1308,7 +1586,8 @@ async def bulk_user_action(bulk_data: dict, admin: User = Depends(get_current_ad
                     }}
                 )
             elif action == "unsuspend":
-                await db.users.update_one(
+                await platform_stats.tracked_update(
+                    "users",
                     {"id": user_id},
                     {"$set": {
                         "is_suspended": False,
@@ -1331,8 +1610,9 @@ async def bulk_user_action(bulk_data: dict, admin: User = Depends(get_current_ad
                         {"$pull": {"tags": tag}}
                     )
             elif action == "delete":
-                await db.users.delete_one({"id": user_id})
+                await platform_stats.tracked_delete("users", {"id": user_id})
             
+            user_cache.invalidate(user_id)
             result["success"] += 1
         except Exception as e:
             result["failed"] += 1
@@ -1346,34 +1626,24 @@ async def bulk_user_action(bulk_data: dict, admin: User = Depends(get_current_ad
 @api_router.get("/admin/users/stats")
 async def get_user_stats(admin: User = Depends(get_current_admin)):
     """Get user statistics for admin dashboard"""
-    total_users = await db.users.count_documents({})
-    active_users = await db.users.count_documents({"last_login": {"$gte": (datetime.now(timezone.utc) - timedelta(days=30)).isoformat()}})
-    suspended_users = await db.users.count_documents({"is_suspended": True})
-    admin_users = await db.users.count_documents({"is_admin": True})
-    
-    # KYC stats
-    kyc_level_0 = await db.users.count_documents({"kyc_level": 0})
-    kyc_level_1 = await db.users.count_documents({"kyc_level": 1})
-    kyc_level_2 = await db.users.count_documents({"kyc_level": 2})
-    
-    pending_kyc = await db.users.count_documents({"kyc_status": "pending"})
-    
-    # Recent registrations
-    today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    new_today = await db.users.count_documents({"created_at": {"$gte": today_start.isoformat()}})
+    stats, today = await asyncio.gather(
+        platform_stats.get_counters(),
+        platform_stats.get_bucket("day")
+    )
     
     return {
-        "total_users": total_users,
-        "active_users": active_users,
-        "suspended_users": suspended_users,
-        "admin_users": admin_users,
+        "total_users": stats.get("users_total", 0),
+        "active_users": stats.get("users_recently_active", 0),
+        "suspended_users": stats.get("users_suspended", 0),
+        "admin_users": stats.get("users_admin", 0),
         "kyc_stats": {
-            "level_0": kyc_level_0,
-            "level_1": kyc_level_1,
-            "level_2": kyc_level_2,
-            "pending": pending_kyc
+            "level_0": stats.get("kyc_level_0", 0),
+            "level_1": stats.get("kyc_level_1", 0),
+            "level_2": stats.get("kyc_level_2", 0),
+            "pending": stats.get("kyc_pending", 0)
         },
-        "new_today": new_today
+        # Recent registrations
+        "new_today": today.get("registrations", 0)
     }
 
 # ==================== CARD NUMBER ROUTES ====================
@@ -1395,15 +1665,17 @@ async def create_card(card_data: CardNumberCreate, admin: User = Depends(get_cur
         cardholder_name=card_data.cardholder_name
     )
     await db.card_numbers.insert_one(card.dict())
+    await platform_stats.record("card_numbers", None, card.dict())
     return CardNumberResponse(**card.dict())
 
 @api_router.put("/admin/cards/{card_id}")
 async def update_card(card_id: str, is_active: bool, admin: User = Depends(get_current_admin)):
-    result = await db.card_numbers.update_one(
+    previous = await platform_stats.tracked_update(
+        "card_numbers",
         {"id": card_id},
         {"$set": {"is_active": is_active}}
     )
-    if result.modified_count == 0:
+    if previous is None:
         raise HTTPException(status_code=404, detail="کارت یافت نشد")
     
     card = await db.card_numbers.find_one({"id": card_id})
@@ -1411,8 +1683,8 @@ async def update_card(card_id: str, is_active: bool, admin: User = Depends(get_c
 
 @api_router.delete("/admin/cards/{card_id}")
 async def delete_card(card_id: str, admin: User = Depends(get_current_admin)):
-    result = await db.card_numbers.delete_one({"id": card_id})
-    if result.deleted_count == 0:
+    deleted = await platform_stats.tracked_delete("card_numbers", {"id": card_id})
+    if deleted is None:
         raise HTTPException(status_code=404, detail="کارت یافت نشد")
     return {"message": "کارت با موفقیت حذف شد"}
 
@@ -1428,6 +1700,7 @@ async def create_deposit_request(deposit_data: DepositRequestCreate, current_use
         receipt_image=deposit_data.receipt_image
     )
     await db.deposit_requests.insert_one(deposit.dict())
+    await platform_stats.record("deposit_requests", None, deposit.dict())
     
     response_data = deposit.dict()
     response_data["user_email"] = current_user.email
@@ -1436,8 +1709,12 @@ async def create_deposit_request(deposit_data: DepositRequestCreate, current_use
     return DepositRequestResponse(**response_data)
 
 @api_router.get("/deposits/my", response_model=List[DepositRequestResponse])
-async def get_my_deposits(current_user: User = Depends(get_current_user)):
-    deposits = await db.deposit_requests.find({"user_id": current_user.id}).to_list(None)
+async def get_my_deposits(response: Response, limit: Optional[int] = None, cursor: Optional[str] = None,
+                          current_user: User = Depends(get_current_user)):
+    deposits, next_cursor = await paginate(
+        db.deposit_requests, {"user_id": current_user.id}, DEPOSIT_LIST_PROJECTION, limit, cursor
+    )
+    set_next_cursor(response, next_cursor)
     
     result = []
     for deposit in deposits:
@@ -1449,19 +1726,13 @@ async def get_my_deposits(current_user: User = Depends(get_current_user)):
     return result
 
 @api_router.get("/admin/deposits", response_model=List[DepositRequestResponse])
-async def get_all_deposits(admin: User = Depends(get_current_admin)):
-    deposits = await db.deposit_requests.find().to_list(None)
-    
-    result = []
-    for deposit in deposits:
-        user = await db.users.find_one({"id": deposit["user_id"]})
-        response_data = deposit.copy()
-        if user:
-            response_data["user_email"] = user.get("email")
-            response_data["user_name"] = user.get("full_name")
-        result.append(DepositRequestResponse(**response_data))
+async def get_all_deposits(response: Response, limit: Optional[int] = None, cursor: Optional[str] = None,
+                           admin: User = Depends(get_current_admin)):
+    deposits, next_cursor = await paginate(db.deposit_requests, {}, DEPOSIT_LIST_PROJECTION, limit, cursor)
+    set_next_cursor(response, next_cursor)
+    await attach_user_info(deposits)
     
-    return result
+    return [DepositRequestResponse(**deposit) for deposit in deposits]
 
 @api_router.post("/admin/deposits/approve")
 async def approve_deposit(approval: DepositApproval, admin: User = Depends(get_current_admin)):
@@ -1474,7 +1745,8 @@ async def approve_deposit(approval: DepositApproval, admin: User = Depends(get_c
     
     # Update deposit status
     new_status = "approved" if approval.action == "approve" else "rejected"
-    await db.deposit_requests.update_one(
+    await platform_stats.tracked_update(
+        "deposit_requests",
         {"id": approval.deposit_id},
         {"$set": {
             "status": new_status,
@@ -1489,6 +1761,7 @@ async def approve_deposit(approval: DepositApproval, admin: User = Depends(get_c
             {"id": deposit["user_id"]},
             {"$inc": {"wallet_balance_tmn": deposit["amount"]}}
         )
+        user_cache.invalidate(deposit["user_id"])
     
     return {"message": f"درخواست با موفقیت {new_status} شد"}
 
@@ -1521,7 +1794,8 @@ async def approve_kyc(approval: KYCApprovalRequest, admin: User = Depends(get_cu
         raise HTTPException(status_code=404, detail="کاربر یافت نشد")
     
     if approval.action == "approve":
-        await db.users.update_one(
+        await platform_stats.tracked_update(
+            "users",
             {"id": approval.user_id},
             {"$set": {
                 "kyc_level": approval.kyc_level,
@@ -1529,13 +1803,15 @@ async def approve_kyc(approval: KYCApprovalRequest, admin: User = Depends(get_cu
                 "updated_at": datetime.now(timezone.utc)
             }}
         )
+        user_cache.invalidate(approval.user_id)
         
         # Log the approval for debugging
         logger.info(f"KYC approved for user {approval.user_id}: level={approval.kyc_level}, status=approved")
         
         message = f"احراز هویت سطح {approval.kyc_level} تایید شد"
     else:
-        await db.users.update_one(
+        await platform_stats.tracked_update(
+            "users",
             {"id": approval.user_id},
             {"$set": {
                 "kyc_status": "rejected",
@@ -1543,6 +1819,7 @@ async def approve_kyc(approval: KYCApprovalRequest, admin: User = Depends(get_cu
                 "updated_at": datetime.now(timezone.utc)
             }}
         )
+        user_cache.invalidate(approval.user_id)
         message = "احراز هویت رد شد"
     
     if approval.action == "approve":
@@ -1562,117 +1839,200 @@ async def approve_kyc(approval: KYCApprovalRequest, admin: User = Depends(get_cu
 
 # ==================== CRYPTO PRICE ROUTES ====================
 
-# Cache for prices - avoid too many API calls
-_price_cache = {'data': None, 'timestamp': None}
-_cache_duration = 300  # 5 minutes cache
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether If-None-Match already names this representation"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
 
 @api_router.get("/crypto/prices")
-async def get_crypto_prices():
-    """Get current prices - CACHED to avoid API ban"""
+async def get_crypto_prices(request: Request, response: Response, since: Optional[str] = None):
+    """Get current prices from the in-memory price book (no network I/O)
+    
+    The ETag follows the price book position, so pollers get a 304 until a
+    price changes. ?since=<position> returns only coins changed after it; a
+    position from another worker or from before a restart gets the full
+    snapshot.
+    """
+    position = price_book.position()
+    base = price_book.version_at(since)
+    delta = base is not None
+    etag = f'"prices-{position}-d{base}"' if delta else f'"prices-{position}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    
+    prices = price_book.snapshot()
+    live = any(entry.get('source') != 'static' for entry in prices.values())
+    
+    result = {
+        'success': True,
+        'data': price_book.changes_since(base) if delta else dict(prices),
+        'source': 'live' if live else 'static',
+        'version': price_book.version,
+        'position': position
+    }
+    if delta:
+        # Absent coins are unchanged since the client's position
+        result['since'] = since
+    return result
+
+@api_router.websocket("/ws/prices")
+async def stream_prices_ws(websocket: WebSocket):
+    """Push price changes; clients send {"action": "subscribe"|"unsubscribe", "symbols": [...]}"""
+    await websocket.accept()
+    subscription = price_broadcaster.subscribe()
+    
+    async def receive_commands():
+        while True:
+            command = await websocket.receive_json()
+            coin_ids = price_broadcaster.resolve(command.get("symbols") or [])
+            if command.get("action") == "subscribe":
+                # The first subscribe narrows the default "all coins" stream
+                subscription.coin_ids = (subscription.coin_ids or set()) | coin_ids
+                subscription.notify(coin_ids)
+            elif command.get("action") == "unsubscribe" and subscription.coin_ids is not None:
+                subscription.coin_ids -= coin_ids
+    
+    receiver = asyncio.create_task(receive_commands())
     try:
-        # Check cache first
-        now = datetime.now(timezone.utc)
-        if (_price_cache['data'] is not None and 
-            _price_cache['timestamp'] is not None and
-            (now - _price_cache['timestamp']).total_seconds() < _cache_duration):
-            logger.info("✅ Returning cached prices (no API call)")
-            return _price_cache['data']
-        
-        # Static prices - fast and no API calls
-        prices = {
-            'bitcoin': {'symbol': 'BTC', 'name': 'Bitcoin', 'price_tmn': 12959940780, 'change_24h': -6.38},
-            'ethereum': {'symbol': 'ETH', 'name': 'Ethereum', 'price_tmn': 445134743, 'change_24h': -10.38},
-            'tether': {'symbol': 'USDT', 'name': 'Tether', 'price_tmn': 115090, 'change_24h': 0.19},
-            'binancecoin': {'symbol': 'BNB', 'name': 'Binance Coin', 'price_tmn': 123989909, 'change_24h': -12.76},
-            'ripple': {'symbol': 'XRP', 'name': 'XRP', 'price_tmn': 264664, 'change_24h': -17.75},
-            'cardano': {'symbol': 'ADA', 'name': 'Cardano', 'price_tmn': 67454, 'change_24h': -24.91},
-            'solana': {'symbol': 'SOL', 'name': 'Solana', 'price_tmn': 21460832, 'change_24h': -13.72},
-            'dogecoin': {'symbol': 'DOGE', 'name': 'Dogecoin', 'price_tmn': 7500, 'change_24h': -1.2},
-            'polkadot': {'symbol': 'DOT', 'name': 'Polkadot', 'price_tmn': 314771, 'change_24h': -29.46},
-            'tron': {'symbol': 'TRX', 'name': 'TRON', 'price_tmn': 36655, 'change_24h': -5.03},
-            'usd-coin': {'symbol': 'USDC', 'name': 'USD Coin', 'price_tmn': 114641, 'change_24h': -0.07},
-            'chainlink': {'symbol': 'LINK', 'name': 'Chainlink', 'price_tmn': 1859854, 'change_24h': -24.6},
-            'litecoin': {'symbol': 'LTC', 'name': 'Litecoin', 'price_tmn': 10899023, 'change_24h': -19.48},
-            'avalanche-2': {'symbol': 'AVAX', 'name': 'Avalanche', 'price_tmn': 2445777, 'change_24h': -24.28},
-            'stellar': {'symbol': 'XLM', 'name': 'Stellar', 'price_tmn': 32731, 'change_24h': -23.37},
-        }
-        
-        for coin_id, data in prices.items():
-            data['last_updated'] = datetime.now(timezone.utc).isoformat()
-        
-        result = {'success': True, 'data': prices, 'source': 'static'}
-        
-        # Update cache
-        _price_cache['data'] = result
-        _price_cache['timestamp'] = now
-        
-        return result
-        
+        await websocket.send_text(price_broadcaster.render())
+        while not receiver.done():
+            coin_ids = await subscription.next_batch(timeout=PRICE_STREAM_KEEPALIVE)
+            if coin_ids:
+                await websocket.send_text(price_broadcaster.render(coin_ids))
+    except WebSocketDisconnect:
+        pass
     except Exception as e:
-        logger.error(f"Error getting crypto prices: {str(e)}")
-        raise HTTPException(status_code=500, detail="خطا در دریافت قیمت‌ها")
+        logger.debug(f"Price WebSocket closed: {str(e)}")
+    finally:
+        receiver.cancel()
+        price_broadcaster.unsubscribe(subscription)
+
+@api_router.get("/sse/prices")
+async def stream_prices_sse(request: Request, symbols: Optional[str] = None):
+    """Server-Sent Events price stream; ?symbols=BTC,ETH filters, Last-Event-ID resumes"""
+    coin_ids = price_broadcaster.resolve(symbols.split(",")) if symbols else None
+    last_event_id = request.headers.get("last-event-id", "")
+    
+    async def events():
+        subscription = price_broadcaster.subscribe(coin_ids)
+        try:
+            # Event ids are book positions; one from another worker or boot resumes with a full snapshot
+            base = price_book.version_at(last_event_id)
+            if base is not None:
+                changed = set(price_book.changes_since(base))
+                initial = changed if coin_ids is None else changed & coin_ids
+            else:
+                initial = coin_ids
+            if initial is None or initial:
+                yield f"id: {price_book.position()}\nevent: prices\ndata: {price_broadcaster.render(initial)}\n\n"
+            
+            while True:
+                batch = await subscription.next_batch(timeout=PRICE_STREAM_KEEPALIVE)
+                if batch:
+                    yield f"id: {price_book.position()}\nevent: prices\ndata: {price_broadcaster.render(batch)}\n\n"
+                else:
+                    yield ": keep-alive\n\n"
+        finally:
+            price_broadcaster.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @api_router.post("/admin/crypto/refresh-prices")
 async def refresh_crypto_prices(admin: User = Depends(get_current_admin)):
-    """Manually trigger price update from Nobitex (Admin only)"""
+    """Manually refresh the price book from all live sources (Admin only)"""
     try:
-        nobitex_service = get_price_service(db)
-        result = await nobitex_service.scrape_nobitex_prices()
+        prices = await price_aggregator.refresh()
         
-        if result.get("success"):
+        if prices:
             return {
                 "message": "قیمت‌ها با موفقیت به‌روزرسانی شدند",
-                "prices_count": len(result.get("data", {})),
-                "last_update": nobitex_service.last_update.isoformat() if nobitex_service.last_update else None
+                "prices_count": len(prices),
+                "last_update": price_book.updated_at.isoformat() if price_book.updated_at else None
             }
         else:
             raise HTTPException(status_code=500, detail="خطا در به‌روزرسانی قیمت‌ها")
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error refreshing prices: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/admin/crypto/price-sources")
+async def get_price_sources(admin: User = Depends(get_current_admin)):
+    """Price feed freshness, per-source latency/success, stream fan-out and CoinGecko breaker stats (Admin only)"""
+    return {
+        "feed": price_aggregator.get_status(),
+        "stream": price_broadcaster.get_stats(),
+        "coingecko": price_service.get_status(),
+        "matching_engine": matching_engine.get_stats(),
+        "stop_loss": stop_loss_engine.get_stats(),
+        "dca_executor": dca_executor.get_stats(),
+        "hedged_fetch": nobitex_service.get_source_stats()
+    }
+
+@api_router.get("/admin/system/price-storage")
+async def get_price_storage(admin: User = Depends(get_current_admin)):
+    """Price tick storage footprint and one-year projection (Admin only)"""
+    try:
+        return await get_tick_storage_stats(db)
+    except Exception as e:
+        logger.error(f"Error reading price tick storage stats: {str(e)}")
+        raise HTTPException(status_code=500, detail="خطا در دریافت آمار ذخیره‌سازی قیمت‌ها")
+
 @api_router.get("/crypto/{coin_id}")
 async def get_coin_details(coin_id: str):
     """Get detailed information about a specific coin"""
-    # Check cache first
-    cache_key = f"coin_details_{coin_id}"
-    cached_result = get_from_cache(cache_key)
-    if cached_result:
-        return cached_result
-    
-    result = await price_service.get_coin_details(coin_id)
-    if not result["success"]:
-        raise HTTPException(status_code=404, detail=result.get("error"))
+    async def load_coin_details():
+        result = await price_service.get_coin_details(coin_id)
+        if not result["success"]:
+            raise HTTPException(status_code=404, detail=result.get("error"))
+        return result
     
-    # Cache the result
-    set_cache(cache_key, result)
-    return result
+    # Concurrent misses share one upstream call
+    return await get_or_set_cache(f"coin_details_{coin_id}", load_coin_details)
 
 @api_router.get("/crypto/{coin_id}/chart")
-async def get_coin_chart(coin_id: str, days: int = 7):
-    """Get historical chart data"""
-    result = await price_service.get_market_chart(coin_id, days)
-    if not result["success"]:
-        raise HTTPException(status_code=500, detail=result.get("error"))
-    return result
+async def get_coin_chart(coin_id: str, days: float = 7, interval: Optional[str] = None, max_points: int = 500):
+    """Get historical Toman chart data from locally built candles"""
+    interval = interval or pick_interval(days)
+    if interval not in INTERVALS:
+        raise HTTPException(status_code=400, detail="بازه زمانی نمودار نامعتبر است")
+    
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    candles = downsample(await candle_builder.get_candles(coin_id, interval, since), max_points)
+    
+    return {
+        "success": True,
+        "data": {
+            "interval": interval,
+            "currency": "tmn",
+            "candles": candles,
+            # [timestamp_ms, close] pairs, same shape as the former market_chart prices
+            "prices": [[candle["t"] * 1000, candle["c"]] for candle in candles]
+        }
+    }
 
 @api_router.get("/crypto/trending/coins")
 async def get_trending():
     """Get trending cryptocurrencies"""
-    # Check cache first
-    cache_key = "trending_coins"
-    cached_result = get_from_cache(cache_key)
-    if cached_result:
-        return cached_result
-    
-    result = await price_service.get_trending_coins()
-    if not result["success"]:
-        raise HTTPException(status_code=500, detail=result.get("error"))
+    async def load_trending():
+        result = await price_service.get_trending_coins()
+        if not result["success"]:
+            raise HTTPException(status_code=500, detail=result.get("error"))
+        return result
     
-    # Cache the result
-    set_cache(cache_key, result)
-    return result
+    return await get_or_set_cache("trending_coins", load_trending)
 
 @api_router.get("/crypto/search/{query}")
 async def search_crypto(query: str):
@@ -1734,6 +2094,11 @@ class TradingOrderApproval(BaseModel):
     action: str  # "approve" or "reject"
     admin_note: Optional[str] = None
 
+class TradingOrderBulkApproval(BaseModel):
+    order_ids: List[str]
+    action: str  # "approve" or "reject"
+    admin_note: Optional[str] = None
+
 class UserHolding(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
@@ -2357,29 +2722,12 @@ async def create_trading_order(order_data: TradingOrderCreate, current_user: Use
             detail="برای معامله باید احراز هویت سطح ۲ را تکمیل کنید"
         )
     
-    # Get current price in Toman - use cached prices
-    # Static price map (same as in get_crypto_prices)
-    price_map = {
-        'bitcoin': 12959940780,
-        'ethereum': 445134743,
-        'tether': 115090,
-        'binancecoin': 123989909,
-        'ripple': 264664,
-        'cardano': 67454,
-        'solana': 21460832,
-        'dogecoin': 7500,
-        'polkadot': 314771,
-        'tron': 36655,
-        'usd-coin': 114641,
-        'chainlink': 1859854,
-        'litecoin': 10899023,
-        'avalanche-2': 2445777,
-        'stellar': 32731,
-    }
-    
-    current_price_tmn = price_map.get(order_data.coin_id)
-    if not current_price_tmn:
+    # Get current price in Toman from the in-memory price book; seed and stale quotes are not traded on
+    if price_book.get(order_data.coin_id) is None:
         raise HTTPException(status_code=404, detail="قیمت ارز یافت نشد")
+    current_price_tmn = price_book.get_fresh_price(order_data.coin_id, PRICE_MAX_AGE)
+    if not current_price_tmn:
+        raise HTTPException(status_code=503, detail="قیمت لحظه‌ای ارز در دسترس نیست")
     
     total_value_tmn = 0
     
@@ -2454,6 +2802,7 @@ async def create_trading_order(order_data: TradingOrderCreate, current_user: Use
     )
     
     await db.trading_orders.insert_one(trading_order.dict())
+    await platform_stats.record("trading_orders", None, trading_order.dict())
     
     response_data = trading_order.dict()
     response_data["user_email"] = current_user.email
@@ -2462,9 +2811,13 @@ async def create_trading_order(order_data: TradingOrderCreate, current_user: Use
     return TradingOrderResponse(**response_data)
 
 @api_router.get("/trading/orders/my", response_model=List[TradingOrderResponse])
-async def get_my_orders(current_user: User = Depends(get_current_user)):
+async def get_my_orders(response: Response, limit: Optional[int] = None, cursor: Optional[str] = None,
+                        current_user: User = Depends(get_current_user)):
     """Get user's trading orders"""
-    orders = await db.trading_orders.find({"user_id": current_user.id}).to_list(None)
+    orders, next_cursor = await paginate(
+        db.trading_orders, {"user_id": current_user.id}, ORDER_LIST_PROJECTION, limit, cursor
+    )
+    set_next_cursor(response, next_cursor)
     
     result = []
     for order in orders:
@@ -2480,17 +2833,12 @@ async def get_my_holdings(current_user: User = Depends(get_current_user)):
     """Get user's crypto holdings"""
     holdings = await db.user_holdings.find({"user_id": current_user.id}).to_list(None)
     
+    # Valuation only - a stale book price is better than none here
+    prices = await get_prices_tmn((holding["coin_id"] for holding in holdings), fresh=False)
+    
     result = []
     for holding in holdings:
-        # Get current price
-        coin_data = await price_service.get_coin_details(holding["coin_id"])
-        current_price_usd = 0
-        current_price_tmn = 0
-        
-        if coin_data["success"]:
-            current_price_usd = coin_data["data"]["market_data"]["current_price"]["usd"]
-            current_price_tmn = current_price_usd * 50000
-        
+        current_price_tmn = prices[holding["coin_id"]]
         total_value_tmn = holding["amount"] * current_price_tmn
         pnl_percent = ((current_price_tmn - holding["average_buy_price_tmn"]) / holding["average_buy_price_tmn"]) * 100 if holding["average_buy_price_tmn"] > 0 else 0
         
@@ -2511,26 +2859,48 @@ async def get_my_holdings(current_user: User = Depends(get_current_user)):
 # ==================== ADMIN TRADING ROUTES ====================
 
 @api_router.get("/admin/trading/orders", response_model=List[TradingOrderResponse])
-async def get_all_trading_orders(admin: User = Depends(get_current_admin)):
+async def get_all_trading_orders(response: Response, limit: Optional[int] = None, cursor: Optional[str] = None,
+                                 admin: User = Depends(get_current_admin)):
     """Get all trading orders for admin"""
-    orders = await db.trading_orders.find().to_list(None)
-    
-    result = []
-    for order in orders:
-        user = await db.users.find_one({"id": order["user_id"]})
-        response_data = order.copy()
-        if user:
-            response_data["user_email"] = user.get("email")
-            response_data["user_name"] = user.get("full_name")
-        result.append(TradingOrderResponse(**response_data))
+    orders, next_cursor = await paginate(db.trading_orders, {}, ORDER_LIST_PROJECTION, limit, cursor)
+    set_next_cursor(response, next_cursor)
+    await attach_user_info(orders)
     
-    return result
+    return [TradingOrderResponse(**order) for order in orders]
 
 # Alias for frontend compatibility
 @api_router.get("/admin/orders", response_model=List[TradingOrderResponse])
-async def get_all_orders_alias(admin: User = Depends(get_current_admin)):
+async def get_all_orders_alias(response: Response, limit: Optional[int] = None, cursor: Optional[str] = None,
+                               admin: User = Depends(get_current_admin)):
     """Get all trading orders for admin (alias route)"""
-    return await get_all_trading_orders(admin)
+    return await get_all_trading_orders(response, limit, cursor, admin)
+
+@api_router.get("/admin/export/{dataset}")
+async def export_dataset(dataset: str, format: str = "ndjson", admin: User = Depends(get_current_admin)):
+    """Stream a full dump of users, deposits or trading orders as NDJSON or CSV"""
+    datasets = {
+        "users": (db.users, USER_LIST_PROJECTION, UserResponse,
+                  lambda document: user_to_response(User(**document)).dict(), False),
+        "deposits": (db.deposit_requests, DEPOSIT_LIST_PROJECTION, DepositRequestResponse,
+                     lambda document: DepositRequestResponse(**document).dict(exclude={"receipt_image"}), True),
+        "trading-orders": (db.trading_orders, ORDER_LIST_PROJECTION, TradingOrderResponse,
+                           lambda document: TradingOrderResponse(**document).dict(), True)
+    }
+    
+    if dataset not in datasets:
+        raise HTTPException(status_code=404, detail="نوع خروجی یافت نشد")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="فرمت خروجی باید ndjson یا csv باشد")
+    
+    collection, projection, response_model, to_row, enrich = datasets[dataset]
+    fields = [field for field in response_model.model_fields if field != "receipt_image"]
+    filename = f"{dataset}-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}.{format}"
+    
+    return StreamingResponse(
+        stream_export(collection, projection, to_row, fields, format, enrich),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 @api_router.post("/admin/trading/orders/approve")
 async def approve_trading_order(approval: TradingOrderApproval, admin: User = Depends(get_current_admin)):
@@ -2543,126 +2913,26 @@ async def approve_trading_order(approval: TradingOrderApproval, admin: User = De
         raise HTTPException(status_code=400, detail="این سفارش قبلاً پردازش شده است")
     
     new_status = "approved" if approval.action == "approve" else "rejected"
-    
-    # Update order status
-    await db.trading_orders.update_one(
-        {"id": approval.order_id},
-        {"$set": {
-            "status": new_status,
-            "admin_note": approval.admin_note,
-            "updated_at": datetime.now(timezone.utc)
-        }}
-    )
+    target_price_tmn = None
     
     if approval.action == "approve":
-        user = await db.users.find_one({"id": order["user_id"]})
-        if not user:
+        if not await db.users.find_one({"id": order["user_id"]}, {"_id": 0, "id": 1}):
             raise HTTPException(status_code=404, detail="کاربر یافت نشد")
         
-        if order["order_type"] == "buy":
-            # Deduct TMN balance and add crypto holding
-            await db.users.update_one(
-                {"id": order["user_id"]},
-                {"$inc": {"wallet_balance_tmn": -order["amount_tmn"]}}
-            )
-            
-            # Add or update crypto holding
-            crypto_amount = order["amount_tmn"] / order["price_at_order"]
-            existing_holding = await db.user_holdings.find_one({
-                "user_id": order["user_id"],
-                "coin_symbol": order["coin_symbol"]
-            })
-            
-            if existing_holding:
-                # Update existing holding (weighted average price)
-                total_amount = existing_holding["amount"] + crypto_amount
-                new_avg_price = ((existing_holding["amount"] * existing_holding["average_buy_price_tmn"]) + 
-                               (crypto_amount * order["price_at_order"])) / total_amount
-                
-                await db.user_holdings.update_one(
-                    {"id": existing_holding["id"]},
-                    {"$set": {
-                        "amount": total_amount,
-                        "average_buy_price_tmn": new_avg_price,
-                        "updated_at": datetime.now(timezone.utc)
-                    }}
-                )
-            else:
-                # Create new holding
-                new_holding = UserHolding(
-                    user_id=order["user_id"],
-                    coin_symbol=order["coin_symbol"],
-                    coin_id=order["coin_id"],
-                    amount=crypto_amount,
-                    average_buy_price_tmn=order["price_at_order"]
-                )
-                await db.user_holdings.insert_one(new_holding.dict())
-                
-        elif order["order_type"] == "sell":
-            # Add TMN balance and deduct crypto holding
-            tmn_amount = order["amount_crypto"] * order["price_at_order"]
-            await db.users.update_one(
-                {"id": order["user_id"]},
-                {"$inc": {"wallet_balance_tmn": tmn_amount}}
-            )
-            
-            # Deduct from crypto holding
-            await db.user_holdings.update_one(
-                {"user_id": order["user_id"], "coin_symbol": order["coin_symbol"]},
-                {"$inc": {"amount": -order["amount_crypto"]}}
-            )
-            
-        elif order["order_type"] == "trade":
+        if order["order_type"] == "trade":
             # Get target coin current price
-            target_coin_data = await price_service.get_coin_details(order["target_coin_id"])
-            if target_coin_data["success"]:
-                target_price_usd = target_coin_data["data"]["market_data"]["current_price"]["usd"]
-                target_price_tmn = target_price_usd * 50000
-                
-                # Calculate how much target coin to give
-                source_value_tmn = order["amount_crypto"] * order["price_at_order"]
-                target_crypto_amount = source_value_tmn / target_price_tmn
-                
-                # Deduct source coin
-                await db.user_holdings.update_one(
-                    {"user_id": order["user_id"], "coin_symbol": order["coin_symbol"]},
-                    {"$inc": {"amount": -order["amount_crypto"]}}
-                )
-                
-                # Add target coin
-                existing_target_holding = await db.user_holdings.find_one({
-                    "user_id": order["user_id"],
-                    "coin_symbol": order["target_coin_symbol"]
-                })
-                
-                if existing_target_holding:
-                    total_amount = existing_target_holding["amount"] + target_crypto_amount
-                    new_avg_price = ((existing_target_holding["amount"] * existing_target_holding["average_buy_price_tmn"]) + 
-                                   (target_crypto_amount * target_price_tmn)) / total_amount
-                    
-                    await db.user_holdings.update_one(
-                        {"id": existing_target_holding["id"]},
-                        {"$set": {
-                            "amount": total_amount,
-                            "average_buy_price_tmn": new_avg_price,
-                            "updated_at": datetime.now(timezone.utc)
-                        }}
-                    )
-                else:
-                    new_holding = UserHolding(
-                        user_id=order["user_id"],
-                        coin_symbol=order["target_coin_symbol"],
-                        coin_id=order["target_coin_id"],
-                        amount=target_crypto_amount,
-                        average_buy_price_tmn=target_price_tmn
-                    )
-                    await db.user_holdings.insert_one(new_holding.dict())
-        
-        # Mark order as completed
-        await db.trading_orders.update_one(
-            {"id": approval.order_id},
-            {"$set": {"status": "completed"}}
-        )
+            target_price_tmn = (await get_prices_tmn([order["target_coin_id"]]))[order["target_coin_id"]]
+            if not target_price_tmn:
+                raise HTTPException(status_code=503, detail="قیمت ارز مقصد در دسترس نیست")
+    
+    # Claim, balance/holding updates and completion commit together
+    try:
+        settled = await settlement_engine.settle(approval.order_id, approval.action, approval.admin_note, target_price_tmn)
+    except PriceUnavailable:
+        raise HTTPException(status_code=503, detail="قیمت ارز مقصد در دسترس نیست")
+    if settled is None:
+        raise HTTPException(status_code=400, detail="این سفارش قبلاً پردازش شده است")
+    user_cache.invalidate(order["user_id"])
     
     return {"message": f"سفارش با موفقیت {new_status} شد"}
 
@@ -2672,26 +2942,59 @@ async def approve_order_alias(approval: TradingOrderApproval, admin: User = Depe
     """Approve or reject a trading order (alias route)"""
     return await approve_trading_order(approval, admin)
 
+@api_router.post("/admin/trading/orders/bulk-approve")
+async def bulk_approve_trading_orders(approval: TradingOrderBulkApproval, admin: User = Depends(get_current_admin)):
+    """Approve or reject many trading orders with batched settlement"""
+    if approval.action not in ("approve", "reject"):
+        raise HTTPException(status_code=400, detail="عملیات نامعتبر است")
+    if not approval.order_ids or len(approval.order_ids) > BULK_APPROVAL_MAX_ORDERS:
+        raise HTTPException(status_code=400, detail=f"تعداد سفارش‌ها باید بین 1 و {BULK_APPROVAL_MAX_ORDERS} باشد")
+    
+    target_prices = {}
+    if approval.action == "approve":
+        target_coin_ids = await db.trading_orders.distinct(
+            "target_coin_id",
+            {"id": {"$in": approval.order_ids}, "order_type": "trade", "status": "pending"}
+        )
+        if target_coin_ids:
+            target_prices = await get_prices_tmn(target_coin_ids)
+    
+    results = await settlement_engine.settle_many(
+        approval.order_ids, approval.action, approval.admin_note, target_prices, SETTLEMENT_BATCH_SIZE
+    )
+    for user_id in {result["user_id"] for result in results if result["outcome"] == "completed"}:
+        user_cache.invalidate(user_id)
+    
+    summary = {}
+    for result in results:
+        summary[result["outcome"]] = summary.get(result["outcome"], 0) + 1
+    
+    return {"success": True, "summary": summary, "results": results}
+
+# Alias for frontend compatibility
+@api_router.post("/admin/orders/bulk-approve")
+async def bulk_approve_orders_alias(approval: TradingOrderBulkApproval, admin: User = Depends(get_current_admin)):
+    """Approve or reject many trading orders (alias route)"""
+    return await bulk_approve_trading_orders(approval, admin)
+
 # ==================== AI ADMIN ROUTES ====================
 
 @api_router.get("/admin/stats/extended")
 async def get_admin_stats_extended(admin: User = Depends(get_current_admin)):
     """Get extended admin statistics"""
     try:
-        # Get basic counts
-        total_users = await db.users.count_documents({})
-        active_users = await db.users.count_documents({"is_active": True})
-        pending_kyc = await db.users.count_documents({"kyc_status": "pending"})
-        pending_orders = await db.trading_orders.count_documents({"status": "pending"})
-        
-        # Calculate today's trading volume
-        today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-        today_orders = await db.trading_orders.find({
-            "created_at": {"$gte": today.isoformat()}
-        }).to_list(None)
+        # Basic counts and today's trading volume from the materialized stats
+        stats, today = await asyncio.gather(
+            platform_stats.get_counters(),
+            platform_stats.get_bucket("day")
+        )
         
-        trading_volume_24h = sum(order.get("total_value_tmn", 0) for order in today_orders)
-        orders_count_24h = len(today_orders)
+        total_users = stats.get("users_total", 0)
+        active_users = stats.get("users_active", 0)
+        pending_kyc = stats.get("kyc_pending", 0)
+        pending_orders = stats.get("orders_pending", 0)
+        trading_volume_24h = today.get("volume_tmn", 0)
+        orders_count_24h = today.get("orders", 0)
         
         # Mock additional stats
         online_users = random.randint(50, 200)
@@ -2764,6 +3067,24 @@ async def get_market_insights(admin: User = Depends(get_current_admin)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/admin/system/cache-stats")
+async def get_cache_stats(admin: User = Depends(get_current_admin)):
+    """Get in-process cache hit/miss counters"""
+    return {
+        "user_cache": user_cache.get_stats(),
+        "response_cache": response_cache.get_stats(),
+        "generated_at": datetime.now(timezone.utc).isoformat()
+    }
+
+@api_router.post("/admin/system/stats/reconcile")
+async def reconcile_platform_stats(admin: User = Depends(get_current_admin)):
+    """Recompute dashboard counters from the source collections now"""
+    drift = await platform_stats.reconcile()
+    return {
+        "drift": drift,
+        "reconciled_at": datetime.now(timezone.utc).isoformat()
+    }
+
 @api_router.get("/admin/system/health")
 async def get_system_health(admin: User = Depends(get_current_admin)):
     """Get AI-powered system health analysis"""
@@ -2777,32 +3098,30 @@ async def get_system_health(admin: User = Depends(get_current_admin)):
 async def get_admin_crypto_prices(admin: User = Depends(get_current_admin)):
     """Get crypto prices for admin management"""
     try:
-        # Get current prices
-        price_result = await price_service.get_prices()
-        
-        if not price_result["success"]:
-            raise HTTPException(status_code=500, detail="خطا در بارگذاری قیمت‌ها")
+        # Current prices from the price book; USD derived from the Tether rate
+        prices = price_book.snapshot()
+        usdt_tmn = price_book.get_price("tether") or 0
         
         # Format for admin interface
         cryptos = []
-        for coin_id, data in price_result["data"].items():
+        for coin_id, data in prices.items():
             crypto_info = {
                 "id": coin_id,
                 "symbol": data.get("symbol", coin_id.upper()),
                 "name": data.get("name", coin_id.title()),
-                "price_usd": data.get("usd", 0),
-                "price_tmn": data.get("usd", 0) * 50000,  # Convert to TMN
-                "change_24h": data.get("usd_24h_change", 0),
-                "volume_24h": data.get("usd_24h_vol", 0),
+                "price_usd": data["price_tmn"] / usdt_tmn if usdt_tmn else 0,
+                "price_tmn": data["price_tmn"],
+                "change_24h": data.get("change_24h", 0),
+                "volume_24h": 0,
                 "active": True,
-                "last_updated": datetime.now(timezone.utc).isoformat()
+                "last_updated": data.get("last_updated")
             }
             cryptos.append(crypto_info)
         
         return {
             "cryptos": cryptos,
             "price_history": {},  # Placeholder for price history
-            "last_sync": datetime.now(timezone.utc).isoformat()
+            "last_sync": price_book.updated_at.isoformat() if price_book.updated_at else None
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -2873,8 +3192,8 @@ async def get_market_status(admin: User = Depends(get_current_admin)):
         return {
             "status": "online",
             "last_update": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
-            "source": "CoinGecko API",
-            "active_pairs": 50,
+            "source": "+".join(price_aggregator.fresh_sources()) or "static",
+            "active_pairs": len(price_book.snapshot()),
             "system_load": round(random.uniform(20, 80), 1)
         }
     except Exception as e:
@@ -2903,11 +3222,18 @@ async def analyze_user_behavior(user_id: str, admin: User = Depends(get_current_
 async def get_predictive_analytics(admin: User = Depends(get_current_admin)):
     """Get AI-powered predictive analytics"""
     try:
-        # Get user data for churn analysis
-        users = await db.users.find().to_list(None)
-        
-        # Get historical trading data
-        historical_orders = await db.trading_orders.find().to_list(None)
+        # Get user data for churn analysis - only users with a login can churn
+        users = await db.users.find(
+            {"last_login": {"$ne": None}},
+            {"_id": 0, "id": 1, "email": 1, "full_name": 1, "last_login": 1}
+        ).limit(ANALYTICS_MAX_DOCUMENTS).to_list(ANALYTICS_MAX_DOCUMENTS)
+        
+        # Get historical trading data (most recent window, oldest first)
+        historical_orders = await db.trading_orders.find(
+            {},
+            {"_id": 0, "id": 1, "created_at": 1, "total_value_tmn": 1, "volume": 1, "amount": 1}
+        ).sort("created_at", -1).limit(ANALYTICS_MAX_DOCUMENTS).to_list(ANALYTICS_MAX_DOCUMENTS)
+        historical_orders.reverse()
         
         # Generate predictions
         churn_analysis = await predictive_analytics.predict_user_churn(users)
@@ -3120,18 +3446,20 @@ async def get_trading_stats(timeframe: str = "24h", admin: User = Depends(get_cu
         
         since_time = datetime.now(timezone.utc) - time_delta
         
-        # Get trading orders in timeframe
-        orders = await db.trading_orders.find({
-            "created_at": {"$gte": since_time.isoformat()}
-        }).to_list(None)
+        # Hourly buckets covering the timeframe (hour granularity)
+        buckets, stats = await asyncio.gather(
+            platform_stats.get_buckets("hour", since_time),
+            platform_stats.get_counters()
+        )
         
         # Calculate stats
-        total_volume = sum(order.get("total_value_tmn", 0) for order in orders)
-        total_trades = len(orders)
-        completed_trades = len([o for o in orders if o.get("status") == "completed"])
+        total_volume = sum(bucket.get("volume_tmn", 0) for bucket in buckets)
+        total_trades = sum(bucket.get("orders", 0) for bucket in buckets)
+        completed_trades = sum(bucket.get("completed_orders", 0) for bucket in buckets)
+        total_users = stats.get("users_total", 0)
         
         # Get unique traders
-        unique_traders = len(set(order.get("user_id") for order in orders))
+        unique_traders = len(set().union(*(bucket.get("traders", []) for bucket in buckets)))
         
         # Calculate average trade size
         avg_trade_size = total_volume / max(total_trades, 1)
@@ -3139,7 +3467,7 @@ async def get_trading_stats(timeframe: str = "24h", admin: User = Depends(get_cu
         # Mock additional stats
         fee_revenue = total_volume * 0.001  # 0.1% fee
         avg_fee_rate = 0.1
-        highest_fee = max([order.get("total_value_tmn", 0) * 0.001 for order in orders] or [0])
+        highest_fee = max([bucket.get("max_value_tmn") or 0 for bucket in buckets] or [0]) * 0.001
         avg_processing_time = random.uniform(2, 15)
         volume_change = random.uniform(-10, 25)
         
@@ -3148,7 +3476,7 @@ async def get_trading_stats(timeframe: str = "24h", admin: User = Depends(get_cu
             "total_trades": total_trades,
             "completed_trades": completed_trades,
             "active_traders": unique_traders,
-            "total_users": await db.users.count_documents({}),
+            "total_users": total_users,
             "avg_trade_size": avg_trade_size,
             "fee_revenue": fee_revenue,
             "avg_fee_rate": avg_fee_rate,
@@ -3172,16 +3500,7 @@ async def get_live_orders(admin: User = Depends(get_current_admin)):
         }).sort([("created_at", -1)]).limit(50).to_list(None)
         
         # Enrich with user data
-        enriched_orders = []
-        for order in orders:
-            user = await db.users.find_one({"id": order.get("user_id")})
-            order_data = order.copy()
-            if user:
-                order_data["user_email"] = user.get("email")
-                order_data["user_name"] = user.get("full_name") or f"{user.get('first_name', '')} {user.get('last_name', '')}"
-            enriched_orders.append(order_data)
-        
-        return enriched_orders
+        return await attach_user_info(orders, name_fallback=True)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -3288,7 +3607,8 @@ async def handle_order_action(action_data: dict, admin: User = Depends(get_curre
             "cancel": "cancelled"
         }.get(action, "pending")
         
-        await db.trading_orders.update_one(
+        await platform_stats.tracked_update(
+            "trading_orders",
             {"id": order_id},
             {"$set": {
                 "status": new_status,
@@ -3558,6 +3878,10 @@ async def create_limit_order(order_data: dict, current_user: User = Depends(get_
     try:
         if current_user.kyc_level < 2:
             raise HTTPException(status_code=403, detail="برای معاملات پیشرفته به احراز هویت کامل نیاز دارید")
+        if order_data.get('order_type') not in ('limit_buy', 'limit_sell'):
+            raise HTTPException(status_code=400, detail="نوع سفارش محدود نامعتبر است")
+        if float(order_data['amount_crypto']) <= 0 or float(order_data['target_price_tmn']) <= 0:
+            raise HTTPException(status_code=400, detail="مقدار و قیمت سفارش باید بیشتر از صفر باشد")
         
         # Create limit order
         limit_order = {
@@ -3572,23 +3896,75 @@ async def create_limit_order(order_data: dict, current_user: User = Depends(get_
             'status': 'active',
             'filled_amount': 0.0,
             'remaining_amount': float(order_data['amount_crypto']),
+            'reserved': True,
             'created_at': datetime.now(timezone.utc),
             'updated_at': datetime.now(timezone.utc)
         }
         
-        # Store in database (mock)
-        result = await db.limit_orders.insert_one(limit_order)
+        # Funds are reserved first, so every fill settles against money or coins that exist
+        reservation = reservation_leg(limit_order)
+        if not await settlement_engine.reserve(reservation):
+            if limit_order['order_type'] == 'limit_buy':
+                raise HTTPException(status_code=400, detail="موجودی کافی ندارید")
+            raise HTTPException(status_code=400, detail="موجودی ارز کافی ندارید")
+        user_cache.invalidate(current_user.id)
+        
+        # Stored, then matched; fills and their settlement are persisted by the engine's journal
+        try:
+            await db.limit_orders.insert_one(limit_order.copy())
+        except Exception:
+            await settlement_engine.apply(f"release-{limit_order['id']}", release_legs(BookOrder.from_document(limit_order)))
+            user_cache.invalidate(current_user.id)
+            raise
+        order = matching_engine.submit(limit_order)
         
         return {
             'message': 'سفارش محدود با موفقیت ایجاد شد',
             'order_id': limit_order['id'],
-            'status': 'active',
+            'status': order.status if order else 'active',
+            'filled_amount': order.filled if order else 0.0,
+            'remaining_amount': order.remaining if order else limit_order['remaining_amount'],
             'estimated_execution': 'زمانی که قیمت به سطح تعیین شده برسد'
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.delete("/trading/limit-order/{order_id}")
+async def cancel_limit_order(order_id: str, current_user: User = Depends(get_current_user)):
+    """Cancel an active limit order"""
+    order = await db.limit_orders.find_one({"id": order_id, "user_id": current_user.id}, {"_id": 0, "status": 1})
+    if not order:
+        raise HTTPException(status_code=404, detail="سفارش یافت نشد")
+    if order["status"] != "active":
+        raise HTTPException(status_code=400, detail="این سفارش قابل لغو نیست")
+    
+    if matching_engine.cancel(order_id) is None:
+        # Resting in another worker's book (or not loaded yet) - its owner applies the request
+        await db.limit_orders.update_one({"id": order_id, "status": "active"}, {"$set": {"cancel_requested": True}})
+    
+    return {"message": "درخواست لغو سفارش ثبت شد", "order_id": order_id}
+
+@api_router.get("/trading/order-book/{coin_id}")
+async def get_order_book(coin_id: str, levels: int = 10, current_user: User = Depends(get_current_user)):
+    """Aggregated bid/ask levels of a coin's limit order book"""
+    depth = matching_engine.depth(coin_id, min(max(levels, 1), 50))
+    if depth is None and not (matching_engine.is_owner and matching_engine.get_stats()["loaded"]):
+        # Books live in the lease holder - aggregate the stored active orders instead
+        depth = {"bids": [], "asks": []}
+        rows = await db.limit_orders.aggregate([
+            {"$match": {"coin_id": coin_id, "status": "active"}},
+            {"$group": {"_id": {"type": "$order_type", "price": "$target_price_tmn"}, "amount": {"$sum": "$remaining_amount"}}}
+        ]).to_list(None)
+        for row in rows:
+            depth["bids" if row["_id"]["type"] == "limit_buy" else "asks"].append([row["_id"]["price"], row["amount"]])
+        depth["bids"] = sorted(depth["bids"], reverse=True)[:levels]
+        depth["asks"] = sorted(depth["asks"])[:levels]
+    
+    return {"success": True, "coin_id": coin_id, "data": depth or {"bids": [], "asks": []}}
+
 @api_router.post("/trading/stop-loss")
 async def create_stop_loss_order(order_data: dict, current_user: User = Depends(get_current_user)):
     """Create a stop-loss order"""
@@ -3604,13 +3980,16 @@ async def create_stop_loss_order(order_data: dict, current_user: User = Depends(
             'coin_id': order_data['coin_id'],
             'amount_crypto': float(order_data['amount_crypto']),
             'stop_price_tmn': float(order_data['stop_price_tmn']),
-            'limit_price_tmn': order_data.get('limit_price_tmn'),
+            'limit_price_tmn': float(order_data['limit_price_tmn']) if order_data.get('limit_price_tmn') else None,
             'status': 'active',
             'created_at': datetime.now(timezone.utc)
         }
+        if stop_loss_order['amount_crypto'] <= 0 or stop_loss_order['stop_price_tmn'] <= 0:
+            raise HTTPException(status_code=400, detail="مقدار و قیمت حد ضرر باید بیشتر از صفر باشد")
         
-        # Store in database (mock)
-        result = await db.stop_loss_orders.insert_one(stop_loss_order)
+        # Stored first, then armed; other workers' stops are armed on the engine's next sync
+        await db.stop_loss_orders.insert_one(stop_loss_order.copy())
+        stop_loss_engine.add(stop_loss_order)
         
         return {
             'message': 'سفارش حد ضرر با موفقیت ایجاد شد',
@@ -3619,13 +3998,33 @@ async def create_stop_loss_order(order_data: dict, current_user: User = Depends(
             'protection_level': f"محافظت در قیمت {order_data['stop_price_tmn']} تومان"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.delete("/trading/stop-loss/{order_id}")
+async def cancel_stop_loss_order(order_id: str, current_user: User = Depends(get_current_user)):
+    """Cancel an active stop-loss order"""
+    result = await db.stop_loss_orders.update_one(
+        {"id": order_id, "user_id": current_user.id, "status": "active"},
+        {"$set": {"status": "cancelled", "updated_at": datetime.now(timezone.utc)}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="سفارش حد ضرر فعال یافت نشد")
+    
+    stop_loss_engine.remove(order_id)
+    return {"message": "سفارش حد ضرر لغو شد", "order_id": order_id}
+
 @api_router.post("/trading/dca-strategy")
 async def create_dca_strategy(strategy_data: dict, current_user: User = Depends(get_current_user)):
     """Create Dollar Cost Averaging strategy"""
     try:
+        if strategy_data.get('frequency') not in DCA_FREQUENCIES:
+            raise HTTPException(status_code=400, detail="دوره خرید باید روزانه، هفتگی یا ماهانه باشد")
+        if float(strategy_data['amount_tmn_per_purchase']) <= 0 or float(strategy_data['total_budget_tmn']) <= 0:
+            raise HTTPException(status_code=400, detail="مبلغ خرید و بودجه باید بیشتر از صفر باشد")
+        
         # Create DCA strategy
         dca_strategy = {
             'id': str(uuid.uuid4()),
@@ -3636,23 +4035,26 @@ async def create_dca_strategy(strategy_data: dict, current_user: User = Depends(
             'frequency': strategy_data['frequency'],  # daily, weekly, monthly
             'total_budget_tmn': float(strategy_data['total_budget_tmn']),
             'spent_amount_tmn': 0.0,
+            'purchase_count': 0,
             'next_purchase_date': datetime.now(timezone.utc) + timedelta(days=1),
             'status': 'active',
             'auto_rebalance': strategy_data.get('auto_rebalance', False),
             'created_at': datetime.now(timezone.utc)
         }
         
-        # Store in database (mock)
-        result = await db.dca_strategies.insert_one(dca_strategy)
+        # Picked up by the DCA executor once next_purchase_date enters its lookahead window
+        await db.dca_strategies.insert_one(dca_strategy.copy())
         
         return {
             'message': 'استراتژی DCA با موفقیت ایجاد شد',
             'strategy_id': dca_strategy['id'],
             'status': 'active',
             'next_purchase': dca_strategy['next_purchase_date'].strftime('%Y-%m-%d %H:%M'),
-            'estimated_purchases': int(strategy_data['total_budget_tmn'] / strategy_data['amount_tmn_per_purchase'])
+            'estimated_purchases': int(dca_strategy['total_budget_tmn'] / dca_strategy['amount_tmn_per_purchase'])
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -4046,6 +4448,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 # Configure logging
@@ -4058,11 +4461,39 @@ logger = logging.getLogger(__name__)
 @app.on_event("startup")
 async def startup_event():
     """Start background tasks on startup"""
-    # Price scheduler disabled - causes delays
-    logger.info("⚠️  Price scheduler disabled - using static prices")
-    pass
+    await ensure_indexes(db)
+    await http_clients.start()
+    await ensure_price_history(db, PRICE_TICK_RETENTION_DAYS)
+    try:
+        await candle_builder.backfill()
+    except Exception as e:
+        logger.error(f"Error restoring open candles: {str(e)}")
+    platform_stats.start(STATS_RECONCILE_INTERVAL)
+    settlement_engine.start(SETTLEMENT_RECOVERY_INTERVAL, SETTLEMENT_RECOVERY_GRACE)
+    
+    # Price feeds run in the background; requests only read the price book
+    if PRICE_FEED_ENABLED:
+        price_aggregator.start()
+    else:
+        logger.info("⚠️  Price feed disabled - using static prices")
+    
+    if MATCHING_ENGINE_ENABLED:
+        matching_engine.start()
+        stop_loss_engine.start()
+    
+    if DCA_EXECUTOR_ENABLED:
+        dca_executor.start()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
     """Cleanup on shutdown"""
+    await platform_stats.stop()
+    await settlement_engine.stop()
+    await price_aggregator.stop()
+    await dca_executor.stop()
+    # Before the matching engine, whose final flush persists the stop-limits the last stops placed
+    await stop_loss_engine.stop()
+    await matching_engine.stop()
+    await rate_limiter.close()
+    await http_clients.close()
     client.close()
\ No newline at end of file
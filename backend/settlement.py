@@ -0,0 +1,565 @@
+"""
+Trade Settlement Engine
+Applies an approved trading order's balance and holding changes in one
+MongoDB transaction when the deployment supports it, with every change
+expressed as a single atomic update so concurrent approvals never race
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+PLANS_COLLECTION = 'settlement_plans'
+
+# Without transactions every user and holding document remembers the ids of
+# the last legs applied to it, so replaying an interrupted plan skips them
+SETTLED_LEGS_FIELD = 'settled_legs'
+SETTLED_LEGS_KEPT = 200
+
+class PriceUnavailable(Exception):
+    """A trade order was approved without a price for its target coin"""
+
+# ('balance', user_id, delta_tmn) | ('credit', user_id, coin_symbol, quantity, price_tmn, coin_id)
+# | ('debit', user_id, coin_symbol, quantity)
+Leg = Tuple
+
+def holding_credit(quantity: float, price_tmn: float, coin_id: str, now: datetime) -> List[Dict]:
+    """Pipeline update adding quantity at price_tmn to a holding, creating it if missing
+
+    The weighted average is computed by the server from the stored amount,
+    so there is no read-modify-write window between concurrent credits.
+    """
+    amount = {'$ifNull': ['$amount', 0]}
+    total = {'$add': [amount, quantity]}
+    return [{'$set': {
+        'id': {'$ifNull': ['$id', str(uuid.uuid4())]},
+        'coin_id': {'$ifNull': ['$coin_id', {'$literal': coin_id}]},
+        'average_buy_price_tmn': {'$cond': [
+            {'$gt': [total, 0]},
+            {'$divide': [
+                {'$add': [{'$multiply': [amount, {'$ifNull': ['$average_buy_price_tmn', 0]}]}, quantity * price_tmn]},
+                total
+            ]},
+            price_tmn
+        ]},
+        'amount': total,
+        'created_at': {'$ifNull': ['$created_at', now]},
+        'updated_at': now,
+    }}]
+
+def settlement_legs(order: Dict, target_price_tmn: Optional[float]) -> List[Leg]:
+    """Balance and holding changes that settle an approved order"""
+    user_id = order['user_id']
+
+    if order['order_type'] == 'buy':
+        return [
+            ('balance', user_id, -order['amount_tmn']),
+            ('credit', user_id, order['coin_symbol'], order['amount_tmn'] / order['price_at_order'],
+             order['price_at_order'], order['coin_id']),
+        ]
+
+    if order['order_type'] == 'sell':
+        return [
+            ('balance', user_id, order['amount_crypto'] * order['price_at_order']),
+            ('debit', user_id, order['coin_symbol'], order['amount_crypto']),
+        ]
+
+    if order['order_type'] == 'trade' and target_price_tmn:
+        return [
+            ('debit', user_id, order['coin_symbol'], order['amount_crypto']),
+            ('credit', user_id, order['target_coin_symbol'],
+             order['amount_crypto'] * order['price_at_order'] / target_price_tmn, target_price_tmn, order['target_coin_id']),
+        ]
+
+    return []
+
+def merge_legs(legs: List[Leg]) -> List[Leg]:
+    """Net balance changes per user and fold consecutive credits or debits of a holding
+
+    Two credits combine into one at their cost-weighted price, which yields
+    the same weighted average as applying them one after the other. Each
+    holding's credits and debits keep their relative order.
+    """
+    balances: Dict[str, float] = {}
+    holdings: Dict[Tuple[str, str], List[List]] = {}
+
+    for leg in legs:
+        if leg[0] == 'balance':
+            balances[leg[1]] = balances.get(leg[1], 0) + leg[2]
+            continue
+
+        sequence = holdings.setdefault((leg[1], leg[2]), [])
+        previous = sequence[-1] if sequence else None
+        if previous is not None and previous[0] == leg[0] == 'debit':
+            previous[3] += leg[3]
+        elif previous is not None and previous[0] == leg[0] == 'credit':
+            quantity = previous[3] + leg[3]
+            previous[4] = (previous[3] * previous[4] + leg[3] * leg[4]) / quantity
+            previous[3] = quantity
+        else:
+            sequence.append(list(leg))
+
+    merged = [('balance', user_id, delta) for user_id, delta in balances.items() if delta]
+    for sequence in holdings.values():
+        merged.extend(tuple(leg) for leg in sequence)
+    return merged
+
+def leg_update(leg: Leg, now: datetime, leg_id: Optional[str] = None) -> Tuple[str, Dict, object, bool]:
+    """(collection, filter, update, upsert) applying one leg
+
+    With a leg_id the update only matches a document that has not recorded
+    that id yet and records it in the same write, so applying it twice is a
+    no-op.
+    """
+    if leg[0] == 'balance':
+        collection, query, update, upsert = 'users', {'id': leg[1]}, {'$inc': {'wallet_balance_tmn': leg[2]}}, False
+    elif leg[0] == 'debit':
+        collection, query, update, upsert = 'user_holdings', {'user_id': leg[1], 'coin_symbol': leg[2]}, {'$inc': {'amount': -leg[3]}}, False
+    else:
+        collection, query, update, upsert = 'user_holdings', {'user_id': leg[1], 'coin_symbol': leg[2]}, holding_credit(leg[3], leg[4], leg[5], now), True
+
+    if leg_id is None:
+        return collection, query, update, upsert
+
+    query = {**query, SETTLED_LEGS_FIELD: {'$ne': leg_id}}
+    if isinstance(update, list):
+        settled = {'$concatArrays': [{'$ifNull': [f'${SETTLED_LEGS_FIELD}', []]}, {'$literal': [leg_id]}]}
+        update = update + [{'$set': {SETTLED_LEGS_FIELD: {'$slice': [settled, -SETTLED_LEGS_KEPT]}}}]
+    else:
+        update = {**update, '$push': {SETTLED_LEGS_FIELD: {'$each': [leg_id], '$slice': -SETTLED_LEGS_KEPT}}}
+    return collection, query, update, upsert
+
+class SettlementEngine:
+    """Idempotent order settlement keyed on the order id
+
+    The pending -> approved/rejected transition is the claim: only the call
+    that wins it applies the legs, so retried or concurrent approvals of the
+    same order settle it once. On replica sets the claim, legs and the final
+    'completed' status commit together. On a standalone server the legs are
+    first stored as a plan in settlement_plans and applied with leg ids;
+    recover() replays plans an interrupted settlement left behind and puts
+    orders claimed before their plan was stored back to 'pending'.
+    """
+
+    def __init__(self, db, stats=None, transactions: Optional[bool] = None, lease=None):
+        self.db = db
+        self.stats = stats
+        self.lease = lease
+        self._transactions = transactions  # None: detect on first use
+        self._task: Optional[asyncio.Task] = None
+        self.settled = 0
+        self.rejected = 0
+        self.duplicates = 0
+        self.recovered = 0
+
+    async def supports_transactions(self) -> bool:
+        if self._transactions is None:
+            try:
+                hello = await self.db.client.admin.command('hello')
+                self._transactions = 'setName' in hello or hello.get('msg') == 'isdbgrid'
+            except PyMongoError as e:
+                logger.warning(f"⚠️  Could not detect transaction support: {str(e)}")
+                self._transactions = False
+            logger.info(f"✅ Settlement {'uses transactions' if self._transactions else 'uses atomic per-document updates'}")
+        return self._transactions
+
+    async def _update(self, collection: str, query: Dict, update, upsert: bool, session=None):
+        try:
+            await self.db[collection].update_one(query, update, upsert=upsert, session=session)
+        except DuplicateKeyError:
+            if session is not None:
+                raise
+            # Two upserts raced to create the same holding - the loser now updates it
+            await self.db[collection].update_one(query, update, session=session)
+
+    async def _bulk_write(self, collection: str, operations: List[Tuple[Dict, object, bool]], session=None):
+        """Ordered bulk_write of (filter, update, upsert) operations"""
+        while operations:
+            try:
+                await self.db[collection].bulk_write(
+                    [UpdateOne(query, update, upsert=upsert) for query, update, upsert in operations],
+                    ordered=True, session=session
+                )
+                return
+            except BulkWriteError as e:
+                errors = e.details.get('writeErrors', [])
+                if session is not None or not errors or errors[0].get('code') != 11000:
+                    raise
+                # The holding exists after all (created concurrently, or it already
+                # recorded this leg) - retry the failed upsert as a plain update
+                failed = errors[0]['index']
+                query, update, _ = operations[failed]
+                operations = [(query, update, False)] + operations[failed + 1:]
+
+    async def _store_plan(self, plan_id: str, legs: List[Leg], marks: List[List], now: datetime,
+                          inserts: Optional[List[List]] = None) -> Dict:
+        """Store a settlement before any of its writes is applied"""
+        plan = {'_id': plan_id, 'legs': [list(leg) for leg in legs], 'marks': marks, 'inserts': inserts or [],
+                'status': 'pending', 'created_at': now}
+        try:
+            await self.db[PLANS_COLLECTION].insert_one(plan)
+        except DuplicateKeyError:
+            plan = await self.db[PLANS_COLLECTION].find_one({'_id': plan_id})
+        return plan
+
+    async def _insert(self, collection: str, documents: List[Dict], session=None):
+        try:
+            await self.db[collection].insert_many([document.copy() for document in documents], ordered=False, session=session)
+        except BulkWriteError as e:
+            if session is not None or any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+                raise
+            # Inserted by an earlier, interrupted replay
+
+    async def _mark(self, marks: List[List], session=None):
+        operations: Dict[str, List] = {}
+        for collection, document_id, fields in marks:
+            operations.setdefault(collection, []).append(UpdateOne({'id': document_id}, {'$set': fields}))
+        for collection, collection_operations in operations.items():
+            await self.db[collection].bulk_write(collection_operations, ordered=False, session=session)
+
+    async def _replay(self, plan: Dict):
+        """Apply a stored plan; safe to repeat
+
+        Once every leg is in, the plan's inserts ([collection, documents])
+        are written and its marks ([collection, id, fields]) are set, such as
+        the status of the orders it settles.
+        """
+        if plan['status'] == 'applied':
+            return
+        now = datetime.now(timezone.utc)
+        operations: Dict[str, List] = {'users': [], 'user_holdings': []}
+        for index, leg in enumerate(plan['legs']):
+            collection, query, update, upsert = leg_update(tuple(leg), now, f"{plan['_id']}:{index}")
+            operations[collection].append((query, update, upsert))
+        for collection, collection_operations in operations.items():
+            if collection_operations:
+                await self._bulk_write(collection, collection_operations)
+
+        for collection, documents in plan.get('inserts') or []:
+            await self._insert(collection, documents)
+        await self._mark(plan['marks'])
+        await self.db[PLANS_COLLECTION].update_one(
+            {'_id': plan['_id']}, {'$set': {'status': 'applied', 'applied_at': now}}
+        )
+
+    async def _apply_plan(self, plan_id: str, legs: List[Leg], marks: List[List], inserts: List[List], session) -> bool:
+        """Transactional counterpart of _store_plan + _replay"""
+        if await self.db[PLANS_COLLECTION].count_documents({'_id': plan_id}, limit=1, session=session):
+            return False
+        now = datetime.now(timezone.utc)
+        await self.db[PLANS_COLLECTION].insert_one(
+            {'_id': plan_id, 'status': 'applied', 'created_at': now, 'applied_at': now}, session=session
+        )
+        operations: Dict[str, List] = {'users': [], 'user_holdings': []}
+        for leg in legs:
+            collection, query, update, upsert = leg_update(leg, now)
+            operations[collection].append((query, update, upsert))
+        for collection, collection_operations in operations.items():
+            if collection_operations:
+                await self._bulk_write(collection, collection_operations, session)
+        for collection, documents in inserts:
+            await self._insert(collection, documents, session)
+        await self._mark(marks, session)
+        return True
+
+    async def apply(self, plan_id: str, legs: List[Leg], marks: Optional[List[List]] = None,
+                    inserts: Optional[List[List]] = None):
+        """Apply balance/holding legs together with marks and inserts, once per plan_id
+
+        Calling it again with the same plan_id (for example after an error)
+        never applies a leg twice.
+        """
+        marks, inserts = marks or [], inserts or []
+        if await self.supports_transactions():
+            async with await self.db.client.start_session() as session:
+                await session.with_transaction(
+                    lambda session: self._apply_plan(plan_id, legs, marks, inserts, session)
+                )
+        else:
+            await self._replay(await self._store_plan(plan_id, legs, marks, datetime.now(timezone.utc), inserts))
+
+    async def reserve(self, leg: Leg, leg_id: Optional[str] = None) -> bool:
+        """Apply a balance or holding debit only if it does not overdraw
+
+        With a leg_id a repeated call reports the earlier reservation instead
+        of taking it again.
+        """
+        collection, query, update, _ = leg_update(leg, datetime.now(timezone.utc), leg_id)
+        if leg[0] == 'balance':
+            guard = {'wallet_balance_tmn': {'$gte': -leg[2]}}
+        else:
+            guard = {'amount': {'$gte': leg[3]}}
+        result = await self.db[collection].update_one({**query, **guard}, update)
+        if result.modified_count == 1:
+            return True
+        if leg_id is None:
+            return False
+        query[SETTLED_LEGS_FIELD] = leg_id
+        return await self.db[collection].count_documents(query, limit=1) == 1
+
+    async def release(self, leg: Leg, leg_id: str) -> bool:
+        """Give back a reservation taken with reserve(leg, leg_id)
+
+        Only a document still holding leg_id is credited, and the id is
+        dropped in the same write, so releasing twice is a no-op and the leg
+        can be reserved again afterwards.
+        """
+        collection, query, update, _ = leg_update(leg, datetime.now(timezone.utc))
+        field, delta = next(iter(update['$inc'].items()))
+        result = await self.db[collection].update_one(
+            {**query, SETTLED_LEGS_FIELD: leg_id},
+            {'$inc': {field: -delta}, '$pull': {SETTLED_LEGS_FIELD: leg_id}}
+        )
+        return result.modified_count == 1
+
+    async def _apply(self, order_id: str, action: str, admin_note: Optional[str],
+                     target_price_tmn: Optional[float], session=None) -> Optional[Tuple[Dict, Dict]]:
+        now = datetime.now(timezone.utc)
+        status = 'approved' if action == 'approve' else 'rejected'
+        query = {'id': order_id, 'status': 'pending'}
+        if action == 'approve' and not target_price_tmn:
+            # A trade cannot settle without its target coin's price
+            query['order_type'] = {'$ne': 'trade'}
+
+        # The claim - fails for every caller but the first
+        order = await self.db.trading_orders.find_one_and_update(
+            query,
+            {'$set': {'status': status, 'admin_note': admin_note, 'updated_at': now}},
+            projection={'_id': 0},
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if order is None:
+            if 'order_type' in query and await self.db.trading_orders.count_documents(
+                {'id': order_id, 'status': 'pending', 'order_type': 'trade'}, limit=1, session=session
+            ):
+                raise PriceUnavailable(order_id)
+            return None
+
+        if action == 'approve':
+            legs = settlement_legs(order, target_price_tmn)
+            status = 'completed'
+            if session is None:
+                plan = await self._store_plan(order_id, legs, [['trading_orders', order_id, {'status': status}]], now)
+                await self._replay(plan)
+            else:
+                for leg in legs:
+                    await self._update(*leg_update(leg, now), session)
+                await self.db.trading_orders.update_one({'id': order_id}, {'$set': {'status': status}}, session=session)
+
+        return order, {**order, 'status': status, 'admin_note': admin_note, 'updated_at': now}
+
+    async def settle(self, order_id: str, action: str, admin_note: Optional[str] = None,
+                     target_price_tmn: Optional[float] = None) -> Optional[Dict]:
+        """Approve (and settle) or reject a pending order
+
+        Returns the order as settled, or None when it was no longer pending.
+        Raises PriceUnavailable when a trade is approved without
+        target_price_tmn.
+        """
+        if await self.supports_transactions():
+            async with await self.db.client.start_session() as session:
+                result = await session.with_transaction(
+                    lambda session: self._apply(order_id, action, admin_note, target_price_tmn, session)
+                )
+        else:
+            result = await self._apply(order_id, action, admin_note, target_price_tmn)
+
+        if result is None:
+            self.duplicates += 1
+            return None
+
+        before, after = result
+        if self.stats is not None:
+            # Counters are recorded once the settlement has committed
+            await self.stats.record('trading_orders', before, after)
+        if action == 'approve':
+            self.settled += 1
+        else:
+            self.rejected += 1
+        return after
+
+    async def _apply_batch(self, order_ids: List[str], action: str, admin_note: Optional[str],
+                           target_prices: Dict[str, float], session=None) -> Tuple[Dict[str, Dict], List[Tuple[Dict, Dict]]]:
+        now = datetime.now(timezone.utc)
+        status = 'approved' if action == 'approve' else 'rejected'
+        outcomes = {order_id: {'order_id': order_id, 'outcome': 'not_found', 'user_id': None} for order_id in order_ids}
+
+        orders = await self.db.trading_orders.find({'id': {'$in': order_ids}}, {'_id': 0}, session=session).to_list(None)
+        users = set()
+        if action == 'approve':
+            # Legs of an order whose user is gone would create orphan holdings
+            users = set(await self.db.users.distinct(
+                'id', {'id': {'$in': list({order['user_id'] for order in orders})}}, session=session
+            ))
+
+        eligible = []
+        for order in orders:
+            outcome = outcomes[order['id']]
+            outcome['user_id'] = order['user_id']
+            if order['status'] != 'pending':
+                outcome['outcome'] = 'already_processed'
+            elif action == 'approve' and order['user_id'] not in users:
+                outcome['outcome'] = 'user_not_found'
+            elif action == 'approve' and order['order_type'] == 'trade' and not target_prices.get(order.get('target_coin_id')):
+                outcome['outcome'] = 'price_unavailable'
+            else:
+                eligible.append(order['id'])
+        if not eligible:
+            return outcomes, []
+
+        # Claim every eligible order under one batch token; orders claimed
+        # elsewhere in the meantime are simply not matched
+        batch = uuid.uuid4().hex
+        await self.db.trading_orders.update_many(
+            {'id': {'$in': eligible}, 'status': 'pending'},
+            {'$set': {'status': status, 'admin_note': admin_note, 'updated_at': now, 'settlement_batch': batch}},
+            session=session
+        )
+        claimed = await self.db.trading_orders.find(
+            {'settlement_batch': batch}, {'_id': 0, 'settlement_batch': 0}, session=session
+        ).to_list(None)
+        for order_id in eligible:
+            # Overwritten below for every order this batch did claim
+            outcomes[order_id]['outcome'] = 'already_processed'
+
+        if action == 'approve':
+            # Grouped by user, oldest order first, then netted per user and holding
+            claimed.sort(key=lambda order: (order['user_id'], str(order.get('created_at'))))
+            legs = merge_legs([
+                leg for order in claimed
+                for leg in settlement_legs(order, target_prices.get(order.get('target_coin_id')))
+            ])
+            status = 'completed'
+            if session is None:
+                marks = [['trading_orders', order['id'], {'status': status}] for order in claimed]
+                await self._replay(await self._store_plan(batch, legs, marks, now))
+            else:
+                operations: Dict[str, List] = {'users': [], 'user_holdings': []}
+                for leg in legs:
+                    collection, query, update, upsert = leg_update(leg, now)
+                    operations[collection].append((query, update, upsert))
+                for collection, collection_operations in operations.items():
+                    if collection_operations:
+                        await self._bulk_write(collection, collection_operations, session)
+
+        if session is not None or action != 'approve':
+            await self.db.trading_orders.update_many(
+                {'settlement_batch': batch}, {'$set': {'status': status}}, session=session
+            )
+
+        changes = []
+        for order in claimed:
+            outcomes[order['id']]['outcome'] = status
+            changes.append(({**order, 'status': 'pending'}, {**order, 'status': status}))
+        return outcomes, changes
+
+    async def settle_many(self, order_ids: List[str], action: str, admin_note: Optional[str] = None,
+                          target_prices: Optional[Dict[str, float]] = None, batch_size: int = 500) -> List[Dict]:
+        """Approve (and settle) or reject many pending orders
+
+        Each batch of batch_size orders is claimed with one update_many, its
+        balance and holding changes are applied with ordered bulk_writes and
+        it commits as one transaction when supported. Returns one
+        {order_id, outcome, user_id} per distinct id, where outcome is
+        completed, rejected, already_processed, price_unavailable,
+        user_not_found or not_found (whose user_id is None).
+        """
+        order_ids = list(dict.fromkeys(order_ids))
+        target_prices = target_prices or {}
+        results = []
+
+        for start in range(0, len(order_ids), batch_size):
+            chunk = order_ids[start:start + batch_size]
+            if await self.supports_transactions():
+                async with await self.db.client.start_session() as session:
+                    outcomes, changes = await session.with_transaction(
+                        lambda session: self._apply_batch(chunk, action, admin_note, target_prices, session)
+                    )
+            else:
+                outcomes, changes = await self._apply_batch(chunk, action, admin_note, target_prices)
+
+            if changes and self.stats is not None:
+                await self.stats.record_many('trading_orders', changes)
+            if action == 'approve':
+                self.settled += len(changes)
+            else:
+                self.rejected += len(changes)
+            self.duplicates += sum(1 for outcome in outcomes.values() if outcome['outcome'] == 'already_processed')
+            results.extend(outcomes[order_id] for order_id in chunk)
+
+        return results
+
+    async def recover(self, grace: int = 300) -> int:
+        """Finish settlements interrupted on a server without transactions
+
+        Plans older than grace seconds are replayed. Orders approved longer
+        ago than that without a stored plan never had a leg applied and go
+        back to 'pending' so they can be approved again.
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace)
+        recovered = 0
+
+        async for plan in self.db[PLANS_COLLECTION].find({'status': 'pending', 'created_at': {'$lt': cutoff}}):
+            await self._replay(plan)
+            recovered += 1
+
+        async for order in self.db.trading_orders.find(
+            {'status': 'approved', 'updated_at': {'$lt': cutoff}}, {'_id': 0, 'id': 1, 'settlement_batch': 1}
+        ):
+            plan_id = order.get('settlement_batch') or order['id']
+            if await self.db[PLANS_COLLECTION].count_documents({'_id': plan_id}, limit=1):
+                continue
+            result = await self.db.trading_orders.update_one(
+                {'id': order['id'], 'status': 'approved'},
+                {'$set': {'status': 'pending', 'updated_at': datetime.now(timezone.utc)}, '$unset': {'settlement_batch': ''}}
+            )
+            recovered += result.modified_count
+
+        if recovered:
+            self.recovered += recovered
+            logger.warning(f"⚠️  Recovered {recovered} interrupted settlements")
+        return recovered
+
+    async def _recovery_loop(self, interval: int, grace: int):
+        while True:
+            try:
+                if self.lease is None or self.lease.is_leader:
+                    await self.recover(grace)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Settlement recovery failed: {str(e)}")
+            await asyncio.sleep(interval)
+
+    def start(self, interval: int = 60, grace: int = 300):
+        """Periodically recover interrupted settlements (in the lease holder only)"""
+        if self._task is None:
+            if self.lease is not None:
+                self.lease.start()
+            self._task = asyncio.create_task(self._recovery_loop(interval, grace))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.lease is not None:
+            await self.lease.stop()
+
+    def get_stats(self) -> Dict:
+        return {
+            'transactions': self._transactions,
+            'settled': self.settled,
+            'rejected': self.rejected,
+            'duplicate_claims': self.duplicates,
+            'recovered': self.recovered
+        }
@@ -0,0 +1,381 @@
+"""
+Stop-Loss Trigger Engine
+Keeps active stop-loss orders per coin sorted by stop price so each price tick
+finds the crossed stops with a bisect, then sends them through the settlement
+path as market sells or into the order book as limit sells, taking the
+coins through a guarded reservation first
+"""
+import asyncio
+import bisect
+import itertools
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from order_book import SYNC_SLACK, reservation_leg
+from timestamps import epoch_seconds
+
+logger = logging.getLogger(__name__)
+
+STOP_LOSS_NOTE = 'اجرای خودکار حد ضرر'
+
+class TriggerLevels:
+    """Stops of one coin as a sorted list of (-stop price, arrival) keys
+
+    A stop-loss fires once the price falls to or below its stop price, so the
+    crossed stops are always a prefix of the list, highest stop first: one
+    bisect finds where it ends and the prefix is cut off in a single slice.
+    """
+
+    def __init__(self):
+        self._keys: List[Tuple[float, int]] = []
+        self._ids: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, stop_id: str, key: Tuple[float, int]):
+        index = bisect.bisect_left(self._keys, key)
+        self._keys.insert(index, key)
+        self._ids.insert(index, stop_id)
+
+    def remove(self, stop_id: str, key: Tuple[float, int]) -> bool:
+        index = bisect.bisect_left(self._keys, key)
+        if index < len(self._keys) and self._keys[index] == key and self._ids[index] == stop_id:
+            del self._keys[index]
+            del self._ids[index]
+            return True
+        return False
+
+    def crossed(self, price: float) -> List[str]:
+        """Remove and return the stops whose stop price is at or above price"""
+        index = bisect.bisect_right(self._keys, (-price, float('inf')))
+        if index == 0:
+            return []
+        triggered = self._ids[:index]
+        del self._keys[:index]
+        del self._ids[:index]
+        return triggered
+
+class StopLossEngine:
+    """Evaluates stop-loss orders against price book ticks
+
+    Like the matching engine, triggers are held by the process owning the
+    lease and reloaded from stop_loss_orders when it becomes the holder;
+    stops created by other workers are picked up by a periodic sync. Firing a
+    stop is claimed in Mongo (active -> triggered) before any order exists,
+    and the emitted order's id is stored with the claim, so a crash between
+    the two is finished on the next reload without emitting it twice. Stops
+    left 'triggered' by a failed execution are retried every retry_interval.
+    """
+
+    def __init__(self, db, settlement, matching_engine=None, lease=None, sync_interval: float = 2.0,
+                 retry_interval: float = 30.0, user_cache=None):
+        self.db = db
+        self.settlement = settlement
+        self.matching_engine = matching_engine
+        self.lease = lease
+        self.sync_interval = sync_interval
+        self.retry_interval = retry_interval
+        self.user_cache = user_cache
+        self._retried_at = time.monotonic()
+        self.levels: Dict[str, TriggerLevels] = {}
+        self._locations: Dict[str, Tuple[str, Tuple[float, int]]] = {}  # stop id -> (coin_id, key)
+        self._stops: Dict[str, Dict] = {}
+        self._seen: Dict[str, float] = {}  # stop id -> created_at epoch, for sync
+        self._watermark: Optional[datetime] = None
+        self._sequence = itertools.count()
+        self._executions: Set[asyncio.Task] = set()
+        self._loaded = False
+        self._task: Optional[asyncio.Task] = None
+        self.triggered = 0
+        self.executed = 0
+        self.failed = 0
+        self.retried = 0
+
+    @property
+    def is_owner(self) -> bool:
+        return self.lease is None or self.lease.is_leader
+
+    def add(self, document: Dict) -> bool:
+        """Arm a stored stop; False when another process owns the triggers"""
+        if not self.is_owner or not self._loaded:
+            return False
+        self._add(document)
+        return True
+
+    def _add(self, document: Dict):
+        stop_id = document['id']
+        self._seen[stop_id] = epoch_seconds(document.get('created_at')) or time.time()
+        if stop_id in self._locations:
+            return
+        key = (-float(document['stop_price_tmn']), next(self._sequence))
+        levels = self.levels.get(document['coin_id'])
+        if levels is None:
+            levels = self.levels[document['coin_id']] = TriggerLevels()
+        levels.add(stop_id, key)
+        self._locations[stop_id] = (document['coin_id'], key)
+        self._stops[stop_id] = document
+
+    def remove(self, stop_id: str) -> bool:
+        """Disarm a stop held in this process"""
+        location = self._locations.pop(stop_id, None)
+        self._stops.pop(stop_id, None)
+        if location is None:
+            return False
+        return self.levels[location[0]].remove(stop_id, location[1])
+
+    async def on_prices(self, prices: Dict[str, Dict]):
+        """Price feed listener - fire every stop the new prices crossed"""
+        if not self._loaded:
+            return
+        for coin_id, data in prices.items():
+            levels = self.levels.get(coin_id)
+            price = data.get('price_tmn')
+            if not levels or not price:
+                continue
+            stops = []
+            for stop_id in levels.crossed(price):
+                self._locations.pop(stop_id, None)
+                stops.append(self._stops.pop(stop_id))
+            if stops:
+                self.triggered += len(stops)
+                # Settlement runs off the publish path so other listeners are not held up
+                task = asyncio.create_task(self._fire_all(stops, price))
+                self._executions.add(task)
+                task.add_done_callback(self._executions.discard)
+
+    async def _fire_all(self, stops: List[Dict], price: float):
+        for stop in stops:
+            try:
+                await self._fire(stop, price)
+            except Exception as e:
+                logger.error(f"Error executing stop-loss {stop['id']}: {str(e)}")
+
+    async def _fire(self, stop: Dict, price: float):
+        now = datetime.now(timezone.utc)
+        # The claim - a cancelled or already fired stop is not executed
+        try:
+            claimed = await self.db.stop_loss_orders.find_one_and_update(
+                {'id': stop['id'], 'status': 'active'},
+                {'$set': {'status': 'triggered', 'trigger_price_tmn': price, 'order_id': str(uuid.uuid4()),
+                          'triggered_at': now, 'updated_at': now}},
+                projection={'_id': 0},
+                return_document=ReturnDocument.AFTER
+            )
+        except Exception:
+            # Still active in Mongo - armed again so the next crossing price retries it
+            if self._loaded:
+                self._add(stop)
+            raise
+        if claimed is not None:
+            # A failure from here on leaves it 'triggered' for retry()
+            await self._execute(claimed)
+
+    async def _execute(self, stop: Dict):
+        """Emit the claimed stop's order; safe to repeat for the same claim"""
+        now = datetime.now(timezone.utc)
+        price = stop['trigger_price_tmn']
+
+        if stop.get('limit_price_tmn'):
+            failure = await self._emit_limit(stop, now)
+        else:
+            failure = await self._emit_market(stop, price, now)
+        status = 'failed' if failure else 'executed'
+
+        await self.db.stop_loss_orders.update_one(
+            {'id': stop['id'], 'status': 'triggered'},
+            {'$set': {'status': status, 'failure_reason': failure, 'updated_at': now}}
+        )
+        if failure:
+            self.failed += 1
+            logger.warning(f"⚠️  Stop-loss {stop['id']} failed: {failure}")
+        else:
+            self.executed += 1
+
+    def _invalidate(self, user_id: str):
+        if self.user_cache is not None:
+            self.user_cache.invalidate(user_id)
+
+    async def _emit_market(self, stop: Dict, price: float, now: datetime) -> Optional[str]:
+        """Reserve the coins and settle the market sell; the failure reason when it cannot"""
+        order = {
+            'id': stop['order_id'],
+            'user_id': stop['user_id'],
+            'order_type': 'sell',
+            'coin_symbol': stop['coin_symbol'],
+            'coin_id': stop['coin_id'],
+            'amount_crypto': stop['amount_crypto'],
+            'amount_tmn': None,
+            'target_coin_symbol': None,
+            'target_coin_id': None,
+            'price_at_order': price,
+            'total_value_tmn': stop['amount_crypto'] * price,
+            'status': 'completed',
+            'admin_note': STOP_LOSS_NOTE,
+            'stop_loss_id': stop['id'],
+            'created_at': now,
+            'updated_at': now
+        }
+        # Keyed on the order id like the plan below, so finishing the claim
+        # after a restart neither takes the coins nor pays the Toman twice
+        if not await self.settlement.reserve(('debit', order['user_id'], order['coin_symbol'], order['amount_crypto']),
+                                             f"{order['id']}:reserve"):
+            return f"not enough {stop['coin_symbol']} to sell {stop['amount_crypto']}"
+        emitted = await self.db.trading_orders.count_documents({'id': order['id']}, limit=1)
+        await self.settlement.apply(
+            order['id'], [('balance', order['user_id'], order['total_value_tmn'])],
+            inserts=[['trading_orders', [order]]]
+        )
+        self._invalidate(order['user_id'])
+        if not emitted and self.settlement.stats is not None:
+            await self.settlement.stats.record('trading_orders', None, order)
+        return None
+
+    async def _emit_limit(self, stop: Dict, now: datetime) -> Optional[str]:
+        """Reserve the coins and place the limit sell; the failure reason when it cannot"""
+        order = {
+            'id': stop['order_id'],
+            'user_id': stop['user_id'],
+            'order_type': 'limit_sell',
+            'coin_symbol': stop['coin_symbol'],
+            'coin_id': stop['coin_id'],
+            'amount_crypto': stop['amount_crypto'],
+            'target_price_tmn': float(stop['limit_price_tmn']),
+            'expiry_date': None,
+            'status': 'active',
+            'filled_amount': 0.0,
+            'remaining_amount': stop['amount_crypto'],
+            'reserved': True,
+            'stop_loss_id': stop['id'],
+            'created_at': now,
+            'updated_at': now
+        }
+        # Keyed on the order id, so a claim finished after a restart does not reserve twice
+        if not await self.settlement.reserve(reservation_leg(order), f"{order['id']}:reserve"):
+            return f"not enough {stop['coin_symbol']} to reserve {stop['amount_crypto']} for the limit sell"
+        self._invalidate(order['user_id'])
+        try:
+            await self.db.limit_orders.insert_one(order.copy())
+        except DuplicateKeyError:
+            return None  # Emitted before a restart; the order book already has it
+        if self.matching_engine is not None:
+            self.matching_engine.submit(order)
+        return None
+
+    async def rebuild(self):
+        """Reload active stops and finish any that were claimed but not executed"""
+        self.levels.clear()
+        self._locations.clear()
+        self._stops.clear()
+        self._seen.clear()
+        self._watermark = None
+        count = 0
+        async for document in self.db.stop_loss_orders.find({'status': 'active'}, {'_id': 0}).sort([('created_at', 1), ('id', 1)]):
+            self._add(document)
+            self._advance(document.get('created_at'))
+            count += 1
+        self._loaded = True
+
+        recovered = await self.retry()
+        logger.info(f"✅ Stop-loss triggers rebuilt: {count} active in {len(self.levels)} coins, {recovered} recovered")
+
+    async def retry(self, grace: float = 0) -> int:
+        """Execute again the stops claimed more than grace seconds ago and still 'triggered'"""
+        query: Dict[str, Any] = {'status': 'triggered'}
+        if grace:
+            query['triggered_at'] = {'$lt': datetime.now(timezone.utc) - timedelta(seconds=grace)}
+        recovered = 0
+        async for document in self.db.stop_loss_orders.find(query, {'_id': 0}):
+            try:
+                await self._execute(document)
+                recovered += 1
+            except Exception as e:
+                logger.error(f"Error recovering stop-loss {document['id']}: {str(e)}")
+        self.retried += recovered
+        return recovered
+
+    def _advance(self, created_at: Optional[datetime]):
+        if isinstance(created_at, datetime) and (self._watermark is None or created_at > self._watermark):
+            self._watermark = created_at
+
+    async def sync(self):
+        """Arm stops created by other workers and drop the ones cancelled since"""
+        query: Dict[str, Any] = {'status': 'active'}
+        if self._watermark is not None:
+            query['created_at'] = {'$gte': self._watermark - SYNC_SLACK}
+        async for document in self.db.stop_loss_orders.find(query, {'_id': 0}).sort([('created_at', 1), ('id', 1)]):
+            self._advance(document.get('created_at'))
+            if document['id'] not in self._seen:
+                self._add(document)
+
+        if self._locations:
+            async for document in self.db.stop_loss_orders.find(
+                {'id': {'$in': list(self._locations)}, 'status': {'$ne': 'active'}}, {'_id': 0, 'id': 1}
+            ):
+                self.remove(document['id'])
+
+        if self._watermark is not None:
+            horizon = epoch_seconds(self._watermark - 2 * SYNC_SLACK)
+            self._seen = {stop_id: created_at for stop_id, created_at in self._seen.items() if created_at >= horizon}
+
+        if time.monotonic() - self._retried_at >= self.retry_interval:
+            # Claims whose execution raised; the grace keeps clear of executions still running
+            self._retried_at = time.monotonic()
+            await self.retry(grace=self.retry_interval)
+
+    async def _run(self):
+        while True:
+            try:
+                if self.is_owner and not self._loaded:
+                    await self.rebuild()
+                elif not self.is_owner and self._loaded:
+                    self._loaded = False
+                    self.levels.clear()
+                    self._locations.clear()
+                    self._stops.clear()
+                    logger.info("🛑 Stop-loss triggers released to another worker")
+
+                if self._loaded:
+                    await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Stop-loss engine loop failed: {str(e)}")
+            await asyncio.sleep(self.sync_interval)
+
+    def start(self):
+        if self._task is None:
+            if self.lease is not None:
+                self.lease.start()
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"🔄 Stop-loss engine started (sync every {self.sync_interval}s)")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._executions:
+            await asyncio.gather(*self._executions, return_exceptions=True)
+        if self.lease is not None:
+            await self.lease.stop()
+
+    def get_stats(self) -> Dict:
+        return {
+            'owner': self.is_owner,
+            'loaded': self._loaded,
+            'coins': len(self.levels),
+            'armed_stops': len(self._locations),
+            'triggered': self.triggered,
+            'executed': self.executed,
+            'failed': self.failed,
+            'retried': self.retried
+        }
@@ -0,0 +1,18 @@
+"""
+Timestamps
+Conversion of stored dates, which are datetimes or ISO strings depending on
+the code that wrote them, into epoch seconds for in-memory schedulers
+"""
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+def epoch_seconds(value: Any) -> Optional[float]:
+    """Epoch seconds of a datetime or ISO string; naive values are UTC, None when unreadable"""
+    if isinstance(value, datetime):
+        return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+    if isinstance(value, str) and value:
+        try:
+            return epoch_seconds(datetime.fromisoformat(value.replace('Z', '+00:00')))
+        except ValueError:
+            return None
+    return None
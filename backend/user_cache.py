@@ -0,0 +1,64 @@
+"""
+Authenticated User Cache
+Keeps recently resolved user principals in memory so get_current_user
+does not query MongoDB on every authenticated request
+"""
+import logging
+from typing import Any, Dict, Optional
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+class UserCache:
+    """Bounded, TTL-based cache of user principals keyed by user id"""
+
+    def __init__(self, maxsize: int = 10000, ttl: int = 60):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, user_id: str) -> Optional[Any]:
+        """Return the cached user or None on a miss"""
+        user = self._cache.get(user_id)
+        if user is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return user
+
+    def generation(self) -> int:
+        """Snapshot taken before a database read, passed back to set()"""
+        return self._generation
+
+    def set(self, user_id: str, user: Any, generation: Optional[int] = None):
+        """Cache a user unless it was invalidated while being loaded"""
+        if generation is not None and generation != self._generation:
+            return
+        self._cache[user_id] = user
+
+    def invalidate(self, user_id: str):
+        """Drop a user after its document changed"""
+        self._generation += 1
+        self.invalidations += 1
+        self._cache.pop(user_id, None)
+
+    def clear(self):
+        """Drop every cached user"""
+        self._generation += 1
+        self._cache.clear()
+
+    def get_stats(self) -> Dict:
+        """Hit/miss counters for monitoring"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._cache),
+            'max_size': self._cache.maxsize,
+            'ttl_seconds': self._cache.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0
+        }
@@ -3,10 +3,10 @@ Wallex Price Service
 Fetches real-time crypto prices in Toman from Wallex API
 Official Iranian Exchange API
 """
-import httpx
 import logging
 from datetime import datetime, timezone
 from typing import Dict, Optional
+from http_clients import get_http_client
 
 logger = logging.getLogger(__name__)
 
@@ -53,73 +53,73 @@ class WallexPriceService:
         try:
             logger.info("🔄 Fetching prices from Wallex API...")
             
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                headers = {
-                    'x-api-key': self.api_key,
-                    'Accept': 'application/json'
-                }
-                
-                response = await client.get(
-                    f"{self.base_url}{WALLEX_MARKETS_ENDPOINT}",
-                    headers=headers
-                )
-                
-                if response.status_code != 200:
-                    logger.error(f"Wallex API error: {response.status_code}")
-                    return {'success': False, 'data': {}}
-                
-                data = response.json()
-                
-                if not data.get('result', {}).get('success'):
-                    logger.error("Wallex API returned unsuccessful response")
-                    return {'success': False, 'data': {}}
-                
-                markets = data.get('result', {}).get('markets', [])
-                prices = {}
-                
-                for market in markets:
-                    try:
-                        symbol = market.get('symbol', '')
-                        
-                        # Only process TMN-based markets
-                        if symbol not in WALLEX_SYMBOL_MAP:
-                            continue
-                        
-                        coin_info = WALLEX_SYMBOL_MAP[symbol]
-                        
-                        # Get price (already in Toman)
-                        price_str = market.get('price', '0')
-                        price_tmn = float(price_str) if price_str else 0
-                        
-                        # Get 24h change
-                        change_str = market.get('change_24h', '0')
-                        change_24h = float(change_str) if change_str else 0
-                        
-                        if price_tmn > 0:
-                            prices[coin_info['id']] = {
-                                'symbol': coin_info['symbol'],
-                                'name': coin_info['name'],
-                                'price_tmn': price_tmn,
-                                'change_24h': change_24h,
-                                'last_updated': datetime.now(timezone.utc).isoformat(),
-                                'source': 'wallex'
-                            }
-                            
-                            logger.info(f"✅ {coin_info['symbol']}: {price_tmn:,.0f} تومان ({change_24h:+.2f}%)")
+            client = get_http_client('wallex')
+            headers = {
+                'x-api-key': self.api_key,
+                'Accept': 'application/json'
+            }
+            
+            response = await client.get(
+                f"{self.base_url}{WALLEX_MARKETS_ENDPOINT}",
+                headers=headers
+            )
+            
+            if response.status_code != 200:
+                logger.error(f"Wallex API error: {response.status_code}")
+                return {'success': False, 'data': {}}
+            
+            data = response.json()
+            
+            if not data.get('result', {}).get('success'):
+                logger.error("Wallex API returned unsuccessful response")
+                return {'success': False, 'data': {}}
+            
+            markets = data.get('result', {}).get('markets', [])
+            prices = {}
+            
+            for market in markets:
+                try:
+                    symbol = market.get('symbol', '')
                     
-                    except Exception as e:
-                        logger.debug(f"Error parsing market: {str(e)}")
+                    # Only process TMN-based markets
+                    if symbol not in WALLEX_SYMBOL_MAP:
                         continue
+                    
+                    coin_info = WALLEX_SYMBOL_MAP[symbol]
+                    
+                    # Get price (already in Toman)
+                    price_str = market.get('price', '0')
+                    price_tmn = float(price_str) if price_str else 0
+                    
+                    # Get 24h change
+                    change_str = market.get('change_24h', '0')
+                    change_24h = float(change_str) if change_str else 0
+                    
+                    if price_tmn > 0:
+                        prices[coin_info['id']] = {
+                            'symbol': coin_info['symbol'],
+                            'name': coin_info['name'],
+                            'price_tmn': price_tmn,
+                            'change_24h': change_24h,
+                            'last_updated': datetime.now(timezone.utc).isoformat(),
+                            'source': 'wallex'
+                        }
+                        
+                        logger.info(f"✅ {coin_info['symbol']}: {price_tmn:,.0f} تومان ({change_24h:+.2f}%)")
                 
-                if prices:
-                    logger.info(f"✅ Fetched {len(prices)} prices from Wallex")
-                    self.cached_prices = prices
-                    self.last_update = datetime.now(timezone.utc)
-                    return {'success': True, 'data': prices}
-                else:
-                    logger.warning("No prices found in Wallex response")
-                    return {'success': False, 'data': {}}
-                
+                except Exception as e:
+                    logger.debug(f"Error parsing market: {str(e)}")
+                    continue
+            
+            if prices:
+                logger.info(f"✅ Fetched {len(prices)} prices from Wallex")
+                self.cached_prices = prices
+                self.last_update = datetime.now(timezone.utc)
+                return {'success': True, 'data': prices}
+            else:
+                logger.warning("No prices found in Wallex response")
+                return {'success': False, 'data': {}}
+            
         except Exception as e:
             logger.error(f"Error fetching Wallex prices: {str(e)}")
             return {'success': False, 'data': {}}
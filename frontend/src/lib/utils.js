@@ -4,3 +4,9 @@ import { twMerge } from "tailwind-merge"
 export function cn(...inputs) {
   return twMerge(clsx(inputs));
 }
+
+// List endpoints return one page at a time; the cursor of the next page
+// comes back in the X-Next-Cursor header and is null on the last page
+export function nextCursor(response) {
+  return response.headers["x-next-cursor"] || null;
+}
@@ -49,7 +49,8 @@ const Trade = ({ user, onLogout }) => {
       const [pricesRes, holdingsRes, ordersRes] = await Promise.all([
         axios.get(`${API}/crypto/prices`),
         axios.get(`${API}/trading/holdings/my`, config),
-        axios.get(`${API}/trading/orders/my`, config)
+        // Only the latest orders are listed below
+        axios.get(`${API}/trading/orders/my`, { ...config, params: { limit: 10 } })
       ]);
 
       if (pricesRes.data.success) {
@@ -7,6 +7,7 @@ import { Input } from "@/components/ui/input";
 import { Label } from "@/components/ui/label";
 import { Dialog, DialogContent, DialogHeader, DialogTitle } from "@/components/ui/dialog";
 import { useToast } from "@/hooks/use-toast";
+import { nextCursor } from "@/lib/utils";
 import { Wallet as WalletIcon, ArrowDownCircle, Copy, CheckCircle } from "lucide-react";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
@@ -18,6 +19,7 @@ export default function Wallet({ user }) {
   const [depositLoading, setDepositLoading] = useState(false);
   const [cards, setCards] = useState([]);
   const [myDeposits, setMyDeposits] = useState([]);
+  const [depositsCursor, setDepositsCursor] = useState(null);
   const { toast } = useToast();
   const navigate = useNavigate();
 
@@ -35,10 +37,11 @@ export default function Wallet({ user }) {
     }
   };
 
-  const fetchMyDeposits = async () => {
+  const fetchMyDeposits = async (pageCursor = null) => {
     try {
-      const response = await axios.get(`${API}/deposits/my`);
-      setMyDeposits(response.data);
+      const response = await axios.get(`${API}/deposits/my`, { params: pageCursor ? { cursor: pageCursor } : {} });
+      setMyDeposits(previous => pageCursor ? [...previous, ...response.data] : response.data);
+      setDepositsCursor(nextCursor(response));
     } catch (error) {
       console.error('Error:', error);
     }
@@ -140,6 +143,11 @@ export default function Wallet({ user }) {
                     </span>
                   </div>
                 ))}
+                {depositsCursor && (
+                  <Button variant="outline" className="w-full" onClick={() => fetchMyDeposits(depositsCursor)}>
+                    نمایش واریزهای بیشتر
+                  </Button>
+                )}
               </div>
             )}
           </CardContent>
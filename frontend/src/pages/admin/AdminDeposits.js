@@ -7,6 +7,7 @@ import { Badge } from "@/components/ui/badge";
 import { Textarea } from "@/components/ui/textarea";
 import { Dialog, DialogContent, DialogDescription, DialogHeader, DialogTitle } from "@/components/ui/dialog";
 import { useToast } from "@/hooks/use-toast";
+import { nextCursor } from "@/lib/utils";
 import { Clock, CheckCircle, XCircle, User, Mail, CreditCard, Calendar, DollarSign } from "lucide-react";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
@@ -14,6 +15,7 @@ const API = `${BACKEND_URL}/api`;
 
 export default function AdminDeposits({ user, onLogout }) {
   const [deposits, setDeposits] = useState([]);
+  const [cursor, setCursor] = useState(null);
   const [loading, setLoading] = useState(true);
   const [selectedDeposit, setSelectedDeposit] = useState(null);
   const [adminNote, setAdminNote] = useState("");
@@ -24,14 +26,12 @@ export default function AdminDeposits({ user, onLogout }) {
     fetchDeposits();
   }, []);
 
-  const fetchDeposits = async () => {
+  const fetchDeposits = async (pageCursor = null) => {
     try {
-      const response = await axios.get(`${API}/admin/deposits`);
-      // Sort by created_at desc
-      const sortedDeposits = response.data.sort((a, b) => 
-        new Date(b.created_at) - new Date(a.created_at)
-      );
-      setDeposits(sortedDeposits);
+      const response = await axios.get(`${API}/admin/deposits`, { params: pageCursor ? { cursor: pageCursor } : {} });
+      // Pages come newest first; a later page is appended to the ones loaded
+      setDeposits(previous => pageCursor ? [...previous, ...response.data] : response.data);
+      setCursor(nextCursor(response));
     } catch (error) {
       console.error('Error fetching deposits:', error);
       toast({
@@ -233,6 +233,14 @@ export default function AdminDeposits({ user, onLogout }) {
           </div>
         )}
 
+        {cursor && (
+          <div className="flex justify-center">
+            <Button variant="outline" onClick={() => fetchDeposits(cursor)} data-testid="load-more-deposits">
+              نمایش درخواست‌های بیشتر
+            </Button>
+          </div>
+        )}
+
         {deposits.length === 0 && (
           <Card className="bg-slate-900/50 border-slate-800">
             <CardContent className="py-12 text-center">
@@ -1,12 +1,14 @@
 import React, { useState, useEffect } from 'react';
 import axios from 'axios';
 import { useNavigate } from 'react-router-dom';
+import { nextCursor } from '@/lib/utils';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
 const AdminOrders = ({ user, onLogout }) => {
   const [orders, setOrders] = useState([]);
+  const [cursor, setCursor] = useState(null);
   const [loading, setLoading] = useState(true);
   const [processingId, setProcessingId] = useState(null);
   const navigate = useNavigate();
@@ -19,11 +21,12 @@ const AdminOrders = ({ user, onLogout }) => {
     fetchOrders();
   }, [user, navigate]);
 
-  const fetchOrders = async () => {
+  const fetchOrders = async (pageCursor = null) => {
     try {
-      setLoading(true);
-      const response = await axios.get(`${API}/admin/trading/orders`);
-      setOrders(response.data);
+      if (!pageCursor) setLoading(true);
+      const response = await axios.get(`${API}/admin/trading/orders`, { params: pageCursor ? { cursor: pageCursor } : {} });
+      setOrders(previous => pageCursor ? [...previous, ...response.data] : response.data);
+      setCursor(nextCursor(response));
     } catch (error) {
       console.error('خطا در بارگذاری سفارشات:', error);
       alert('خطا در بارگذاری سفارشات');
@@ -277,6 +280,16 @@ const AdminOrders = ({ user, onLogout }) => {
               </tbody>
             </table>
           </div>
+          {cursor && (
+            <div className="flex justify-center p-4 border-t border-slate-800">
+              <button
+                onClick={() => fetchOrders(cursor)}
+                className="px-4 py-2 bg-slate-800 hover:bg-slate-700 rounded text-sm transition-colors"
+              >
+                نمایش سفارشات بیشتر
+              </button>
+            </div>
+          )}
         </div>
       </div>
     </div>
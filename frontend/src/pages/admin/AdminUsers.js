@@ -7,6 +7,7 @@ import { Badge } from "@/components/ui/badge";
 import { Switch } from "@/components/ui/switch";
 import { Input } from "@/components/ui/input";
 import { useToast } from "@/hooks/use-toast";
+import { nextCursor } from "@/lib/utils";
 import { 
   Mail, Phone, Calendar, Shield, CheckCircle, XCircle, Search, Filter,
   UserX, UserCheck, StickyNote, Tag, Activity, Download, Users, AlertTriangle,
@@ -18,6 +19,7 @@ const API = `${BACKEND_URL}/api`;
 
 export default function AdminUsers({ user, onLogout }) {
   const [users, setUsers] = useState([]);
+  const [cursor, setCursor] = useState(null);
   const [filteredUsers, setFilteredUsers] = useState([]);
   const [loading, setLoading] = useState(true);
   const [stats, setStats] = useState(null);
@@ -58,14 +60,16 @@ export default function AdminUsers({ user, onLogout }) {
     applyFilters();
   }, [users, searchText, kycLevelFilter, statusFilter]);
 
-  const fetchUsers = async () => {
+  const fetchUsers = async (pageCursor = null) => {
     try {
       const token = localStorage.getItem('token');
       const response = await axios.get(`${API}/admin/users`, {
-        headers: { Authorization: `Bearer ${token}` }
+        headers: { Authorization: `Bearer ${token}` },
+        params: pageCursor ? { cursor: pageCursor } : {}
       });
-      setUsers(response.data);
-      setFilteredUsers(response.data);
+      // Filters run over the users loaded so far; applyFilters refreshes filteredUsers
+      setUsers(previous => pageCursor ? [...previous, ...response.data] : response.data);
+      setCursor(nextCursor(response));
     } catch (error) {
       console.error('Error fetching users:', error);
       toast({
@@ -713,6 +717,14 @@ export default function AdminUsers({ user, onLogout }) {
           ))}
         </div>
 
+        {cursor && (
+          <div className="flex justify-center">
+            <Button variant="outline" onClick={() => fetchUsers(cursor)}>
+              نمایش کاربران بیشتر
+            </Button>
+          </div>
+        )}
+
         {filteredUsers.length === 0 && (
           <Card className="bg-slate-900/50 border-slate-800">
             <CardContent className="p-8 text-center">
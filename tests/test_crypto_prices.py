@@ -0,0 +1,31 @@
+import asyncio
+
+from fakeredis import aioredis as fake_aioredis
+
+from crypto_prices import CircuitBreaker, CryptoPriceService, TokenBucket
+from rate_limiter import RedisRateLimiter
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_workers_share_one_budget():
+    async def scenario():
+        shared = RedisRateLimiter(fake_aioredis.FakeRedis())
+        # Two workers' buckets, each with room for the whole budget locally
+        workers = [TokenBucket(3, burst=3, shared=shared) for _ in range(2)]
+        granted = [await bucket.acquire(0) for bucket in workers for _ in range(3)]
+        assert granted.count(True) == 3
+        assert sum(bucket.throttled for bucket in workers) == 3
+    run(scenario())
+
+def test_throttled_probe_does_not_block_the_next():
+    async def scenario():
+        service = CryptoPriceService(calls_per_minute=1, burst=1, max_wait=0)
+        breaker = service.breakers['simple_price'] = CircuitBreaker()
+        breaker.state, breaker.open_until = 'open', 0.0
+        service.bucket._tokens = 0.0
+
+        assert await service._fetch('simple_price', '/simple/price') is None
+        assert breaker.state == 'half_open'
+        assert breaker.allow()
+    run(scenario())
@@ -0,0 +1,112 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from db_indexes import INDEXES
+import dca_executor
+from dca_executor import DCAExecutor
+from settlement import SettlementEngine
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+NOW = datetime(2026, 1, 1, 12, tzinfo=timezone.utc)
+
+async def make_executor(price_lookup=None):
+    db = AsyncMongoMockClient()['dca_test']
+    await db.user_holdings.create_indexes(INDEXES['user_holdings'])
+    await db.users.insert_one({'id': 'u1', 'wallet_balance_tmn': 1000.0})
+    await db.dca_strategies.insert_many([strategy('s1'), strategy('s2')])
+
+    async def prices(coin_ids):
+        return {coin_id: 100.0 for coin_id in coin_ids}
+    executor = DCAExecutor(db, SettlementEngine(db, transactions=False), price_lookup or prices)
+    return db, executor
+
+def strategy(strategy_id, **fields):
+    document = {'id': strategy_id, 'user_id': 'u1', 'coin_symbol': 'BTC', 'coin_id': 'bitcoin',
+                'amount_tmn_per_purchase': 100.0, 'frequency': 'daily', 'total_budget_tmn': 500.0,
+                'spent_amount_tmn': 0.0, 'purchase_count': 0, 'next_purchase_date': NOW - timedelta(minutes=1),
+                'status': 'active', 'created_at': NOW - timedelta(days=1)}
+    document.update(fields)
+    return document
+
+async def balance(db):
+    return (await db.users.find_one({'id': 'u1'}))['wallet_balance_tmn']
+
+def test_purchases_settle_once():
+    async def scenario():
+        db, executor = await make_executor()
+        await executor.execute(['s1', 's2'], NOW)
+        await executor.execute(['s1', 's2'], NOW)
+
+        assert await balance(db) == 800.0
+        assert await db.trading_orders.count_documents({'status': 'completed'}) == 2
+        s1 = await db.dca_strategies.find_one({'id': 's1'})
+        assert s1['spent_amount_tmn'] == 100.0 and 'pending_purchase' not in s1
+        assert s1['next_purchase_date'].replace(tzinfo=timezone.utc) == NOW + timedelta(days=1, minutes=-1)
+    run(scenario())
+
+def test_strategy_changed_since_read_is_not_bought():
+    async def scenario():
+        async def prices(coin_ids):
+            # Paused by its owner while the batch was being priced
+            await db.dca_strategies.update_one({'id': 's2'}, {'$set': {'status': 'paused'}})
+            return {coin_id: 100.0 for coin_id in coin_ids}
+        db, executor = await make_executor(prices)
+
+        await executor.execute(['s1', 's2'], NOW)
+        assert await balance(db) == 900.0
+        assert await db.trading_orders.count_documents({}) == 1
+        assert (await db.trading_orders.find_one({}))['dca_strategy_id'] == 's1'
+        assert executor.get_stats()['superseded_purchases'] == 1
+    run(scenario())
+
+def test_recover_places_committed_purchase():
+    async def scenario():
+        db, executor = await make_executor()
+        place = executor._place
+        async def crash(orders):
+            raise ConnectionError('worker killed')
+        executor._place = crash
+        with pytest.raises(ConnectionError):
+            await executor.execute(['s1'], NOW)
+        assert await db.trading_orders.count_documents({}) == 0
+
+        executor._place = place
+        await executor.recover()
+        await executor.recover()
+        assert await balance(db) == 900.0
+        assert await db.trading_orders.count_documents({'status': 'completed'}) == 1
+        assert await db.dca_strategies.count_documents({'pending_purchase': {'$exists': True}}) == 0
+    run(scenario())
+
+def test_invalid_next_purchase_date_is_skipped(monkeypatch):
+    async def scenario():
+        db, executor = await make_executor()
+        unreadable = NOW - timedelta(hours=1)
+        await db.dca_strategies.update_one({'id': 's2'}, {'$set': {'next_purchase_date': unreadable}})
+        # Stands in for a stored value the conversion cannot read
+        epoch_seconds = dca_executor.epoch_seconds
+        monkeypatch.setattr(dca_executor, 'epoch_seconds', lambda value: (
+            None if value.replace(tzinfo=timezone.utc) == unreadable else epoch_seconds(value)
+        ))
+        await executor.load(NOW)
+        assert len(executor.wheel) == 1
+        assert executor.get_stats()['invalid_strategies'] == 1
+    run(scenario())
+
+def test_purchases_never_overdraw_the_wallet():
+    async def scenario():
+        db, executor = await make_executor()
+        await db.users.update_one({'id': 'u1'}, {'$set': {'wallet_balance_tmn': 150.0}})
+
+        await executor.execute(['s1', 's2'], NOW)
+        assert await balance(db) == 50.0
+        assert await db.trading_orders.count_documents({}) == 1
+        assert executor.get_stats()['skipped_insufficient_balance'] == 1
+        holding = await db.user_holdings.find_one({'user_id': 'u1', 'coin_symbol': 'BTC'})
+        assert holding['amount'] == pytest.approx(1.0)
+    run(scenario())
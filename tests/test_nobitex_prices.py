@@ -0,0 +1,48 @@
+import asyncio
+
+from nobitex_prices import NobitexPriceService
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+QUOTES = {f'coin-{index}': {'price_tmn': 100.0} for index in range(5)}
+
+def test_cancelled_source_does_not_lower_its_latency():
+    async def scenario():
+        service = NobitexPriceService()
+        async def fast():
+            return QUOTES
+        async def slow():
+            await asyncio.sleep(1)
+            return QUOTES
+        service.sources = {'fast': fast, 'slow': slow}
+        service.source_stats = {
+            name: {'attempts': 0, 'successes': 0, 'failures': 0, 'cancelled': 0, 'avg_latency': latency}
+            for name, latency in (('fast', None), ('slow', 0.5))
+        }
+
+        assert await service._fetch_hedged() == QUOTES
+        await asyncio.sleep(0)
+        slow_stats = service.source_stats['slow']
+        assert slow_stats['cancelled'] == 1
+        assert slow_stats['avg_latency'] == 0.5
+        assert service.source_stats['fast']['successes'] == 1
+    run(scenario())
+
+def test_aggregator_sources_record_stats():
+    async def scenario():
+        service = NobitexPriceService()
+        async def empty():
+            return {}
+        async def quotes():
+            return QUOTES
+        service.sources = {'abantether_api': empty, 'abantether_page': quotes, 'nobitex_api': quotes}
+
+        # The API falls short of the quorum, so the page's answer is used
+        assert await service.fetch_abantether_prices() == QUOTES
+        assert await service.fetch_nobitex_prices() == QUOTES
+        stats = service.get_source_stats()
+        assert stats['abantether_api']['failures'] == 1
+        assert stats['abantether_page']['successes'] == 1
+        assert stats['nobitex_api']['successes'] == 1
+    run(scenario())
@@ -0,0 +1,163 @@
+import asyncio
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import PyMongoError
+
+from db_indexes import INDEXES
+from order_book import FILLS_COLLECTION, MatchingEngine, reservation_leg
+from settlement import SettlementEngine
+from user_cache import UserCache
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+async def make_engine(user_cache=None):
+    db = AsyncMongoMockClient()['order_book_test']
+    await db.user_holdings.create_indexes(INDEXES['user_holdings'])
+    await db[FILLS_COLLECTION].create_indexes(INDEXES[FILLS_COLLECTION])
+    await db.users.insert_many([
+        {'id': 'buyer', 'wallet_balance_tmn': 1000.0},
+        {'id': 'seller', 'wallet_balance_tmn': 0.0},
+    ])
+    await db.user_holdings.insert_one({'id': 'h1', 'user_id': 'seller', 'coin_symbol': 'BTC', 'coin_id': 'bitcoin',
+                                       'amount': 1.0, 'average_buy_price_tmn': 100.0})
+    settlement = SettlementEngine(db, transactions=False)
+    engine = MatchingEngine(db, settlement, user_cache=user_cache)
+    await engine.rebuild()
+    return db, engine
+
+def limit_order(user_id, order_type, amount, price, **fields):
+    document = {'id': str(uuid.uuid4()), 'user_id': user_id, 'order_type': order_type, 'coin_symbol': 'BTC',
+                'coin_id': 'bitcoin', 'amount_crypto': amount, 'target_price_tmn': price, 'expiry_date': None,
+                'status': 'active', 'filled_amount': 0.0, 'remaining_amount': amount, 'reserved': True,
+                'created_at': datetime.now(timezone.utc)}
+    document.update(fields)
+    return document
+
+async def place(db, engine, document):
+    """What the limit order route does"""
+    assert await engine.settlement.reserve(reservation_leg(document))
+    await db.limit_orders.insert_one(document.copy())
+    return engine.submit(document)
+
+async def balance(db, user_id):
+    return (await db.users.find_one({'id': user_id}))['wallet_balance_tmn']
+
+async def coins(db, user_id):
+    holding = await db.user_holdings.find_one({'user_id': user_id, 'coin_symbol': 'BTC'})
+    return holding['amount'] if holding else 0.0
+
+def test_submit_after_sync_does_not_add_twice():
+    async def scenario():
+        db, engine = await make_engine()
+        document = limit_order('buyer', 'limit_buy', 1.0, 100.0)
+        await engine.settlement.reserve(reservation_leg(document))
+        await db.limit_orders.insert_one(document.copy())
+
+        await engine.sync()
+        order = engine.submit(document)
+        assert order is engine.books['bitcoin'].orders[document['id']]
+        assert engine.get_stats()['resting_orders'] == 1
+        assert engine.books['bitcoin'].depth(10)['bids'] == [[100.0, 1.0]]
+    run(scenario())
+
+def test_reservation_fails_without_funds():
+    async def scenario():
+        db, engine = await make_engine()
+        assert not await engine.settlement.reserve(reservation_leg(limit_order('buyer', 'limit_buy', 1.0, 2000.0)))
+        assert not await engine.settlement.reserve(reservation_leg(limit_order('seller', 'limit_sell', 2.0, 100.0)))
+        assert await balance(db, 'buyer') == 1000.0
+        assert await coins(db, 'seller') == 1.0
+    run(scenario())
+
+def test_book_fill_settles_both_sides():
+    async def scenario():
+        db, engine = await make_engine()
+        sell = await place(db, engine, limit_order('seller', 'limit_sell', 0.5, 150.0))
+        assert await coins(db, 'seller') == pytest.approx(0.5)
+
+        buy = await place(db, engine, limit_order('buyer', 'limit_buy', 0.5, 200.0))
+        assert buy.status == 'filled' and sell.status == 'filled'
+        await engine.journal.flush()
+
+        # Filled at the resting price; the buyer gets back what was reserved above it
+        assert await balance(db, 'buyer') == pytest.approx(1000.0 - 75.0)
+        assert await coins(db, 'buyer') == pytest.approx(0.5)
+        assert await balance(db, 'seller') == pytest.approx(75.0)
+        assert await coins(db, 'seller') == pytest.approx(0.5)
+        assert await db[FILLS_COLLECTION].count_documents({}) == 1
+        assert (await db.limit_orders.find_one({'id': buy.id}))['status'] == 'filled'
+    run(scenario())
+
+def test_cancel_releases_reservation():
+    async def scenario():
+        db, engine = await make_engine()
+        buy = await place(db, engine, limit_order('buyer', 'limit_buy', 2.0, 100.0))
+        sell = await place(db, engine, limit_order('seller', 'limit_sell', 1.0, 300.0))
+        assert await balance(db, 'buyer') == 800.0 and await coins(db, 'seller') == 0.0
+
+        engine.cancel(buy.id)
+        engine.cancel(sell.id)
+        await engine.journal.flush()
+        assert await balance(db, 'buyer') == 1000.0
+        assert await coins(db, 'seller') == 1.0
+        assert (await db.limit_orders.find_one({'id': buy.id}))['status'] == 'cancelled'
+    run(scenario())
+
+def test_retried_flush_settles_once():
+    async def scenario():
+        db, engine = await make_engine()
+        await place(db, engine, limit_order('seller', 'limit_sell', 1.0, 100.0))
+        await place(db, engine, limit_order('buyer', 'limit_buy', 1.0, 100.0))
+
+        # Legs and fills are written, then the order state update fails
+        mark = engine.settlement._mark
+        async def failing_mark(marks, session=None):
+            raise PyMongoError('connection reset')
+        engine.settlement._mark = failing_mark
+        await engine.journal.flush()
+        assert engine.journal.pending == 3
+
+        engine.settlement._mark = mark
+        await engine.journal.flush()
+        await engine.journal.flush()
+        assert engine.journal.pending == 0
+        assert await balance(db, 'buyer') == 900.0
+        assert await balance(db, 'seller') == 100.0
+        assert await coins(db, 'buyer') == 1.0
+        assert await db[FILLS_COLLECTION].count_documents({}) == 1
+    run(scenario())
+
+def test_rebuild_reserves_for_stored_orders():
+    async def scenario():
+        db, engine = await make_engine()
+        funded = limit_order('buyer', 'limit_buy', 1.0, 600.0, created_at=datetime(2024, 1, 1, tzinfo=timezone.utc))
+        unfunded = limit_order('buyer', 'limit_buy', 1.0, 600.0, created_at=datetime(2024, 1, 2, tzinfo=timezone.utc))
+        for document in (funded, unfunded):
+            del document['reserved']
+        await db.limit_orders.insert_many([funded, unfunded])
+
+        await engine.rebuild()
+        assert await balance(db, 'buyer') == 400.0
+        assert (await db.limit_orders.find_one({'id': funded['id']}))['reserved'] is True
+        cancelled = await db.limit_orders.find_one({'id': unfunded['id']})
+        assert cancelled['status'] == 'cancelled' and cancelled['cancel_reason'] == 'insufficient_funds'
+        assert engine.get_stats()['resting_orders'] == 1
+    run(scenario())
+
+def test_flush_invalidates_cached_users():
+    async def scenario():
+        cache = UserCache()
+        db, engine = await make_engine(cache)
+        for user_id in ('buyer', 'seller', 'bystander'):
+            cache.set(user_id, {'id': user_id})
+        await place(db, engine, limit_order('seller', 'limit_sell', 1.0, 100.0))
+        await place(db, engine, limit_order('buyer', 'limit_buy', 1.0, 100.0))
+
+        await engine.journal.flush()
+        assert cache.get('buyer') is None and cache.get('seller') is None
+        assert cache.get('bystander') is not None
+    run(scenario())
@@ -0,0 +1,61 @@
+import asyncio
+from datetime import datetime, timezone
+
+from mongomock_motor import AsyncMongoMockClient
+
+from platform_stats import BUCKETS_COLLECTION, STATS_COLLECTION, PlatformStats
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+class Follower:
+    """A lease held by another worker"""
+    is_leader = False
+
+    async def acquire(self):
+        return False
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+async def make_db():
+    db = AsyncMongoMockClient()['platform_stats_test']
+    now = datetime.now(timezone.utc)
+    await db.users.insert_many([
+        {'id': 'u1', 'is_active': True, 'kyc_level': 2, 'created_at': now},
+        {'id': 'u2', 'is_active': False, 'kyc_level': 0, 'created_at': now.isoformat()},
+    ])
+    await db.trading_orders.insert_many([
+        {'id': 'o1', 'user_id': 'u1', 'status': 'completed', 'total_value_tmn': 300.0, 'created_at': now},
+        {'id': 'o2', 'user_id': 'u1', 'status': 'pending', 'total_value_tmn': 200.0, 'created_at': now},
+    ])
+    return db
+
+def test_reconcile_counts_from_source_collections():
+    async def scenario():
+        db = await make_db()
+        stats = PlatformStats(db)
+        await stats.reconcile()
+
+        counters = await db[STATS_COLLECTION].find_one({'_id': 'global'})
+        assert counters['users_total'] == 2 and counters['users_active'] == 1
+        assert counters['kyc_level_2'] == 1 and counters['orders_pending'] == 1
+        assert counters['deposits_approved_amount'] == 0 and counters['cards_active'] == 0
+
+        # The user with an ISO string created_at is left out of the buckets instead of failing the rebuild
+        day = await db[BUCKETS_COLLECTION].find_one({'granularity': 'day'})
+        assert day['registrations'] == 1 and day['volume_tmn'] == 500.0 and day['completed_orders'] == 1
+    run(scenario())
+
+def test_only_the_lease_holder_reconciles():
+    async def scenario():
+        db = await make_db()
+        stats = PlatformStats(db, lease=Follower())
+        stats.start(interval=3600)
+        await asyncio.sleep(0.05)
+        await stats.stop()
+        assert await db[STATS_COLLECTION].count_documents({}) == 0
+    run(scenario())
@@ -0,0 +1,87 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from price_book import PriceBook, PriceFeedAggregator
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+SEED = {'bitcoin': {'symbol': 'BTC', 'name': 'Bitcoin', 'price_tmn': 100.0}}
+
+def ago(seconds):
+    return (datetime.now(timezone.utc) - timedelta(seconds=seconds)).isoformat()
+
+def test_seed_and_stale_prices_are_not_fresh():
+    book = PriceBook(seed=SEED)
+    assert book.get_price('bitcoin') == 100.0
+    assert book.get_fresh_price('bitcoin', 300) is None
+
+    book.publish({'bitcoin': {'price_tmn': 110.0, 'quoted_at': ago(600)}}, source='aggregated')
+    assert book.get_fresh_price('bitcoin', 300) is None
+
+    book.publish({'bitcoin': {'price_tmn': 120.0}}, source='aggregated')
+    assert book.get_fresh_price('bitcoin', 300) == 120.0
+    assert book.get_fresh_price('ethereum', 300) is None
+
+def test_follower_keeps_requoted_prices_fresh():
+    async def scenario():
+        book = PriceBook(seed=SEED)
+        leader = {'bitcoin': {'coin_id': 'bitcoin', 'price_tmn': 110.0, 'quoted_at': ago(10)}}
+        async def follow_source():
+            return leader
+        aggregator = PriceFeedAggregator(book, {}, follow_source=follow_source)
+
+        await aggregator.follow()
+        version = book.version
+        assert book.get_fresh_price('bitcoin', 300) == 110.0
+
+        # Same price, newer quote: fresh again without a new version
+        leader['bitcoin'] = {**leader['bitcoin'], 'quoted_at': ago(1)}
+        book.confirm({'bitcoin': ago(400)})
+        assert book.get_fresh_price('bitcoin', 300) is None
+        await aggregator.follow()
+        assert book.version == version
+        assert book.get_fresh_price('bitcoin', 300) == 110.0
+    run(scenario())
+
+def test_fresh_only_listeners_skip_old_quotes():
+    async def scenario():
+        aggregator = PriceFeedAggregator(PriceBook(), {}, max_age=300)
+        received = {}
+        async def everything(prices):
+            received['all'] = set(prices)
+        async def fresh(prices):
+            received['fresh'] = set(prices)
+        aggregator.add_listener(everything)
+        aggregator.add_listener(fresh, fresh_only=True)
+
+        await aggregator._publish({
+            'bitcoin': {'price_tmn': 110.0, 'quoted_at': ago(10)},
+            'ethereum': {'price_tmn': 50.0, 'quoted_at': ago(3600)},
+            'tether': {'price_tmn': 1.0},
+        }, 'leader', leader=False)
+        assert received == {'all': {'bitcoin', 'ethereum', 'tether'}, 'fresh': {'bitcoin'}}
+    run(scenario())
+
+def test_positions_from_another_book_are_not_resumed():
+    book, restarted = PriceBook(seed=SEED), PriceBook(seed=SEED)
+    position = book.position()
+    book.publish({'bitcoin': {'price_tmn': 110.0}}, source='aggregated')
+
+    assert book.version_at(position) == 1
+    assert set(book.changes_since(book.version_at(position))) == {'bitcoin'}
+    assert restarted.version_at(position) is None
+    assert book.version_at(f"{book.epoch}.{book.version + 1}") is None
+    assert book.version_at('1') is None and book.version_at(None) is None
+
+def test_unchanged_publish_keeps_the_version():
+    book = PriceBook(seed=SEED)
+    version = book.publish({'bitcoin': {'price_tmn': 110.0, 'last_updated': 't1'}}, source='aggregated')
+
+    assert book.publish({'bitcoin': {'price_tmn': 110.0, 'last_updated': 't1'}}, source='aggregated') == version
+    assert book.changes_since(version) == {}
+    assert book.get_fresh_price('bitcoin', 300) == 110.0
+
+    newer = book.publish({'bitcoin': {'price_tmn': 110.0, 'last_updated': 't2'}}, source='aggregated')
+    assert newer == version + 1
+    assert set(book.changes_since(version)) == {'bitcoin'}
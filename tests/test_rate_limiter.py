@@ -0,0 +1,93 @@
+import asyncio
+
+import fakeredis
+import pytest
+from fakeredis import aioredis as fake_aioredis
+
+import rate_limiter
+from rate_limiter import InMemoryRateLimiter, RedisRateLimiter, create_rate_limiter
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+class Clock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(960_000.0)  # start of a 60s and of a 10s window
+    monkeypatch.setattr(rate_limiter.time, 'time', clock.time)
+    return clock
+
+async def hits(limiter, count, key='ip:1', limit=5, window=60):
+    return [await limiter.hit(key, limit, window) for _ in range(count)]
+
+def make_limiter(backend):
+    return RedisRateLimiter(fake_aioredis.FakeRedis()) if backend == 'redis' else InMemoryRateLimiter()
+
+@pytest.mark.parametrize('backend', ['memory', 'redis'])
+def test_limit_within_a_window(clock, backend):
+    async def scenario():
+        limiter = make_limiter(backend)
+        assert await hits(limiter, 7) == [True] * 5 + [False] * 2
+        # Other keys have their own budget
+        assert await hits(limiter, 1, key='ip:2') == [True]
+    run(scenario())
+
+@pytest.mark.parametrize('backend', ['memory', 'redis'])
+def test_previous_window_is_weighted_by_overlap(clock, backend):
+    async def scenario():
+        limiter = make_limiter(backend)
+        assert await hits(limiter, 5, limit=4) == [True] * 4 + [False]
+
+        # A quarter into the next window 3/4 of the previous 4 hits still count
+        clock.now += 75
+        assert await hits(limiter, 2, limit=4) == [True, False]
+
+        # Two windows later nothing is left
+        clock.now += 120
+        assert await hits(limiter, 4, limit=4) == [True] * 4
+    run(scenario())
+
+def test_redis_limit_is_shared_between_workers(clock):
+    async def scenario():
+        server = fakeredis.FakeServer()
+        first = RedisRateLimiter(fake_aioredis.FakeRedis(server=server))
+        second = RedisRateLimiter(fake_aioredis.FakeRedis(server=server))
+        assert await hits(first, 3) == [True] * 3
+        assert await hits(second, 3) == [True, True, False]
+    run(scenario())
+
+def test_redis_failure_falls_back_to_memory(clock):
+    async def scenario():
+        server = fakeredis.FakeServer()
+        server.connected = False
+        limiter = create_rate_limiter('redis', client=fake_aioredis.FakeRedis(server=server))
+        assert isinstance(limiter, RedisRateLimiter)
+        assert await hits(limiter, 6) == [True] * 5 + [False]
+        assert len(limiter.fallback) == 1
+    run(scenario())
+
+def test_memory_limiter_drops_idle_keys(clock):
+    async def scenario():
+        limiter = InMemoryRateLimiter(sweep_interval=60)
+        await hits(limiter, 1, key='ip:1', window=10)
+        await hits(limiter, 1, key='ip:2', window=10)
+        assert len(limiter) == 2
+
+        clock.now += 61
+        await hits(limiter, 1, key='ip:3', window=10)
+        assert len(limiter) == 1
+    run(scenario())
+
+def test_unconfigured_redis_uses_memory():
+    assert isinstance(create_rate_limiter('redis', redis_url=None), InMemoryRateLimiter)
+    assert isinstance(create_rate_limiter('memory'), InMemoryRateLimiter)
+
+def test_base_limiter_is_abstract():
+    with pytest.raises(TypeError):
+        rate_limiter.RateLimiter()
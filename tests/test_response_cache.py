@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from response_cache import ResponseCache
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_cancelled_leader_does_not_fail_waiters():
+    async def scenario():
+        cache = ResponseCache()
+        release = asyncio.Event()
+        calls = []
+        async def loader():
+            calls.append(1)
+            await release.wait()
+            return {'price': 1}
+
+        leader = asyncio.ensure_future(cache.get_or_set('prices', loader))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(cache.get_or_set('prices', loader))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await waiter == {'price': 1}
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        assert len(calls) == 1
+        assert cache.get('prices') == {'price': 1}
+        assert cache.get_stats()['inflight'] == 0
+    run(scenario())
+
+def test_loader_error_reaches_every_caller():
+    async def scenario():
+        cache = ResponseCache()
+        async def loader():
+            await asyncio.sleep(0)
+            raise ValueError('upstream down')
+
+        results = await asyncio.gather(*(cache.get_or_set('prices', loader) for _ in range(3)),
+                                       return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert cache.get('prices') is None
+        assert cache.get_stats()['coalesced_requests'] == 2
+    run(scenario())
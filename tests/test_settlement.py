@@ -0,0 +1,181 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from db_indexes import INDEXES
+from settlement import PLANS_COLLECTION, PriceUnavailable, SettlementEngine, leg_update, settlement_legs
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+async def make_db():
+    db = AsyncMongoMockClient()['settlement_test']
+    await db.user_holdings.create_indexes(INDEXES['user_holdings'])
+    await db.users.insert_many([
+        {'id': 'u1', 'wallet_balance_tmn': 1000.0},
+        {'id': 'u2', 'wallet_balance_tmn': 0.0},
+    ])
+    await db.user_holdings.insert_one({'id': 'h1', 'user_id': 'u1', 'coin_symbol': 'BTC', 'coin_id': 'bitcoin',
+                                       'amount': 1.0, 'average_buy_price_tmn': 100.0})
+    return db
+
+def order(order_id, order_type='buy', **fields):
+    document = {'id': order_id, 'user_id': 'u1', 'order_type': order_type, 'coin_symbol': 'BTC', 'coin_id': 'bitcoin',
+                'amount_tmn': None, 'amount_crypto': None, 'price_at_order': 300.0, 'status': 'pending',
+                'created_at': datetime.now(timezone.utc)}
+    document.update(fields)
+    return document
+
+async def balance(db, user_id='u1'):
+    return (await db.users.find_one({'id': user_id}))['wallet_balance_tmn']
+
+async def holding(db, symbol='BTC', user_id='u1'):
+    return await db.user_holdings.find_one({'user_id': user_id, 'coin_symbol': symbol})
+
+def test_double_approve_settles_once():
+    async def scenario():
+        db = await make_db()
+        await db.trading_orders.insert_one(order('o1', amount_tmn=300.0))
+        engine = SettlementEngine(db, transactions=False)
+
+        first, second = await asyncio.gather(engine.settle('o1', 'approve'), engine.settle('o1', 'approve'))
+        assert [first is None, second is None].count(True) == 1
+        assert await engine.settle('o1', 'approve') is None
+
+        assert await balance(db) == 700.0
+        assert (await holding(db))['amount'] == pytest.approx(2.0)
+        assert (await db.trading_orders.find_one({'id': 'o1'}))['status'] == 'completed'
+        assert engine.settled == 1 and engine.duplicates == 2
+    run(scenario())
+
+def test_buy_credits_at_weighted_average_price():
+    async def scenario():
+        db = await make_db()
+        await db.trading_orders.insert_many([
+            order('o1', amount_tmn=300.0),
+            order('o2', coin_symbol='ETH', coin_id='ethereum', amount_tmn=100.0, price_at_order=50.0),
+        ])
+        engine = SettlementEngine(db, transactions=False)
+        await engine.settle('o1', 'approve')
+        await engine.settle('o2', 'approve')
+
+        btc = await holding(db)
+        assert btc['amount'] == pytest.approx(2.0)
+        assert btc['average_buy_price_tmn'] == pytest.approx(200.0)
+        eth = await holding(db, 'ETH')
+        assert eth['amount'] == pytest.approx(2.0)
+        assert eth['average_buy_price_tmn'] == pytest.approx(50.0)
+        assert eth['coin_id'] == 'ethereum'
+    run(scenario())
+
+def test_trade_without_target_price_is_not_settled():
+    async def scenario():
+        db = await make_db()
+        trade = order('t1', 'trade', amount_crypto=0.5, target_coin_symbol='ETH', target_coin_id='ethereum')
+        await db.trading_orders.insert_one(trade)
+        engine = SettlementEngine(db, transactions=False)
+
+        with pytest.raises(PriceUnavailable):
+            await engine.settle('t1', 'approve')
+        assert (await db.trading_orders.find_one({'id': 't1'}))['status'] == 'pending'
+        assert (await holding(db))['amount'] == 1.0
+
+        await engine.settle('t1', 'approve', target_price_tmn=50.0)
+        assert (await holding(db))['amount'] == pytest.approx(0.5)
+        assert (await holding(db, 'ETH'))['amount'] == pytest.approx(0.5 * 300.0 / 50.0)
+    run(scenario())
+
+def test_reject_moves_nothing():
+    async def scenario():
+        db = await make_db()
+        await db.trading_orders.insert_one(order('o1', amount_tmn=300.0))
+        settled = await SettlementEngine(db, transactions=False).settle('o1', 'reject', 'no')
+        assert settled['status'] == 'rejected'
+        assert await balance(db) == 1000.0
+    run(scenario())
+
+def test_settle_many_outcomes():
+    async def scenario():
+        db = await make_db()
+        await db.trading_orders.insert_many([
+            order('b1', amount_tmn=300.0),
+            order('b2', amount_tmn=300.0),
+            order('s1', 'sell', user_id='u1', amount_crypto=0.5),
+            order('t1', 'trade', amount_crypto=0.1, target_coin_symbol='ETH', target_coin_id='ethereum'),
+            order('done', amount_tmn=1.0, status='completed'),
+        ])
+        engine = SettlementEngine(db, transactions=False)
+        results = await engine.settle_many(['b1', 'b2', 's1', 't1', 'done', 'missing', 'b1'], 'approve', batch_size=2)
+        outcomes = {result['order_id']: result['outcome'] for result in results}
+
+        assert outcomes == {'b1': 'completed', 'b2': 'completed', 's1': 'completed', 't1': 'price_unavailable',
+                            'done': 'already_processed', 'missing': 'not_found'}
+        assert len(results) == 6
+        assert await balance(db) == pytest.approx(1000.0 - 600.0 + 150.0)
+        assert (await holding(db))['amount'] == pytest.approx(1.0 + 2.0 - 0.5)
+
+        again = await engine.settle_many(['b1', 'b2'], 'approve')
+        assert {result['outcome'] for result in again} == {'already_processed'}
+        assert await balance(db) == pytest.approx(550.0)
+    run(scenario())
+
+def test_settle_many_skips_orders_of_missing_users():
+    async def scenario():
+        db = await make_db()
+        await db.trading_orders.insert_many([order('orphan', user_id='ghost', amount_tmn=300.0), order('b1', amount_tmn=300.0)])
+        results = await SettlementEngine(db, transactions=False).settle_many(['orphan', 'b1', 'missing'], 'approve')
+
+        assert results == [
+            {'order_id': 'orphan', 'outcome': 'user_not_found', 'user_id': 'ghost'},
+            {'order_id': 'b1', 'outcome': 'completed', 'user_id': 'u1'},
+            {'order_id': 'missing', 'outcome': 'not_found', 'user_id': None},
+        ]
+        assert await db.user_holdings.count_documents({'user_id': 'ghost'}) == 0
+        assert (await db.trading_orders.find_one({'id': 'orphan'}))['status'] == 'pending'
+    run(scenario())
+
+def test_recover_replays_interrupted_plan_once():
+    async def scenario():
+        db = await make_db()
+        engine = SettlementEngine(db, transactions=False)
+        past = datetime.now(timezone.utc) - timedelta(hours=1)
+        await db.trading_orders.insert_one(order('o1', amount_tmn=300.0, status='approved', updated_at=past))
+        legs = settlement_legs(order('o1', amount_tmn=300.0), None)
+        plan = await engine._store_plan('o1', legs, [['trading_orders', 'o1', {'status': 'completed'}]], past)
+
+        # Crash after the first leg: only the balance debit is in
+        collection, query, update, upsert = leg_update(legs[0], past, 'o1:0')
+        await db[collection].update_one(query, update, upsert=upsert)
+
+        assert await engine.recover(grace=60) == 1
+        assert await balance(db) == 700.0
+        assert (await holding(db))['amount'] == pytest.approx(2.0)
+        assert (await db.trading_orders.find_one({'id': 'o1'}))['status'] == 'completed'
+        assert (await db[PLANS_COLLECTION].find_one({'_id': plan['_id']}))['status'] == 'applied'
+
+        # A second replay of the same plan changes nothing
+        await db[PLANS_COLLECTION].update_one({'_id': 'o1'}, {'$set': {'status': 'pending'}})
+        await engine.recover(grace=60)
+        assert await balance(db) == 700.0
+        assert (await holding(db))['amount'] == pytest.approx(2.0)
+    run(scenario())
+
+def test_recover_reopens_orders_claimed_without_a_plan():
+    async def scenario():
+        db = await make_db()
+        engine = SettlementEngine(db, transactions=False)
+        past = datetime.now(timezone.utc) - timedelta(hours=1)
+        await db.trading_orders.insert_many([
+            order('old', amount_tmn=300.0, status='approved', updated_at=past),
+            order('fresh', amount_tmn=300.0, status='approved', updated_at=datetime.now(timezone.utc)),
+        ])
+
+        assert await engine.recover(grace=60) == 1
+        assert (await db.trading_orders.find_one({'id': 'old'}))['status'] == 'pending'
+        assert (await db.trading_orders.find_one({'id': 'fresh'}))['status'] == 'approved'
+
+        await engine.settle('old', 'approve')
+        assert await balance(db) == 700.0
+    run(scenario())
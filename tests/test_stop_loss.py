@@ -0,0 +1,109 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import PyMongoError
+
+from db_indexes import INDEXES
+from order_book import MatchingEngine
+from settlement import SettlementEngine
+from stop_loss import StopLossEngine
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+async def make_engine():
+    db = AsyncMongoMockClient()['stop_loss_test']
+    await db.user_holdings.create_indexes(INDEXES['user_holdings'])
+    await db.limit_orders.create_indexes(INDEXES['limit_orders'])
+    await db.user_holdings.insert_one({'id': 'h1', 'user_id': 'u1', 'coin_symbol': 'BTC', 'coin_id': 'bitcoin',
+                                       'amount': 1.0, 'average_buy_price_tmn': 100.0})
+    settlement = SettlementEngine(db, transactions=False)
+    matching_engine = MatchingEngine(db, settlement)
+    await matching_engine.rebuild()
+    return db, StopLossEngine(db, settlement, matching_engine)
+
+def claimed_stop(stop_id, amount):
+    return {'id': stop_id, 'user_id': 'u1', 'coin_symbol': 'BTC', 'coin_id': 'bitcoin', 'amount_crypto': amount,
+            'stop_price_tmn': 90.0, 'limit_price_tmn': 85.0, 'status': 'triggered', 'trigger_price_tmn': 90.0,
+            'order_id': f"{stop_id}-order", 'created_at': datetime.now(timezone.utc)}
+
+async def coins(db):
+    return (await db.user_holdings.find_one({'user_id': 'u1', 'coin_symbol': 'BTC'}))['amount']
+
+def test_stop_limit_reserves_coins_once():
+    async def scenario():
+        db, engine = await make_engine()
+        stop = claimed_stop('s1', 0.4)
+        await db.stop_loss_orders.insert_one(stop.copy())
+
+        # Executed again after a restart: the reservation is not taken twice
+        await engine._execute(stop)
+        await engine._execute(stop)
+        assert await coins(db) == pytest.approx(0.6)
+        order = await db.limit_orders.find_one({'id': 's1-order'})
+        assert order['reserved'] is True and order['order_type'] == 'limit_sell'
+        assert (await db.stop_loss_orders.find_one({'id': 's1'}))['status'] == 'executed'
+        assert engine.matching_engine.books['bitcoin'].depth(10)['asks'] == [[85.0, 0.4]]
+    run(scenario())
+
+def test_stop_limit_without_coins_fails():
+    async def scenario():
+        db, engine = await make_engine()
+        stop = claimed_stop('s1', 2.0)
+        await db.stop_loss_orders.insert_one(stop.copy())
+
+        await engine._execute(stop)
+        assert await coins(db) == 1.0
+        assert await db.limit_orders.count_documents({}) == 0
+        assert (await db.stop_loss_orders.find_one({'id': 's1'}))['status'] == 'failed'
+        assert engine.failed == 1
+    run(scenario())
+
+def test_stop_market_reserves_and_settles_once():
+    async def scenario():
+        db, engine = await make_engine()
+        await db.users.insert_one({'id': 'u1', 'wallet_balance_tmn': 0.0})
+        stop = {**claimed_stop('s1', 0.4), 'limit_price_tmn': None}
+        await db.stop_loss_orders.insert_one(stop.copy())
+
+        await engine._execute(stop)
+        await engine._execute(stop)
+        assert await coins(db) == pytest.approx(0.6)
+        assert (await db.users.find_one({'id': 'u1'}))['wallet_balance_tmn'] == pytest.approx(36.0)
+        order = await db.trading_orders.find_one({'id': 's1-order'})
+        assert order['status'] == 'completed' and order['order_type'] == 'sell'
+        assert await db.trading_orders.count_documents({}) == 1
+    run(scenario())
+
+def test_failed_claim_rearms_stop(monkeypatch):
+    async def scenario():
+        db, engine = await make_engine()
+        stop = {**claimed_stop('s1', 0.4), 'status': 'active'}
+        await db.stop_loss_orders.insert_one(stop.copy())
+        await engine.rebuild()
+
+        async def failing_claim(*args, **kwargs):
+            raise PyMongoError('connection reset')
+        with monkeypatch.context() as patch:
+            patch.setattr(type(db.stop_loss_orders), 'find_one_and_update', failing_claim)
+            await engine.on_prices({'bitcoin': {'price_tmn': 80.0}})
+            await asyncio.gather(*engine._executions)
+        assert engine.get_stats()['armed_stops'] == 1
+        assert (await db.stop_loss_orders.find_one({'id': 's1'}))['status'] == 'active'
+        assert engine.levels['bitcoin'].crossed(80.0) == ['s1']
+    run(scenario())
+
+def test_sync_retries_stops_left_triggered():
+    async def scenario():
+        db, engine = await make_engine()
+        stop = {**claimed_stop('s1', 0.4), 'triggered_at': datetime(2024, 1, 1, tzinfo=timezone.utc)}
+        await db.stop_loss_orders.insert_one(stop.copy())
+        engine._loaded = True
+
+        engine._retried_at -= engine.retry_interval
+        await engine.sync()
+        assert (await db.stop_loss_orders.find_one({'id': 's1'}))['status'] == 'executed'
+        assert engine.get_stats()['retried'] == 1
+    run(scenario())